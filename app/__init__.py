@@ -1,7 +1,7 @@
 import os
 from flask import Flask
 from flask_cors import CORS
-from .db import init_db, close_db, init_db_command, init_master_data_command
+from .db import init_db, close_db, get_db, check_query_plans, init_db_command, init_master_data_command, check_query_plans_command
 
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
@@ -11,6 +11,15 @@ def create_app(test_config=None):
         DATABASE=os.path.join(app.instance_path, 'bonsai_users.db'),
         UPLOAD_FOLDER=os.path.join(app.instance_path, 'uploads'),
         MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 最大16MBのアップロードを許可
+        RECOMMENDATION_CACHE_SIZE=1024,  # 推奨結果キャッシュの最大エントリ数
+        SQLITE_PROFILE='wal',  # 接続ごとのPRAGMA設定（db.SQLITE_PROFILES のキー）
+        DB_POOL_SIZE=10,  # DB接続プールの最大接続数
+        DB_POOL_TIMEOUT=10.0,  # プールが埋まっているときに返却を待つ秒数
+        PAGINATION_MAX_LIMIT=1000,  # 一覧APIの1ページの最大件数（limit未指定時もこの件数まで）
+        QUERY_PLAN_CHECK=True,  # 起動時にホットクエリの全件スキャンを検出したら起動を中止する
+        RAG_CHAT_HISTORY_SIZE=10,  # RAGチャットのセッションごとに保持する発言数
+        RAG_CHAT_MAX_SESSIONS=1000,  # プロセス内で保持するRAGチャットのセッション数の上限
+        RAG_CHAT_SESSION_TTL=3600,  # 最後に使われてから会話履歴を破棄するまでの秒数
     )
     
     if test_config is None:
@@ -46,7 +55,7 @@ def create_app(test_config=None):
              "Access-Control-Request-Method",
              "Access-Control-Request-Headers"
          ],
-         expose_headers=["Content-Type", "Authorization"],
+         expose_headers=["Content-Type", "Authorization", "X-Next-Cursor"],
          methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
          max_age=600,
          vary_header=True,
@@ -57,13 +66,16 @@ def create_app(test_config=None):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
     app.cli.add_command(init_master_data_command)
+    app.cli.add_command(check_query_plans_command)
     
     # 初回起動時にデータベースを初期化
     with app.app_context():
         init_db()
+        if app.config['QUERY_PLAN_CHECK']:
+            check_query_plans(get_db())
 
     # Blueprintの登録
-    from .routes import bonsai, pesticide, recommend, user, other_settings, admin_master, work_log
+    from .routes import bonsai, pesticide, recommend, user, other_settings, admin_master, work_log, rag_chat
     app.register_blueprint(bonsai.bp)
     app.register_blueprint(pesticide.bp)
     app.register_blueprint(recommend.bp)
@@ -71,6 +83,7 @@ def create_app(test_config=None):
     app.register_blueprint(other_settings.bp)
     app.register_blueprint(admin_master.bp)
     app.register_blueprint(work_log.bp)
+    app.register_blueprint(rag_chat.bp)
 
     # デバッグ用：全エンドポイントの一覧表示（開発時のみ）
     if app.debug:
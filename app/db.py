@@ -1,27 +1,193 @@
 import sqlite3
 import os
+import threading
+import time
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 
+# 接続ごとに適用するPRAGMAのプロファイル（設定のSQLITE_PROFILEで選択）
+# - legacy: SQLiteのデフォルトに近い設定（ロールバックジャーナル、書き込み中は読み取りもブロック）
+# - wal: WALモード。読み取りが書き込みにブロックされない。synchronous=NORMALでも
+#        WALではコミット済みデータが壊れることはない（電源断時に直近のコミットが失われる可能性のみ）
+SQLITE_PROFILES = {
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 64 * 1024 * 1024,  # 64MB
+        'cache_size': -16000,  # 負の値はKB単位（約16MB）
+        'busy_timeout': 5000,  # ms
+        'temp_store': 'MEMORY',
+    },
+}
+DEFAULT_SQLITE_PROFILE = 'wal'
+
+_pool_lock = threading.Lock()
+
+def apply_sqlite_profile(conn, profile=DEFAULT_SQLITE_PROFILE):
+    """接続にPRAGMAプロファイルを適用（プロファイル名または設定の辞書を指定）"""
+    if isinstance(profile, str):
+        if profile not in SQLITE_PROFILES:
+            raise ValueError(f"Unknown SQLITE_PROFILE: {profile}")
+        profile = SQLITE_PROFILES[profile]
+
+    for pragma, value in profile.items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
+
+class ConnectionPool:
+    """スレッドセーフなSQLite接続プール
+
+    リクエストごとに acquire() で接続を借り、teardown で release() して返却する。
+    貸し出し前に SELECT 1 で接続の健全性を確認し、壊れた接続は破棄して作り直す。
+    """
+
+    def __init__(self, path, profile=DEFAULT_SQLITE_PROFILE, max_size=10, timeout=10.0):
+        self.path = path
+        self.profile = profile
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._cond = threading.Condition()
+        self.in_use = 0
+        self.creations = 0
+        self.waits = 0
+        self.discarded = 0
+
+    def _connect(self):
+        # 接続はリクエストごとに別スレッドへ貸し出されるため check_same_thread=False
+        conn = sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        apply_sqlite_profile(conn, self.profile)
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """接続を借りる（上限に達している場合は返却を最大timeout秒待つ）"""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if self._is_healthy(conn):
+                        self.in_use += 1
+                        return conn
+                    self.discarded += 1
+                    try:
+                        conn.close()
+                    except sqlite3.Error:
+                        pass
+
+                if self.in_use < self.max_size:
+                    # 接続の作成中も上限を超えないよう先に枠を確保する
+                    self.in_use += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"DB connection pool exhausted ({self.max_size} connections in use)")
+                self.waits += 1
+                self._cond.wait(remaining)
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.creations += 1
+        return conn
+
+    def release(self, conn):
+        """接続を返却（未コミットのトランザクションは破棄する）"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+
+        with self._cond:
+            self.in_use -= 1
+            if healthy:
+                self._idle.append(conn)
+            else:
+                self.discarded += 1
+            self._cond.notify()
+
+    def close_all(self):
+        """待機中の接続をすべて閉じる"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """監視用の統計情報"""
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "creations": self.creations,
+                "waits": self.waits,
+                "discarded": self.discarded
+            }
+
+def get_db_pool(app=None):
+    """アプリに紐づく接続プールを取得（初回はDB_POOL_SIZE / DB_POOL_TIMEOUTに従って作成）"""
+    if app is None:
+        app = current_app._get_current_object()
+
+    pool = app.extensions.get('db_pool')
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get('db_pool')
+            if pool is None:
+                pool = ConnectionPool(
+                    os.path.join(app.instance_path, app.config['DATABASE']),
+                    profile=app.config.get('SQLITE_PROFILE', DEFAULT_SQLITE_PROFILE),
+                    max_size=app.config.get('DB_POOL_SIZE', 10),
+                    timeout=app.config.get('DB_POOL_TIMEOUT', 10.0)
+                )
+                app.extensions['db_pool'] = pool
+    return pool
+
 def get_db(app=None):
     if app is None:
         app = current_app
     
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            os.path.join(app.instance_path, app.config['DATABASE']),
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        pool = get_db_pool(app)
+        g.db = pool.acquire()
+        g.db_pool = pool
     
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
+    pool = g.pop('db_pool', None)
     
     if db is not None:
-        db.close()
+        pool.release(db)
 
 def init_db():
     db = get_db()
@@ -170,6 +336,259 @@ def init_db():
     ''')
     
     db.commit()
+    
+    # インデックス等のスキーマ変更を適用
+    migrate_db(db)
+
+# ========== インデックスとスキーマのマイグレーション ==========
+
+# 管理対象のインデックス（ルートのホットクエリが絞り込み・並び替えに使う列）
+MANAGED_INDEXES = {
+    'idx_pesticide_logs_bonsai_date': 'pesticide_logs (bonsai_id, date)',
+    'idx_work_logs_bonsai_date': 'work_logs (bonsai_id, date)',
+    'idx_bonsai_user': 'bonsai (user_id)',
+    'idx_bonsai_images_bonsai_created': 'bonsai_images (bonsai_id, created_at)',
+    'idx_species_pest_disease_species': 'species_pest_disease (species_id)',
+}
+
+def _create_managed_indexes(db):
+    for name, target in MANAGED_INDEXES.items():
+        db.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+
+# 盆栽の最新画像（作成日時が同じ場合はIDの大きい方）
+LATEST_IMAGE_SUBQUERY = '''
+    SELECT id FROM bonsai_images
+    WHERE bonsai_id = bonsai.id
+    ORDER BY created_at DESC, id DESC LIMIT 1
+'''
+
+def refresh_latest_image_id(db, bonsai_id=None):
+    """bonsai.latest_image_id を bonsai_images から再計算（bonsai_id省略時は全件）
+    
+    コミットは呼び出し側で行う（画像の追加・削除と同じトランザクションで更新するため）
+    """
+    if bonsai_id is None:
+        db.execute(f'UPDATE bonsai SET latest_image_id = ({LATEST_IMAGE_SUBQUERY})')
+    else:
+        db.execute(f'UPDATE bonsai SET latest_image_id = ({LATEST_IMAGE_SUBQUERY}) WHERE id = ?',
+                   (bonsai_id,))
+
+def _add_latest_image_id(db):
+    columns = [row['name'] for row in db.execute('PRAGMA table_info(bonsai)')]
+    if 'latest_image_id' not in columns:
+        db.execute('ALTER TABLE bonsai ADD COLUMN latest_image_id INTEGER')
+    refresh_latest_image_id(db)
+
+# 管理対象のトリガー（アプリ以外の書き込み（options/ のスクリプト・別のワーカープロセス）も
+# 同じトランザクションで反映するため、キャッシュの鍵になるバージョンはトリガーで更新する）
+
+# 盆栽ごとの農薬記録のバージョン（推奨結果のキャッシュキーに使う）
+PESTICIDE_LOG_VERSION_TRIGGERS = {
+    'trg_pesticide_logs_insert_version': '''
+        AFTER INSERT ON pesticide_logs BEGIN
+            UPDATE bonsai SET pesticide_log_version = pesticide_log_version + 1 WHERE id = NEW.bonsai_id;
+        END
+    ''',
+    'trg_pesticide_logs_update_version': '''
+        AFTER UPDATE ON pesticide_logs BEGIN
+            UPDATE bonsai SET pesticide_log_version = pesticide_log_version + 1
+            WHERE id IN (OLD.bonsai_id, NEW.bonsai_id);
+        END
+    ''',
+    'trg_pesticide_logs_delete_version': '''
+        AFTER DELETE ON pesticide_logs BEGIN
+            UPDATE bonsai SET pesticide_log_version = pesticide_log_version + 1 WHERE id = OLD.bonsai_id;
+        END
+    ''',
+}
+
+# 推奨エンジンのマスタテーブル（master_snapshot.py がメモリに読み込む）
+MASTER_TABLES = (
+    'pesticide_master',
+    'pest_disease_master',
+    'pesticide_effectiveness',
+    'species_pest_disease',
+    'species_prohibited_pesticides',
+)
+
+# マスタのバージョン（マスタテーブルの行が変わるたびにトリガーで1ずつ増える）。
+# 各ワーカープロセスはスナップショットを作ったときの値と比べ、変わっていれば作り直す
+MASTER_VERSION_TRIGGERS = {
+    f'trg_{table}_{event.lower()}_master_version': f'''
+        AFTER {event} ON {table} BEGIN
+            UPDATE master_version SET version = version + 1 WHERE id = 1;
+        END
+    '''
+    for table in MASTER_TABLES
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+}
+
+MANAGED_TRIGGERS = {**PESTICIDE_LOG_VERSION_TRIGGERS, **MASTER_VERSION_TRIGGERS}
+
+def get_master_version(db):
+    """マスタのバージョン（別のプロセス・optionsのスクリプトでの更新も反映される）"""
+    return db.execute('SELECT version FROM master_version WHERE id = 1').fetchone()[0]
+
+def _create_managed_triggers(db, triggers=MANAGED_TRIGGERS):
+    for name, body in triggers.items():
+        db.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+def _add_pesticide_log_version(db):
+    columns = [row['name'] for row in db.execute('PRAGMA table_info(bonsai)')]
+    if 'pesticide_log_version' not in columns:
+        db.execute('ALTER TABLE bonsai ADD COLUMN pesticide_log_version INTEGER NOT NULL DEFAULT 0')
+    _create_managed_triggers(db, PESTICIDE_LOG_VERSION_TRIGGERS)
+
+def _add_master_version(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS master_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    db.execute('INSERT OR IGNORE INTO master_version (id, version) VALUES (1, 0)')
+    _create_managed_triggers(db, MASTER_VERSION_TRIGGERS)
+
+# (バージョン, 説明, 適用関数)。PRAGMA user_version に適用済みのバージョンを記録する
+MIGRATIONS = [
+    (1, 'ホットクエリ用のインデックスを追加', _create_managed_indexes),
+    (2, '盆栽に最新画像ID（latest_image_id）を追加', _add_latest_image_id),
+    (3, '盆栽に農薬記録のバージョン（pesticide_log_version）を追加', _add_pesticide_log_version),
+    (4, 'マスタのバージョン（master_version）を追加', _add_master_version),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate_db(db):
+    """未適用のマイグレーションを順番に適用する"""
+    current_version = db.execute('PRAGMA user_version').fetchone()[0]
+    
+    for version, description, apply in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            apply(db)
+            # PRAGMAはパラメータを使えないため整数を直接埋め込む
+            db.execute(f'PRAGMA user_version = {int(version)}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        click.echo(f'Applied schema migration {version}: {description}')
+    
+    # 手動で削除されたインデックス・トリガーも復元しておく
+    _create_managed_indexes(db)
+    _create_managed_triggers(db)
+    db.commit()
+
+# ========== クエリプランのチェック ==========
+
+# アプリケーションのホットクエリ（全件スキャンになってはいけないもの）
+HOT_QUERIES = {
+    'bonsai_by_user': '''
+        SELECT * FROM (SELECT * FROM bonsai WHERE user_id = ?)
+        WHERE (id) > (?) ORDER BY id ASC LIMIT ?
+    ''',
+    # 一覧APIはキーセットページネーション（pagination.paginate）の形で発行される
+    'pesticide_logs_by_bonsai': '''
+        SELECT * FROM (SELECT * FROM pesticide_logs WHERE bonsai_id = ?)
+        WHERE (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?
+    ''',
+    'latest_pesticide_log': 'SELECT * FROM pesticide_logs WHERE bonsai_id = ? ORDER BY date DESC LIMIT 1',
+    'pesticide_history': '''
+        SELECT bonsai_id, pesticide_name, date FROM pesticide_logs
+        WHERE bonsai_id IN (?) AND date >= ?
+        ORDER BY bonsai_id, date DESC
+    ''',
+    'user_pesticide_history': '''
+        SELECT bonsai_id, pesticide_name, date FROM pesticide_logs
+        WHERE bonsai_id IN (SELECT id FROM bonsai WHERE user_id = ?) AND date >= ?
+        ORDER BY bonsai_id, date DESC
+    ''',
+    'user_latest_pesticide_logs': '''
+        SELECT * FROM (
+            SELECT pl.*, ROW_NUMBER() OVER (
+                PARTITION BY pl.bonsai_id ORDER BY pl.date DESC, pl.id DESC
+            ) AS row_rank
+            FROM pesticide_logs pl
+            WHERE pl.bonsai_id IN (SELECT id FROM bonsai WHERE user_id = ?)
+        )
+        WHERE row_rank = 1
+    ''',
+    'user_pesticide_logs': '''
+        SELECT * FROM (
+            SELECT pl.*, b.name as bonsai_name
+            FROM pesticide_logs pl
+            JOIN bonsai b ON pl.bonsai_id = b.id
+            WHERE pl.bonsai_id IN (?)
+        )
+        WHERE (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?
+    ''',
+    'work_logs_by_bonsai': '''
+        SELECT * FROM (SELECT * FROM work_logs WHERE bonsai_id = ?)
+        WHERE (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?
+    ''',
+    'user_work_logs': '''
+        SELECT * FROM (
+            SELECT wl.*, b.name as bonsai_name
+            FROM work_logs wl
+            JOIN bonsai b ON wl.bonsai_id = b.id
+            WHERE wl.bonsai_id IN (?)
+        )
+        WHERE (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?
+    ''',
+    'refresh_latest_image': f'UPDATE bonsai SET latest_image_id = ({LATEST_IMAGE_SUBQUERY}) WHERE id = ?',
+    'bonsai_images': 'SELECT * FROM bonsai_images WHERE bonsai_id = ? ORDER BY created_at DESC',
+    'species_risks': '''
+        SELECT spd.*, pdm.name as pest_disease_name
+        FROM species_pest_disease spd
+        JOIN pest_disease_master pdm ON spd.pest_disease_id = pdm.id
+        WHERE spd.species_id = ?
+    ''',
+    'user_by_name': 'SELECT password_hash, id FROM users WHERE username = ?',
+    'user_role': 'SELECT role FROM users WHERE id = ?',
+}
+
+def find_full_table_scans(db, queries=None):
+    """EXPLAIN QUERY PLAN でテーブルの全件スキャンを含むクエリを探す
+    
+    Returns:
+        {クエリ名: [全件スキャンのプラン行, ...]}
+    """
+    if queries is None:
+        queries = HOT_QUERIES
+    
+    problems = {}
+    for name, query in queries.items():
+        params = [None] * query.count('?')
+        plan = db.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()
+        scans = []
+        for row in plan:
+            detail = row[3]
+            # 例: "SCAN bonsai" / "SCAN TABLE bonsai"（古いSQLite）。サブクエリの走査は対象外
+            if detail.startswith('SCAN ') and not detail.startswith(('SCAN (', 'SCAN CONSTANT ROW', 'SCAN SUBQUERY')):
+                scans.append(detail)
+        if scans:
+            problems[name] = scans
+    return problems
+
+def check_query_plans(db):
+    """ホットクエリが全件スキャンになっていれば例外を送出する（起動時チェック）"""
+    problems = find_full_table_scans(db)
+    if problems:
+        details = '; '.join(f"{name}: {', '.join(scans)}" for name, scans in problems.items())
+        raise RuntimeError(f'Full table scan detected in hot queries: {details}')
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Run EXPLAIN QUERY PLAN over the hot queries and report full table scans."""
+    problems = find_full_table_scans(get_db())
+    if problems:
+        for name, scans in problems.items():
+            click.echo(f'NG {name}: {", ".join(scans)}')
+        raise click.ClickException('Full table scan detected.')
+    click.echo(f'All {len(HOT_QUERIES)} hot queries use indexes (schema version {SCHEMA_VERSION}).')
 
 @click.command('init-db')
 @with_appcontext
@@ -0,0 +1,334 @@
+"""マスタデータのインメモリスナップショット
+
+推奨エンジンが参照するマスタテーブル（species_pest_disease, pest_disease_master,
+pesticide_effectiveness, pesticide_master, species_prohibited_pesticides）を一括で読み込み、
+インデックスを事前計算した不変オブジェクトとして保持する。
+
+管理者API（admin_master.py）での更新時は新しいスナップショットを構築して丸ごと差し替える。
+読み取り側は差し替え前後のどちらか一方の完全なスナップショットだけを見ることになる。
+スナップショットはプロセスごとに保持されるため、取得のたびにDBのマスタのバージョン
+（master_version。マスタテーブルのトリガーで更新）と比べ、別のワーカープロセスや
+optionsのスクリプトでマスタが更新されていれば作り直す。
+"""
+import itertools
+import threading
+from datetime import datetime
+from types import MappingProxyType
+
+from flask import current_app
+from .db import get_db, get_master_version
+
+EXTENSION_KEY = 'master_snapshot'
+
+_version_counter = itertools.count(1)
+_swap_lock = threading.Lock()
+
+
+def is_month_in_range(target_month, start_month, end_month):
+    """指定月が月範囲内にあるかチェック（年をまたぐ場合も対応）"""
+    if start_month <= end_month:
+        # 通常の範囲（例: 3月-6月）
+        return start_month <= target_month <= end_month
+    else:
+        # 年をまたぐ範囲（例: 12月-2月）
+        return target_month >= start_month or target_month <= end_month
+
+
+def get_month_season(month):
+    """指定された月の季節を取得（互換性のため残存）"""
+    if month in [3, 4, 5]:
+        return "春"
+    elif month in [6, 7, 8]:
+        return "夏"
+    elif month in [9, 10, 11]:
+        return "秋"
+    else:
+        return "冬"
+
+
+def is_risk_in_month(risk, target_month):
+    """リスク行が指定月に該当するか（月データ優先、なければ季節ベースをフォールバック）"""
+    # 月ベースデータをチェック
+    start_month = risk.get('start_month')
+    end_month = risk.get('end_month')
+    if start_month and end_month and is_month_in_range(target_month, start_month, end_month):
+        return True
+
+    # フォールバック: 季節ベースデータをチェック
+    season = risk.get('pest_disease_season') or risk.get('season')
+    if season:
+        return (season == "通年" or
+                season == get_month_season(target_month) or
+                (season == "梅雨" and target_month == 6))
+    return False
+
+
+def risk_month_mask(risk):
+    """リスク行が該当する月のビットマスク（bit0 = 1月 … bit11 = 12月）"""
+    mask = 0
+    for month in range(1, 13):
+        if is_risk_in_month(risk, month):
+            mask |= 1 << (month - 1)
+    return mask
+
+
+class MasterSnapshot:
+    """インデックス付きのマスタデータスナップショット（不変）
+
+    species_month_risks は 樹種 → 12か月分のリスク一覧 の事前計算表で、
+    「樹種Sの M 月のリスク」を辞書参照だけで引けるようにしている。
+    """
+
+    __slots__ = (
+        'version',
+        'db_version',
+        'built_at',
+        'pesticides_by_type',
+        'pesticide_types',
+        'species_risks',
+        'species_month_risks',
+        'pest_pesticides',
+        'species_prohibitions',
+    )
+
+    def __init__(self, version, db_version, pesticides_by_type, pesticide_types, species_risks,
+                 species_month_risks, pest_pesticides, species_prohibitions):
+        set_attr = object.__setattr__
+        set_attr(self, 'version', version)
+        set_attr(self, 'db_version', db_version)
+        set_attr(self, 'built_at', datetime.now())
+        set_attr(self, 'pesticides_by_type', pesticides_by_type)
+        set_attr(self, 'pesticide_types', pesticide_types)
+        set_attr(self, 'species_risks', species_risks)
+        set_attr(self, 'species_month_risks', species_month_risks)
+        set_attr(self, 'pest_pesticides', pest_pesticides)
+        set_attr(self, 'species_prohibitions', species_prohibitions)
+
+    @classmethod
+    def build(cls, version, db_version, pesticides, risks, effectiveness, prohibitions):
+        """マスタテーブルの行からインデックスを構築"""
+        # 農薬タイプ別（散布間隔の短い順）
+        by_type = {}
+        for pesticide in pesticides:
+            by_type.setdefault(pesticide['type'], []).append(pesticide)
+
+        # 樹種 → リスク（発生確率の高い順）
+        species_risks = {}
+        for risk in risks:
+            species_risks.setdefault(risk['species_id'], []).append(risk)
+        species_risks = _freeze_index(species_risks)
+
+        # 害虫・病気 → 農薬（効果レベル・農薬情報付き）
+        pest_pesticides = {}
+        for row in effectiveness:
+            pest_pesticides.setdefault(row['pest_disease_id'], []).append(row)
+
+        # 樹種 → 禁止・警告農薬
+        species_prohibitions = {}
+        for row in prohibitions:
+            species_prohibitions.setdefault(row['species_id'], []).append(row)
+
+        return cls(
+            version=version,
+            db_version=db_version,
+            pesticides_by_type=_freeze_index(by_type),
+            pesticide_types=MappingProxyType({p['name']: p['type'] for p in pesticides}),
+            species_risks=species_risks,
+            species_month_risks=MappingProxyType({
+                species_id: _build_month_table(rows)
+                for species_id, rows in species_risks.items()
+            }),
+            pest_pesticides=_freeze_index(pest_pesticides),
+            species_prohibitions=_freeze_index(species_prohibitions),
+        )
+
+    def with_species_risks(self, version, db_version, species_id, risks):
+        """指定樹種のリスクだけを差し替えた新しいスナップショットを返す（他の樹種の表は共有）"""
+        species_risks = dict(self.species_risks)
+        species_month_risks = dict(self.species_month_risks)
+        if risks:
+            rows = tuple(MappingProxyType(r) for r in risks)
+            species_risks[species_id] = rows
+            species_month_risks[species_id] = _build_month_table(rows)
+        else:
+            species_risks.pop(species_id, None)
+            species_month_risks.pop(species_id, None)
+
+        return MasterSnapshot(
+            version=version,
+            db_version=db_version,
+            pesticides_by_type=self.pesticides_by_type,
+            pesticide_types=self.pesticide_types,
+            species_risks=MappingProxyType(species_risks),
+            species_month_risks=MappingProxyType(species_month_risks),
+            pest_pesticides=self.pest_pesticides,
+            species_prohibitions=self.species_prohibitions,
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError('MasterSnapshot is immutable')
+
+    def risks_for_species(self, species_id):
+        """樹種の害虫・病気リスクを取得（発生確率の高い順）"""
+        return [dict(r) for r in self.species_risks.get(species_id, ())]
+
+    def risks_for_month(self, species_id, month):
+        """樹種の指定月（1-12）のリスクを取得（事前計算表から参照）"""
+        month_table = self.species_month_risks.get(species_id)
+        if month_table is None:
+            return []
+        return [dict(r) for r in month_table[month - 1]]
+
+    def prohibitions_for_species(self, species_id):
+        """樹種に対する禁止・警告農薬を取得"""
+        return [dict(p) for p in self.species_prohibitions.get(species_id, ())]
+
+    def pesticides_of_type(self, pesticide_type, limit=None):
+        """指定タイプの農薬を散布間隔の短い順に取得"""
+        pesticides = self.pesticides_by_type.get(pesticide_type, ())
+        if limit is not None:
+            pesticides = pesticides[:limit]
+        return [dict(p) for p in pesticides]
+
+    def effective_pesticides(self, pest_disease_ids, pesticide_type=None):
+        """指定された害虫・病気に効果的な農薬を取得
+
+        pesticide_effectiveness を農薬ごとに集計したSQL
+        （GROUP BY pe.pesticide_id / ORDER BY avg_effectiveness DESC, interval_days ASC）
+        と同じ形の辞書リストを返す。
+        """
+        groups = {}
+        for pest_disease_id in set(pest_disease_ids):
+            for row in self.pest_pesticides.get(pest_disease_id, ()):
+                if pesticide_type is not None and row['pesticide_type'] != pesticide_type:
+                    continue
+                groups.setdefault(row['pesticide_id'], []).append(row)
+
+        pesticides = []
+        for pesticide_id in sorted(groups):
+            rows = sorted(groups[pesticide_id], key=lambda r: r['id'])
+            pesticide = dict(rows[0])
+            pesticide['avg_effectiveness'] = sum(r['effectiveness_level'] for r in rows) / len(rows)
+            pesticides.append(pesticide)
+
+        pesticides.sort(key=lambda p: (-p['avg_effectiveness'], p['interval_days']))
+        return pesticides
+
+
+def _freeze_index(index):
+    """{key: [row, ...]} を読み取り専用の {key: (row, ...)} に変換"""
+    return MappingProxyType({
+        key: tuple(MappingProxyType(row) for row in rows)
+        for key, rows in index.items()
+    })
+
+
+def _build_month_table(risks):
+    """リスク行から 12か月分（1月〜12月）のリスク一覧を作成（各月は発生確率の高い順）"""
+    masks = [(risk, risk_month_mask(risk)) for risk in risks]
+    return tuple(
+        tuple(risk for risk, mask in masks if mask & (1 << (month - 1)))
+        for month in range(1, 13)
+    )
+
+
+RISKS_QUERY = '''
+    SELECT spd.*, pdm.name as pest_disease_name, pdm.type as pest_disease_type,
+           pdm.start_month, pdm.end_month, pdm.season as pest_disease_season,
+           pdm.description as pest_disease_description
+    FROM species_pest_disease spd
+    JOIN pest_disease_master pdm ON spd.pest_disease_id = pdm.id
+    {where}
+    ORDER BY spd.occurrence_probability DESC, pdm.type DESC, spd.id ASC
+'''
+
+
+def load_master_snapshot(db):
+    """DBからマスタテーブルを読み込んでスナップショットを構築"""
+    # バージョンはテーブルより先に読む（読み込み中に更新されても次回の取得で作り直す）
+    db_version = get_master_version(db)
+    pesticides = db.execute('''
+        SELECT * FROM pesticide_master
+        ORDER BY interval_days ASC, id ASC
+    ''').fetchall()
+
+    risks = db.execute(RISKS_QUERY.format(where='')).fetchall()
+
+    effectiveness = db.execute('''
+        SELECT pe.*, pm.name as pesticide_name, pm.type as pesticide_type,
+               pm.interval_days, pm.active_ingredient, pm.description
+        FROM pesticide_effectiveness pe
+        JOIN pesticide_master pm ON pe.pesticide_id = pm.id
+        ORDER BY pe.id ASC
+    ''').fetchall()
+
+    prohibitions = db.execute('''
+        SELECT spp.*, pm.name as pesticide_name
+        FROM species_prohibited_pesticides spp
+        JOIN pesticide_master pm ON spp.pesticide_id = pm.id
+        ORDER BY spp.id ASC
+    ''').fetchall()
+
+    return MasterSnapshot.build(
+        version=next(_version_counter),
+        db_version=db_version,
+        pesticides=[dict(p) for p in pesticides],
+        risks=[dict(r) for r in risks],
+        effectiveness=[dict(e) for e in effectiveness],
+        prohibitions=[dict(p) for p in prohibitions],
+    )
+
+
+def refresh_master_snapshot(db=None, app=None):
+    """スナップショットを再構築して差し替える（管理者APIの更新後に呼び出す）"""
+    if app is None:
+        app = current_app._get_current_object()
+    if db is None:
+        db = get_db(app)
+
+    with _swap_lock:
+        snapshot = load_master_snapshot(db)
+        app.extensions[EXTENSION_KEY] = snapshot
+
+    app.logger.info(f"マスタデータのスナップショットを更新しました (version={snapshot.version})")
+    return snapshot
+
+
+def refresh_species_risks(species_id, db=None, app=None):
+    """指定樹種のリスク表だけを再計算して差し替える（樹種別リスクの追加・削除後に呼び出す）"""
+    if app is None:
+        app = current_app._get_current_object()
+    if db is None:
+        db = get_db(app)
+    species_id = int(species_id)
+
+    with _swap_lock:
+        current = app.extensions.get(EXTENSION_KEY)
+        db_version = get_master_version(db)
+        # 前回からの更新がこの1行だけの場合に限り差分で更新する（他のプロセスの更新も含む場合は作り直す）
+        if current is None or db_version != current.db_version + 1:
+            snapshot = load_master_snapshot(db)
+        else:
+            risks = db.execute(
+                RISKS_QUERY.format(where='WHERE spd.species_id = ?'), (species_id,)
+            ).fetchall()
+            snapshot = current.with_species_risks(
+                next(_version_counter), db_version, species_id, [dict(r) for r in risks]
+            )
+        app.extensions[EXTENSION_KEY] = snapshot
+
+    app.logger.info(f"樹種ID {species_id} のリスク表を更新しました (version={snapshot.version})")
+    return snapshot
+
+
+def get_master_snapshot(db=None, app=None):
+    """現在のスナップショットを取得（未構築の場合・DBのマスタが更新されている場合はその場で構築）"""
+    if app is None:
+        app = current_app._get_current_object()
+    if db is None:
+        db = get_db(app)
+
+    snapshot = app.extensions.get(EXTENSION_KEY)
+    if snapshot is None or snapshot.db_version != get_master_version(db):
+        snapshot = refresh_master_snapshot(db, app)
+    return snapshot
@@ -0,0 +1,106 @@
+"""一覧APIのカーソル（キーセット）ページネーション
+
+一覧系のエンドポイントはレスポンスをJSON配列のまま返し、続きがある場合は
+レスポンスヘッダ X-Next-Cursor に次ページのカーソルを付与する。
+クライアントは ?cursor=<X-Next-Cursor の値>&limit=<件数> で続きを取得する。
+
+- 並び順は必ず一意なキーで終わる（例: date DESC, id DESC）ため、ページの境界で
+  行が重複・欠落しない。OFFSETを使わないので深いページでも取得コストは一定
+- カーソルは並びキーの値をbase64化した不透明なトークン。一覧ごとのスコープ
+  （対象の盆栽・ユーザーIDを含む）を持つため、別の一覧のカーソルを渡すとエラーになる
+- limit を指定しない既存クライアントには PAGINATION_MAX_LIMIT 件まで返す
+"""
+import base64
+import json
+
+from flask import current_app, jsonify, request
+
+DEFAULT_MAX_LIMIT = 1000
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class InvalidPageRequest(ValueError):
+    """cursor / limit パラメータが不正"""
+
+
+def encode_cursor(scope, values):
+    """並びキーの値から次ページ用のカーソルを作成"""
+    payload = json.dumps({"s": scope, "k": list(values)}, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, scope, key_count):
+    """カーソルを並びキーの値に戻す（不正なカーソルは InvalidPageRequest）"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        values = payload['k']
+        valid = payload['s'] == scope and isinstance(values, list) and len(values) == key_count
+    except (ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        raise InvalidPageRequest("無効なカーソルです")
+    return values
+
+
+def get_page_args():
+    """リクエストから (cursor, limit) を取得（limitは PAGINATION_MAX_LIMIT で頭打ち）"""
+    max_limit = current_app.config.get('PAGINATION_MAX_LIMIT', DEFAULT_MAX_LIMIT)
+    limit = request.args.get('limit')
+    if limit is None:
+        limit = max_limit
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InvalidPageRequest("limitは整数で指定してください")
+        if limit < 1:
+            raise InvalidPageRequest("limitは1以上で指定してください")
+        limit = min(limit, max_limit)
+    return request.args.get('cursor') or None, limit
+
+
+def paginate(db, query, params, sort_keys, scope, descending=False):
+    """クエリ結果の1ページ分と次ページのカーソルを取得
+
+    Args:
+        query: ORDER BY を含まないSELECT文（サブクエリとして包んで並べ替える）
+        sort_keys: 並びキーとなる結果列名。最後は一意な列（id）にすること。
+                   NOT NULL の列のみ指定できる（行値比較でNULLは比較できないため）
+        scope: カーソルの使い回しを防ぐための一覧の識別子
+        descending: すべてのキーを降順で並べる場合はTrue
+
+    Returns:
+        (rows, next_cursor)  続きがない場合 next_cursor は None
+    """
+    cursor, limit = get_page_args()
+    direction, comparison = ('DESC', '<') if descending else ('ASC', '>')
+    keys = ', '.join(sort_keys)
+    order_by = ', '.join(f'{key} {direction}' for key in sort_keys)
+
+    where = ''
+    params = list(params)
+    if cursor is not None:
+        values = decode_cursor(cursor, scope, len(sort_keys))
+        where = f"WHERE ({keys}) {comparison} ({', '.join(['?'] * len(values))})"
+        params.extend(values)
+
+    # 1件多く取得して次ページの有無を判定する
+    rows = db.execute(
+        f'SELECT * FROM ({query}) {where} ORDER BY {order_by} LIMIT ?',
+        params + [limit + 1]
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(scope, [rows[-1][key] for key in sort_keys])
+    return rows, next_cursor
+
+
+def paginated_response(items, next_cursor):
+    """JSON配列のレスポンスを作成し、続きがあれば X-Next-Cursor ヘッダを付与"""
+    response = jsonify(items)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
@@ -0,0 +1,136 @@
+# チャンクの埋め込みをバッチ化・並列化してベクトルストアに書き込む
+import random
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import tiktoken
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+EMBED_BATCH_SIZE = 64  # 1回の埋め込みAPI呼び出しで送るチャンク数
+EMBED_CONCURRENCY = 4  # 同時に実行する埋め込みAPI呼び出しの数
+PENDING_BATCHES_PER_WORKER = 2  # 埋め込み中・書き込み待ちのバッチの上限（EMBED_CONCURRENCYあたり）
+MAX_RETRIES = 5
+BASE_DELAY = 1.0  # 秒（リトライごとに2倍）
+
+# レート制限・一時的な障害のみリトライする
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+
+def call_with_retry(func, *args, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, **kwargs):
+    """
+    一時的なエラーの場合は指数バックオフ（ジッター付き）でリトライする
+
+    :param func: 呼び出す関数
+    :param max_retries: 最大リトライ回数
+    :param base_delay: 最初の待ち時間（秒）
+    :return: funcの戻り値
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+            print(f"  {type(e).__name__}: {delay:.1f}秒後にリトライします ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+def iter_batches(items, batch_size):
+    """リスト・ジェネレータなどをbatch_size件ずつのリストに分ける"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class IngestStats:
+    """埋め込み処理のスループットを集計する"""
+
+    def __init__(self, model="text-embedding-ada-002"):
+        self.encoding = tiktoken.encoding_for_model(model)
+        self.chunks = 0
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def add(self, texts, seconds=0.0):
+        self.chunks += len(texts)
+        self.tokens += sum(len(self.encoding.encode(text)) for text in texts)
+        self.seconds += seconds
+
+    def report(self):
+        if self.seconds == 0:
+            return f"埋め込み: {self.chunks} chunks, {self.tokens} tokens"
+        return (
+            f"埋め込み: {self.chunks} chunks, {self.tokens} tokens, {self.seconds:.1f}秒 "
+            f"({self.chunks / self.seconds:.1f} chunks/s, {self.tokens / self.seconds:.0f} tokens/s)"
+        )
+
+
+def write_batch(vectorstore, documents, vectors):
+    """埋め込み済みのドキュメントをChromaに書き込む（add_textsと同じくIDはuuid）"""
+    vectorstore._collection.upsert(
+        ids=[str(uuid.uuid4()) for _ in documents],
+        embeddings=vectors,
+        documents=[doc.page_content for doc in documents],
+        metadatas=[doc.metadata for doc in documents],
+    )
+
+
+def add_documents_batched(
+    vectorstore,
+    embeddings,
+    documents,
+    batch_size=EMBED_BATCH_SIZE,
+    concurrency=EMBED_CONCURRENCY,
+    stats=None,
+    on_written=None,
+):
+    """
+    ドキュメントをバッチ単位で並列に埋め込み、ベクトルストアに書き込む
+    埋め込みAPIの呼び出しは最大concurrency件まで同時に行い、
+    Chromaへの書き込みは呼び出し元のスレッドだけでバッチの順番通りに行う
+
+    :param vectorstore: 書き込み先のChroma
+    :param embeddings: OpenAIEmbeddings
+    :param documents: Documentのリストまたはイテラブル（ジェネレータの場合は埋め込みの進み具合に合わせて読み進める）
+    :param stats: IngestStats（スループットを集計する場合）
+    :param on_written: Chromaに書き込んだバッチ（Documentのリスト）ごとに呼び出す関数
+    :return: 書き込んだドキュメントの数
+
+    埋め込み中・書き込み待ちのバッチは最大 concurrency * PENDING_BATCHES_PER_WORKER 件で、
+    文書が多くても埋め込みベクトルをすべてメモリに溜めない
+    """
+    start = time.time()
+    written = 0
+    pending = deque()
+    max_pending = concurrency * PENDING_BATCHES_PER_WORKER
+
+    def write_oldest():
+        nonlocal written
+        batch, future = pending.popleft()
+        write_batch(vectorstore, batch, future.result())
+        written += len(batch)
+        if stats is not None:
+            stats.add([doc.page_content for doc in batch])
+        if on_written is not None:
+            on_written(batch)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch in iter_batches(documents, batch_size):
+            pending.append(
+                (batch, executor.submit(call_with_retry, embeddings.embed_documents, [doc.page_content for doc in batch]))
+            )
+            if len(pending) >= max_pending:
+                write_oldest()
+        while pending:
+            write_oldest()
+
+    if stats is not None and written:
+        stats.seconds += time.time() - start
+    return written
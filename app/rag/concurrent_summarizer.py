@@ -0,0 +1,87 @@
+# 画像・表チャンクの要約を並列に実行する
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+
+SUMMARY_CONCURRENCY = 4  # 同時に実行する要約リクエストの数
+SUMMARY_TIMEOUT = 120  # 1リクエストあたりのタイムアウト（秒）
+
+
+class SummaryTimeout(Exception):
+    pass
+
+
+class StubVisionModel:
+    """
+    ローカル検証用の要約モデル（APIを呼ばずに固定の要約を返す）
+    ChatOpenAIと同じく invoke(messages) で .content を持つオブジェクトを返す
+    """
+
+    def __init__(self, delay=0.0, fail_every=0):
+        """
+        :param delay: 1回の呼び出しにかかる秒数（遅延のシミュレーション）
+        :param fail_every: n回に1回例外を送出する（0の場合は失敗しない）
+        """
+        self.delay = delay
+        self.fail_every = fail_every
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages):
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_every and call_number % self.fail_every == 0:
+            raise RuntimeError(f"stub failure (call {call_number})")
+        prompt = messages[0].content[0]["text"]
+        return SimpleNamespace(content=f"[stub summary #{call_number}] {prompt[:40]}")
+
+
+def summarize_concurrently(items, summarize, max_workers=SUMMARY_CONCURRENCY, timeout=SUMMARY_TIMEOUT):
+    """
+    itemsの各要素にsummarizeを並列に適用し、入力と同じ順番で結果を返す
+    1件が失敗・タイムアウトしても他の要素の処理は続行する
+
+    :param items: 要約対象のリスト
+    :param summarize: 1件を要約する関数（item -> str）
+    :param max_workers: 同時実行数
+    :param timeout: 1件あたりのタイムアウト（秒）。実行開始からの経過時間で判定する
+    :return: [(summary, error), ...]  成功時はerrorがNone、失敗時はsummaryがNone
+    """
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    started_at = {}
+
+    def run(index, item):
+        started_at[index] = time.monotonic()
+        return summarize(item)
+
+    # タイムアウトしたリクエストのスレッドは止められないため、待たずにプールを閉じる
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending = {executor.submit(run, i, item): i for i, item in enumerate(items)}
+        while pending:
+            done, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    results[index] = (future.result(), None)
+                except Exception as e:
+                    results[index] = (None, e)
+
+            now = time.monotonic()
+            for future, index in list(pending.items()):
+                start = started_at.get(index)
+                if start is not None and now - start > timeout:
+                    future.cancel()
+                    del pending[future]
+                    results[index] = (None, SummaryTimeout(f"{timeout}秒以内に要約が返りませんでした"))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
@@ -1,6 +1,9 @@
+import json
 import os
 import time
 import warnings
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 
 from dotenv import load_dotenv
 from langchain.schema.document import Document
@@ -11,6 +14,22 @@ from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from unstructured.partition.pdf import partition_pdf
 from google.cloud import documentai
 import pdf_chunking
+from batch_embedding import (
+    EMBED_BATCH_SIZE,
+    EMBED_CONCURRENCY,
+    IngestStats,
+    add_documents_batched,
+)
+from concurrent_summarizer import (
+    SUMMARY_CONCURRENCY,
+    SUMMARY_TIMEOUT,
+    StubVisionModel,
+    summarize_concurrently,
+)
+from ingest_cache import CachedEmbeddings, IngestCache
+from ingest_state import KEYWORD_INDEX_REBUILD, LEGACY, IngestState, file_hash
+from keyword_index import INDEX_PATH as KEYWORD_INDEX_PATH, append_documents, rebuild_index
+from ocr_client import OCR_CONCURRENCY, OCRCache, OCRClient, ReplayDocumentAIClient
 
 load_dotenv(dotenv_path="/home/fujikawa/jinshari/flask-bonsai/.env.local")
 # 環境変数の設定
@@ -20,12 +39,40 @@ FOLDER_PATH = "/home/fujikawa/jinshari/flask-bonsai/data/input/"
 PROCESSED_FILES_TXT = "/home/fujikawa/jinshari/flask-bonsai/data/processed_files.txt"
 VECTORSTORE_PATH = "/home/fujikawa/jinshari/flask-bonsai/data/vectorstore"
 
+INGEST_WORKERS = 1  # OCR・チャンク分割・要約を並列に行うPDFの数
+PREPARED_FILES_PER_WORKER = 1  # 書き込み待ちにしておける準備済みのPDFの数（ワーカーあたり）
+KEYWORD_APPEND_SIZE = 2048  # キーワードインデックスに1回で追加する（1セグメントにする）文書の数
+CHUNK_PROCESSES = 0  # チャンク抽出をページごとに並列に行うプロセスの数（0・1なら並列にしない）
+MERGE_MODE = pdf_chunking.MERGE_SEQUENTIAL  # 段落チャンクの結合方法（pdf_chunking.merge_paragraph_chunks）
+
 
 class CreateVectorstore:
-    def __init__(self):
+    def __init__(
+        self,
+        batch_size=EMBED_BATCH_SIZE,
+        embed_concurrency=EMBED_CONCURRENCY,
+        summary_concurrency=SUMMARY_CONCURRENCY,
+        summary_timeout=SUMMARY_TIMEOUT,
+        summarizer_client=None,
+        use_cache=True,
+        ocr_concurrency=OCR_CONCURRENCY,
+        ocr_replay_dir=None,
+        chunk_processes=CHUNK_PROCESSES,
+        merge_mode=MERGE_MODE,
+    ):
         self.embeddings = OpenAIEmbeddings(
             model="text-embedding-ada-002",
         )
+        # 埋め込みはbatch_size件ずつ、最大embed_concurrency件を並列に実行する
+        self.batch_size = batch_size
+        self.embed_concurrency = embed_concurrency
+        self.stats = IngestStats(model="text-embedding-ada-002")
+        # 同じ内容の埋め込み・要約はディスクキャッシュから再利用する
+        self.cache = IngestCache() if use_cache else None
+        if self.cache is not None:
+            self.batch_embeddings = CachedEmbeddings(self.embeddings, self.cache, "text-embedding-ada-002")
+        else:
+            self.batch_embeddings = self.embeddings
         if os.path.exists(VECTORSTORE_PATH):
             print("--------------------------------")
             warnings.warn("vectorstore already exists, you may want to delete it")
@@ -38,67 +85,185 @@ class CreateVectorstore:
             chunk_size=512, chunk_overlap=128
         )
 
-        self.chat_image_summarizer = ChatOpenAI(model="gpt-4.1-mini")
+        # 要約モデルはinvoke(messages)を持つものなら差し替え可能（ローカル検証ではStubVisionModel）
+        self.summary_concurrency = summary_concurrency
+        self.summary_timeout = summary_timeout
+        if summarizer_client is None:
+            summarizer_client = ChatOpenAI(model="gpt-4.1-mini", timeout=summary_timeout)
+        self.chat_image_summarizer = summarizer_client
+        self.summary_model = getattr(summarizer_client, "model_name", type(summarizer_client).__name__)
+
+        # OCRは共有のクライアントで最大ocr_concurrency件を同時に実行し、結果はディスクキャッシュに保存する
+        # ocr_replay_dirを指定した場合はAPIを呼ばずに記録済みの結果を使う（オフライン検証用）
+        if ocr_replay_dir is not None:
+            self.ocr = OCRClient(client=ReplayDocumentAIClient(ocr_replay_dir), concurrency=ocr_concurrency)
+        else:
+            self.ocr = OCRClient(concurrency=ocr_concurrency, cache=OCRCache() if use_cache else None)
+
+        # ページ数の多いPDFのチャンク抽出（CPU処理）はプロセスプールでページごとに並列に行う
+        self.chunk_pool = pdf_chunking.create_page_pool(chunk_processes) if chunk_processes > 1 else None
+        self.merge_mode = merge_mode
+
+        # 取り込みの進捗（内容のハッシュで識別したファイルごと・段階ごと）
+        self.state = IngestState()
+
+    def main(self, workers=INGEST_WORKERS):
+        """
+        input/ のPDFを取り込む
+        OCR・チャンク分割・要約は最大workers件のPDFを並列に処理し、
+        チャンクの分割・埋め込みとChroma・キーワードインデックスへの書き込みはこのスレッドだけで1ファイルずつ行う
+        書き込みが追いつかない場合は、書き込み待ちのPDFが減るまで次のPDFの準備を始めない
+        """
+        pending = self.pending_files()
+        print(f"取り込むPDF: {len(pending)}件")
+
+        # OCRはworkersの数に関係なく最大ocr_concurrency件を先行して実行し、結果をOCRキャッシュに保存する
+        # （prepare_fileはキャッシュから読む。キャッシュを使わない場合はワーカースレッドの中でOCRする）
+        for file, hash_ in pending:
+            if self.state.stage(hash_) is None:
+                self.ocr.prefetch(FOLDER_PATH + file, content_hash=hash_)
+
+        max_in_flight = workers * (1 + PREPARED_FILES_PER_WORKER)
+        remaining = iter(pending)
+        futures = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                for file, hash_ in islice(remaining, max_in_flight - len(futures)):
+                    futures[executor.submit(self.prepare_file, file, hash_)] = (file, hash_)
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file, hash_ = futures.pop(future)
+                    try:
+                        documents = future.result()
+                        # 同じファイル名の古い内容のチャンクを削除してから書き込む
+                        self.remove_superseded(file, hash_)
+                        written = self.write_documents(documents, hash_)
+                        self.vectorstore.persist()
+                        self.state.complete(hash_, file, "embed")
+                        print(f"{file}: embed, done! ({written} chunks)")
+                    except Exception as e:
+                        print(f"{file}: 取り込みに失敗しました: {e}")
+                        self.state.fail(hash_, file, e)
 
-    def main(self):
-        if os.path.exists(PROCESSED_FILES_TXT):
+        if self.state.has_flag(KEYWORD_INDEX_REBUILD):
+            # キーワードインデックスは追記のみのため、削除したチャンクを除くには作り直す
+            # （前回の実行が作り直す前に中断した場合もフラグが残っているためここで作り直す）
+            self.rebuild_keyword_index()
+
+        self.ocr.close()
+        print(self.stats.report())
+        print(self.ocr.report())
+        if self.cache is not None:
+            print(self.cache.report())
+            self.cache.close()
+        if self.chunk_pool is not None:
+            self.chunk_pool.shutdown()
+        self.state.close()
+
+    def pending_files(self):
+        """取り込みが終わっていないPDF: [(ファイル名, 内容のハッシュ), ...]"""
+        if not self.state.rows() and os.path.exists(PROCESSED_FILES_TXT):
+            # processed_files.txt で管理していたときに取り込んだファイルを引き継ぐ
             with open(PROCESSED_FILES_TXT, "r") as f:
-                processed_files = set(f.read().splitlines())
+                legacy_files = set(f.read().splitlines())
+        else:
+            legacy_files = set()
+
+        pending = []
+        for file in sorted(os.listdir(FOLDER_PATH)):
+            if file.split(".")[-1] != "pdf":
+                continue
+            hash_ = file_hash(os.path.join(FOLDER_PATH, file))
+            if file in legacy_files:
+                self.state.import_legacy(hash_, file)
+            if self.state.is_done(hash_):
+                previous = self.state.filename(hash_)
+                if previous != file:
+                    print(f"{file}: {previous} と同じ内容のため取り込み済みとして扱います")
+                    self.state.rename(hash_, file)
+                continue
+            stage = self.state.stage(hash_)
+            if stage is not None:
+                print(f"{file}: 前回の {stage} まで終わっているため、続きから処理します")
+            pending.append((file, hash_))
+        return pending
+
+    def prepare_file(self, file, hash_):
+        """
+        1つのPDFのOCR・チャンク分割・要約を行い、書き込むDocumentのイテレータを返す（ワーカースレッドで実行）
+        段階ごとに途中結果を保存し、保存済みの段階は省略する
+        Documentへの分割は書き込み側が埋め込みの進み具合に合わせて行う
+        """
+        summarized = self.state.load(hash_, "summarize")
+        if summarized is not None:
+            images, texts = load_chunks(summarized)
         else:
-            processed_files = set()
-
-        for file in os.listdir(FOLDER_PATH):
-            if file.split(".")[-1] == "pdf":
-                if file not in processed_files:
-                    print(file)
-                    images, texts = self.process_pdf(file)
-                    print("partation, done!")
-                    images = self.add_summary(images)
-                    print("summarize, done!")
-                    self.add_vectorstore(
-                        self.vectorstore, texts, images, self.text_splitter
-                    )
-                    processed_files.add(file)
-
-            with open(PROCESSED_FILES_TXT, "w") as f:
-                f.write("\n".join(processed_files))
-            self.vectorstore.persist()
+            chunked = self.state.load(hash_, "chunk")
+            if chunked is not None:
+                images, texts = load_chunks(chunked)
+            else:
+                ocr = self.state.load(hash_, "ocr")
+                if ocr is not None:
+                    document = documentai.Document.deserialize(ocr)
+                else:
+                    document = self.get_documentai_document(file, hash_)
+                    # OCRキャッシュがある場合は結果はそちらに保存されているため、途中結果として重複して保存しない
+                    ocr_data = documentai.Document.serialize(document) if self.ocr.cache is None else None
+                    self.state.complete(hash_, file, "ocr", ocr_data)
+                    print(f"{file}: ocr, done!")
+                images, texts = self.chunk_document(document, file)
+                self.state.complete(hash_, file, "chunk", dump_chunks(images, texts))
+                print(f"{file}: partation, done!")
+            images = self.add_summary(images)
+            self.state.complete(hash_, file, "summarize", dump_chunks(images, texts))
+            print(f"{file}: summarize, done!")
+        return self.build_documents(texts, images, self.text_splitter, file_hash=hash_)
+
+    def remove_superseded(self, file, hash_):
+        """
+        同じファイル名で内容が変わる前のチャンクをChromaから削除する
+        削除する前にキーワードインデックスの作り直しのフラグを立てる
+        """
+        for old_hash, source in self.state.superseded(hash_, file):
+            self.state.set_flag(KEYWORD_INDEX_REBUILD)
+            # processed_files.txt から引き継いだファイルのチャンクにはfile_hashがないためファイル名で削除する
+            where = {"filename": file} if source == LEGACY else {"file_hash": old_hash}
+            self.vectorstore._collection.delete(where=where)
+            self.state.forget(old_hash)
+            print(f"{file}: 内容が変わったため、前の内容のチャンクを削除しました")
 
     def process_pdf(self, file):
         # DocumentAI documentを取得
         document = self.get_documentai_document(file)
+        return self.chunk_document(document, file)
+
+    def chunk_document(self, document, file):
         base_metadata = {
             "source_file": FOLDER_PATH + file,
             "filename": file,
         }
-        # チャンク抽出・結合
-        chunks = pdf_chunking.extract_document_chunks(document, base_metadata)
+        # チャンク抽出・結合（1ページ分ずつ処理し、文書全体のチャンクのリストを途中で作らない）
+        chunks = pdf_chunking.iter_document_chunks(document, base_metadata, executor=self.chunk_pool)
         # 距離閾値を30pxに拡大
-        chunks = pdf_chunking.merge_paragraph_chunks(chunks, max_distance=30, max_chars_per_chunk=1500)
-        # 3文字以下の短いチャンクを除去
-        chunks = [c for c in chunks if len(c["text"].strip()) > 3]
-        # 画像・表要素は従来通り抽出
-        images = [c for c in chunks if c["metadata"]["chunk_type"] in ["Image", "Table"]]
-        texts = [c for c in chunks if c["metadata"]["chunk_type"] == "paragraph" or c["metadata"]["chunk_type"] == "merged_paragraph"]
+        chunks = pdf_chunking.iter_merged_chunks(chunks, max_distance=30, max_chars_per_chunk=1500, mode=self.merge_mode)
+        images, texts = [], []
+        for c in chunks:
+            # 3文字以下の短いチャンクを除去
+            if len(c.text.strip()) <= 3:
+                continue
+            # 画像・表要素は従来通り抽出
+            # 以降（要約・途中結果の保存・Chromaへの書き込み）は辞書の形式で扱う
+            if c.chunk_type in ["Image", "Table"]:
+                images.append(c.to_dict())
+            elif c.chunk_type == "paragraph" or c.chunk_type == "merged_paragraph":
+                texts.append(c.to_dict())
         return images, texts
 
-    def get_documentai_document(self, file):
-        # test.pyのprocess_documentを参考にDocumentAI documentを取得
-        project_id = "utopian-saga-466802-m5"
-        location = "us"
-        processor_id = "e794632016082b0"
-        processor_version = "pretrained-ocr-v2.0-2023-06-02"
-        mime_type = "application/pdf"
-        client = documentai.DocumentProcessorServiceClient()
-        name = client.processor_version_path(project_id, location, processor_id, processor_version)
-        with open(FOLDER_PATH + file, "rb") as image:
-            image_content = image.read()
-        request = documentai.ProcessRequest(
-            name=name,
-            raw_document=documentai.RawDocument(content=image_content, mime_type=mime_type),
-        )
-        result = client.process_document(request=request)
-        return result.document
+    def get_documentai_document(self, file, content_hash=None):
+        # DocumentAI documentを取得（同じ内容のPDFはOCRキャッシュから返す）
+        return self.ocr.process_file(FOLDER_PATH + file, content_hash=content_hash)
 
     def del_small_images(self, images, max_kb=30):
         over_max_kb_image_list = []
@@ -144,25 +309,35 @@ class CreateVectorstore:
         return result
 
     def add_summary(self, images):
-        for image in images:
-            image["summary"] = self.image_summarize(image)
+        results = summarize_concurrently(
+            images,
+            self.image_summarize,
+            max_workers=self.summary_concurrency,
+            timeout=self.summary_timeout,
+        )
+        failed = 0
+        for image, (summary, error) in zip(images, results):
+            if error is not None:
+                # 要約に失敗した要素はOCRテキストで代用する（ファイル全体の処理は中断しない）
+                failed += 1
+                print(f"  要約に失敗しました (page {image['metadata'].get('page_number')}): {error}")
+                summary = image.get("text", "")
+            image["summary"] = summary
+        if failed:
+            print(f"  要約失敗: {failed}/{len(images)}件")
         return images
 
     def image_summarize(self, image):
-        if image["type"] == "Table":
-            prompt = (
-                "表が画像データとして提供されています。"
-                "画像データをもとに、この表に含まれる情報をもれなく正確に、日本語の文章で説明してください。"
-                "ただし与えられた表の画像が読み取りにくい場合には、次に提供するHTML形式の表を使用して情報をもれなく正確に日本語で説明してください。"
-                "表のHTML形式: {html}"
-                "また、HTML形式には誤字が含まれている可能性がありますので、以下のテキスト情報を参考にしてください。"
-                "テキスト情報: {text}"
-            ).format(html=image["metadata"]["text_as_html"], text=image["text"])
-        else:
-            prompt = "この画像に含まれる情報をもれなく正確に日本語で説明してください。"
-
+        prompt = self.summary_prompt(image)
         img_base64 = image["metadata"]["image_base64"]
 
+        # プロンプトと画像データが同じなら要約も同じとみなしてキャッシュを使う
+        cache_content = prompt + "\n" + img_base64
+        if self.cache is not None:
+            summary = self.cache.get_summary(self.summary_model, cache_content)
+            if summary is not None:
+                return summary
+
         msg = self.chat_image_summarizer.invoke(
             [
                 HumanMessage(
@@ -179,60 +354,157 @@ class CreateVectorstore:
             ]
         )
 
+        if self.cache is not None:
+            self.cache.put_summary(self.summary_model, cache_content, msg.content)
         return msg.content
 
+    def summary_prompt(self, image):
+        if image["type"] == "Table":
+            prompt = (
+                "表が画像データとして提供されています。"
+                "画像データをもとに、この表に含まれる情報をもれなく正確に、日本語の文章で説明してください。"
+                "ただし与えられた表の画像が読み取りにくい場合には、次に提供するHTML形式の表を使用して情報をもれなく正確に日本語で説明してください。"
+                "表のHTML形式: {html}"
+                "また、HTML形式には誤字が含まれている可能性がありますので、以下のテキスト情報を参考にしてください。"
+                "テキスト情報: {text}"
+            ).format(html=image["metadata"]["text_as_html"], text=image["text"])
+        else:
+            prompt = "この画像に含まれる情報をもれなく正確に日本語で説明してください。"
+        return prompt
+
     def add_vectorstore(self, vectorstore, texts, images, text_splitter):
-        chunks = []
-        for text in texts:
-            chunk_list = text_splitter.split_text(text["text"])
-            for chunk in chunk_list:
-                chunk_dict = text.copy()
-                chunk_dict["text"] = chunk
-                chunks.append(chunk_dict)
-
-        for i, chunk in enumerate(chunks):
-            vectorstore.add_documents(
-                [
-                    Document(
-                        page_content=chunk["text"],
-                        metadata={
-                            "type": chunk["metadata"]["chunk_type"],
-                            "filename": chunk["metadata"]["filename"],
-                            "page_number": chunk["metadata"]["page_number"],
-                            "image_base64": "",
-                        },
-                    )
-                ]
-            )
+        self.write_vectorstore(vectorstore, self.build_documents(texts, images, text_splitter))
 
-        img_chunks = []
-        for image in images:
-            img_chunk_list = text_splitter.split_text(image["summary"])
-            for img_chunk in img_chunk_list:
-                img_chunk_dict = image.copy()
-                img_chunk_dict["summary"] = img_chunk
-                img_chunks.append(img_chunk_dict)
-
-        for i, image in enumerate(img_chunks):
-            vectorstore.add_documents(
-                [
-                    Document(
-                        page_content=image["summary"],
-                        metadata={
-                            "type": image["metadata"]["chunk_type"] if "chunk_type" in image["metadata"] else "Image",
-                            "file_directory": image["metadata"]["file_directory"],
-                            "filename": image["metadata"]["filename"],
-                            "page_number": image["metadata"]["page_number"],
-                            "image_base64": image["metadata"].get("image_base64", ""),
-                        },
-                    )
-                ]
+    def write_vectorstore(self, vectorstore, documents):
+        """
+        Documentを埋め込んでChromaに書き込み、書き込んだ数を返す
+        キーワード検索用のインデックスにも、Chromaに書き込んだバッチをKEYWORD_APPEND_SIZE件ずつ追加する
+        """
+        keyword_documents = []
+
+        def append_keyword_documents():
+            append_documents(
+                [doc.page_content for doc in keyword_documents],
+                [doc.metadata for doc in keyword_documents],
+                path=KEYWORD_INDEX_PATH,
             )
+            keyword_documents.clear()
+
+        def on_written(batch):
+            keyword_documents.extend(batch)
+            if len(keyword_documents) >= KEYWORD_APPEND_SIZE:
+                append_keyword_documents()
+
+        written = add_documents_batched(
+            vectorstore,
+            self.batch_embeddings,
+            documents,
+            batch_size=self.batch_size,
+            concurrency=self.embed_concurrency,
+            stats=self.stats,
+            on_written=on_written,
+        )
+        # 残りを追加する（文書がなかった場合もインデックスのmanifestは作成しておく）
+        if keyword_documents or not written:
+            append_keyword_documents()
+        return written
+
+    def write_documents(self, documents, file_hash):
+        """
+        1つのPDFのDocumentを埋め込んでChromaとキーワードインデックスに書き込み、書き込んだ数を返す
+        前回の実行が書き込みの途中で中断していた場合は、そのチャンクを削除してから書き込む
+        （キーワードインデックスにも途中まで追加されている可能性があるため、作り直しのフラグを立てる）
+        """
+        existing = self.vectorstore._collection.get(where={"file_hash": file_hash}, include=[])["ids"]
+        if existing:
+            self.state.set_flag(KEYWORD_INDEX_REBUILD)
+            self.vectorstore._collection.delete(ids=existing)
+        return self.write_vectorstore(self.vectorstore, documents)
+
+    def build_documents(self, texts, images, text_splitter, file_hash=None):
+        """チャンクを分割してChromaに書き込むDocumentを順に返す（分割は読み進めたときに行う）"""
+        return iter_split_documents(texts, images, text_splitter, file_hash)
+
+    def rebuild_keyword_index(self):
+        """既存のベクトルストアの全文書からキーワードインデックスを作り直す"""
+        documents = self.vectorstore.get()
+        manifest = rebuild_index(documents["documents"], documents["metadatas"], path=KEYWORD_INDEX_PATH)
+        self.state.clear_flag(KEYWORD_INDEX_REBUILD)
+        print(f"キーワードインデックスを作成しました: {manifest['doc_count']}件")
+
+
+def iter_split_documents(texts, images, text_splitter, file_hash=None):
+    """チャンクを分割したDocumentを順に返す（分割した断片ごとにチャンクの辞書をコピーしない）"""
+    for text in texts:
+        for chunk in text_splitter.split_text(text["text"]):
+            metadata = {
+                "type": text["metadata"]["chunk_type"],
+                "filename": text["metadata"]["filename"],
+                "page_number": text["metadata"]["page_number"],
+                "image_base64": "",
+            }
+            if file_hash is not None:
+                metadata["file_hash"] = file_hash
+            yield Document(page_content=chunk, metadata=metadata)
+
+    for image in images:
+        for img_chunk in text_splitter.split_text(image["summary"]):
+            metadata = {
+                "type": image["metadata"]["chunk_type"] if "chunk_type" in image["metadata"] else "Image",
+                "file_directory": image["metadata"]["file_directory"],
+                "filename": image["metadata"]["filename"],
+                "page_number": image["metadata"]["page_number"],
+                "image_base64": image["metadata"].get("image_base64", ""),
+            }
+            if file_hash is not None:
+                metadata["file_hash"] = file_hash
+            yield Document(page_content=img_chunk, metadata=metadata)
+
+
+def dump_chunks(images, texts):
+    """段階の途中結果としてチャンクを保存する形式（_boundsなどの内部用のキーは除く）"""
+    def strip(chunks):
+        return [{key: value for key, value in chunk.items() if not key.startswith("_")} for chunk in chunks]
+    return json.dumps({"images": strip(images), "texts": strip(texts)}, ensure_ascii=False).encode("utf-8")
+
+
+def load_chunks(data):
+    chunks = json.loads(data)
+    return chunks["images"], chunks["texts"]
 
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=EMBED_BATCH_SIZE, help='1回の埋め込みAPI呼び出しで送るチャンク数')
+    parser.add_argument('--embed-concurrency', type=int, default=EMBED_CONCURRENCY, help='埋め込みAPIの同時呼び出し数')
+    parser.add_argument('--summary-concurrency', type=int, default=SUMMARY_CONCURRENCY, help='画像・表の要約リクエストの同時実行数')
+    parser.add_argument('--summary-timeout', type=float, default=SUMMARY_TIMEOUT, help='要約リクエスト1件あたりのタイムアウト（秒）')
+    parser.add_argument('--stub-summarizer', action='store_true', help='要約モデルをスタブに差し替える（ローカル検証用）')
+    parser.add_argument('--no-cache', action='store_true', help='埋め込み・要約のキャッシュを使わない')
+    parser.add_argument('--ocr-concurrency', type=int, default=OCR_CONCURRENCY, help='Document AIへの同時リクエスト数（--no-cache・--ocr-replayの場合は--workersの数までに制限される）')
+    parser.add_argument('--ocr-replay', metavar='DIR', help='記録済みのOCR結果（OCRキャッシュのディレクトリ）を再生する（オフライン検証用）')
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help='OCR・チャンク分割・要約を並列に行うPDFの数')
+    parser.add_argument('--chunk-processes', type=int, default=CHUNK_PROCESSES, help='チャンク抽出をページごとに並列に行うプロセスの数')
+    parser.add_argument('--merge-mode', choices=pdf_chunking.MERGE_MODES, default=MERGE_MODE, help='段落チャンクの結合方法（sequential: 読み順で隣り合う段落、spatial: ページ上で近い段落）')
+    parser.add_argument('--rebuild-keyword-index', action='store_true', help='ベクトルストアからキーワードインデックスを作り直して終了する')
+    args = parser.parse_args()
     start_time = time.time()
-    cv = CreateVectorstore()
-    cv.main()
+    cv = CreateVectorstore(
+        batch_size=args.batch_size,
+        embed_concurrency=args.embed_concurrency,
+        summary_concurrency=args.summary_concurrency,
+        summary_timeout=args.summary_timeout,
+        summarizer_client=StubVisionModel() if args.stub_summarizer else None,
+        use_cache=not args.no_cache,
+        ocr_concurrency=args.ocr_concurrency,
+        ocr_replay_dir=args.ocr_replay,
+        chunk_processes=args.chunk_processes,
+        merge_mode=args.merge_mode,
+    )
+    if args.rebuild_keyword_index:
+        cv.rebuild_keyword_index()
+    else:
+        cv.main(workers=args.workers)
     end_time = time.time()
     print(f"Time taken: {(end_time - start_time) / 60} minutes")
@@ -0,0 +1,240 @@
+# 埋め込みベクトルと画像要約のディスクキャッシュ（内容ハッシュをキーにする）
+#
+# create_vectorstore.py を再実行したとき（クラッシュ後・チャンク設定の変更後など）に
+# 同じテキスト・同じ画像の埋め込みや要約をAPIに再リクエストしないためのキャッシュ。
+# キーは (種別, モデル名, 内容) のSHA-256なので、ファイル名やチャンクの順番が変わってもヒットする。
+#
+# 使い方:
+#   python ingest_cache.py stats   # 件数・サイズ・ヒット率を表示
+#   python ingest_cache.py clear   # キャッシュを削除
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+CACHE_PATH = "/home/fujikawa/jinshari/flask-bonsai/data/ingest_cache.sqlite3"
+CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1GB（超えた分は最後に使われた時刻が古いものから削除）
+TOUCH_BATCH_SIZE = 1000  # ヒット時の last_used 更新をまとめて書き込む件数
+
+
+def content_key(kind, model, content):
+    """キャッシュキー（種別・モデル名・内容のSHA-256）"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    digest = hashlib.sha256()
+    for part in (kind.encode("utf-8"), model.encode("utf-8"), content):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class IngestCache:
+    """SQLiteに保存する内容アドレス方式のキャッシュ（LRUでサイズ上限を維持）"""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 埋め込み・要約のワーカースレッドから呼ばれるため1接続をロックで共有する
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache (last_used)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS counters (
+                kind TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        self.hits = {}
+        self.misses = {}
+        # ヒットした key -> 参照時刻（読み込みのたびにコミットしないよう、まとめて書き込む）
+        self._touched = {}
+
+    def get(self, kind, model, content):
+        """キャッシュを参照（見つからない場合はNone）"""
+        key = content_key(kind, model, content)
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._flush_touched()
+                self._conn.commit()
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            return row[0]
+
+    def put(self, kind, model, content, value):
+        """キャッシュに保存（上限を超えたら古いものから削除）"""
+        key = content_key(kind, model, content)
+        size = len(value)
+        with self._lock:
+            # 追い出し対象を最新の参照時刻で選ぶため、溜まった更新を先に反映する
+            self._flush_touched()
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, kind, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, value, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _flush_touched(self):
+        """溜まった last_used の更新を書き込む（コミットは呼び出し側、ロック取得済みで呼ぶ）"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE cache SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched = {}
+
+    def _evict(self):
+        freed = 0
+        excess = self.total_bytes - self.max_bytes
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache ORDER BY last_used ASC"):
+            if freed >= excess:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+        self.total_bytes -= freed
+
+    # --- 種別ごとの保存形式 ---
+
+    def get_embedding(self, model, text):
+        value = self.get("embedding", model, text)
+        if value is None:
+            return None
+        return array("d", value).tolist()
+
+    def put_embedding(self, model, text, vector):
+        self.put("embedding", model, text, array("d", vector).tobytes())
+
+    def get_summary(self, model, content):
+        value = self.get("summary", model, content)
+        return None if value is None else value.decode("utf-8")
+
+    def put_summary(self, model, content, summary):
+        self.put("summary", model, content, summary.encode("utf-8"))
+
+    # --- 統計 ---
+
+    def flush_counters(self):
+        """今回の実行のヒット数・ミス数を累計に加算する（溜まった last_used の更新も書き込む）"""
+        with self._lock:
+            self._flush_touched()
+            for kind in set(self.hits) | set(self.misses):
+                self._conn.execute(
+                    """
+                    INSERT INTO counters (kind, hits, misses) VALUES (?, ?, ?)
+                    ON CONFLICT(kind) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses
+                    """,
+                    (kind, self.hits.get(kind, 0), self.misses.get(kind, 0)),
+                )
+            self._conn.commit()
+            self.hits = {}
+            self.misses = {}
+
+    def report(self):
+        """今回の実行のヒット率"""
+        lines = []
+        for kind in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+            lines.append(f"キャッシュ({kind}): {hits}/{hits + misses}件ヒット")
+        return "\n".join(lines) or "キャッシュ: 参照なし"
+
+    def stats(self):
+        with self._lock:
+            entries = {
+                kind: {"entries": count, "bytes": size}
+                for kind, count, size in self._conn.execute(
+                    "SELECT kind, COUNT(*), SUM(size) FROM cache GROUP BY kind"
+                )
+            }
+            for kind, hits, misses in self._conn.execute("SELECT kind, hits, misses FROM counters"):
+                entries.setdefault(kind, {"entries": 0, "bytes": 0}).update(hits=hits, misses=misses)
+        return {"path": self.path, "total_bytes": self.total_bytes, "max_bytes": self.max_bytes, "kinds": entries}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.execute("DELETE FROM counters")
+            self._conn.commit()
+            self.total_bytes = 0
+            self._touched = {}
+
+    def close(self):
+        self.flush_counters()
+        self._conn.close()
+
+
+class CachedEmbeddings:
+    """
+    OpenAIEmbeddingsのembed_documentsをキャッシュ経由にするラッパー
+    キャッシュにないテキストだけを元のembeddingsに問い合わせる
+    """
+
+    def __init__(self, embeddings, cache, model):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts):
+        vectors = [self.cache.get_embedding(self.model, text) for text in texts]
+        # 同じバッチ内の重複テキストは1回だけ問い合わせる
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            for text, vector in computed.items():
+                self.cache.put_embedding(self.model, text, vector)
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+def main():
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="埋め込み・要約キャッシュの管理")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--path", default=CACHE_PATH)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"キャッシュが存在しません: {args.path}")
+        return
+    cache = IngestCache(args.path)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    else:
+        cache.clear()
+        print("キャッシュを削除しました")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# PDF取り込みの進捗（ファイルごと・段階ごとのチェックポイント）
+#
+# ファイルは内容のSHA-256で識別する（processed_files.txt のファイル名による管理の置き換え）。
+# - ファイル名を変えただけのPDFは取り込み済みとして扱う
+# - 同じファイル名で内容が変わったPDFは新しいファイルとして取り込み、古い内容のチャンクを削除する
+# 段階（STAGES）が終わるごとに途中結果を保存するため、中断しても終わった段階からやり直せる。
+# 最後の段階（embed）が終わったファイルは途中結果を削除する。
+#
+# 使い方:
+#   python ingest_state.py status  # ファイルごとの進捗を表示
+#   python ingest_state.py reset   # 進捗を削除（次回はすべてのPDFを取り込み直す）
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+STATE_PATH = "/home/fujikawa/jinshari/flask-bonsai/data/ingest_state.sqlite3"
+STAGES = ("ocr", "chunk", "summarize", "embed")
+
+LEGACY = "legacy"  # processed_files.txt から引き継いだファイル（チャンクのメタデータにfile_hashがない）
+
+# フラグ（中断しても次回の実行に引き継ぐ後処理）
+KEYWORD_INDEX_REBUILD = "keyword_index_rebuild"  # Chromaからチャンクを削除したためキーワードインデックスの作り直しが必要
+
+
+def file_hash(path, block_size=1024 * 1024):
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestState:
+    """取り込みの進捗をSQLiteに保存する（ワーカースレッドから呼ばれるため1接続をロックで共有する）"""
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                hash TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                stage TEXT,
+                source TEXT NOT NULL DEFAULT 'ingest',
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_filename ON files (filename)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                hash TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (hash, stage)
+            )
+            """
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS flags (name TEXT PRIMARY KEY)")
+        self._conn.commit()
+
+    def set_flag(self, name):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO flags (name) VALUES (?)", (name,))
+            self._conn.commit()
+
+    def has_flag(self, name):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM flags WHERE name = ?", (name,)).fetchone() is not None
+
+    def clear_flag(self, name):
+        with self._lock:
+            self._conn.execute("DELETE FROM flags WHERE name = ?", (name,))
+            self._conn.commit()
+
+    def stage(self, hash_):
+        """終わっている最後の段階（未着手の場合はNone）"""
+        with self._lock:
+            row = self._conn.execute("SELECT stage FROM files WHERE hash = ?", (hash_,)).fetchone()
+        return row[0] if row else None
+
+    def filename(self, hash_):
+        with self._lock:
+            row = self._conn.execute("SELECT filename FROM files WHERE hash = ?", (hash_,)).fetchone()
+        return row[0] if row else None
+
+    def is_done(self, hash_):
+        return self.stage(hash_) == STAGES[-1]
+
+    def load(self, hash_, stage):
+        """段階の途中結果（保存されていない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM artifacts WHERE hash = ? AND stage = ?", (hash_, stage)
+            ).fetchone()
+        return row[0] if row else None
+
+    def complete(self, hash_, filename, stage, data=None):
+        """段階の終了を記録する（dataは次回その段階を省略するための途中結果）"""
+        with self._lock:
+            if data is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO artifacts (hash, stage, data) VALUES (?, ?, ?)",
+                    (hash_, stage, data),
+                )
+            self._conn.execute(
+                """
+                INSERT INTO files (hash, filename, stage, error, updated_at) VALUES (?, ?, ?, NULL, ?)
+                ON CONFLICT(hash) DO UPDATE SET filename = excluded.filename, stage = excluded.stage,
+                    error = NULL, updated_at = excluded.updated_at
+                """,
+                (hash_, filename, stage, time.time()),
+            )
+            if stage == STAGES[-1]:
+                self._conn.execute("DELETE FROM artifacts WHERE hash = ?", (hash_,))
+            self._conn.commit()
+
+    def fail(self, hash_, filename, error):
+        """失敗を記録する（終わった段階はそのまま残す）"""
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO files (hash, filename, stage, error, updated_at) VALUES (?, ?, NULL, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET error = excluded.error, updated_at = excluded.updated_at
+                """,
+                (hash_, filename, str(error), time.time()),
+            )
+            self._conn.commit()
+
+    def rename(self, hash_, filename):
+        with self._lock:
+            self._conn.execute("UPDATE files SET filename = ? WHERE hash = ?", (filename, hash_))
+            self._conn.commit()
+
+    def superseded(self, hash_, filename):
+        """同じファイル名で別の内容の取り込み済みファイル: [(hash, source), ...]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT hash, source FROM files WHERE filename = ? AND hash != ? AND stage = ?",
+                (filename, hash_, STAGES[-1]),
+            ).fetchall()
+
+    def forget(self, hash_):
+        """ファイルの記録を削除する（新しい内容に置き換えたとき）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE hash = ?", (hash_,))
+            self._conn.execute("DELETE FROM artifacts WHERE hash = ?", (hash_,))
+            self._conn.commit()
+
+    def import_legacy(self, hash_, filename):
+        """processed_files.txt に記録されていたファイルを取り込み済みとして登録する"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO files (hash, filename, stage, source, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (hash_, filename, STAGES[-1], LEGACY, time.time()),
+            )
+            self._conn.commit()
+
+    def rows(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT hash, filename, stage, source, error, updated_at FROM files ORDER BY filename"
+            ).fetchall()
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM artifacts")
+            self._conn.execute("DELETE FROM flags")
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="PDF取り込みの進捗の管理")
+    parser.add_argument("command", choices=["status", "reset"])
+    parser.add_argument("--path", default=STATE_PATH)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"進捗が記録されていません: {args.path}")
+        return
+    state = IngestState(args.path)
+    if args.command == "status":
+        for hash_, filename, stage, source, error, updated_at in state.rows():
+            updated = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(updated_at))
+            status = stage or "未着手"
+            if error:
+                status += f" (エラー: {error})"
+            print(f"{filename}  {hash_[:12]}  {status}  [{source}] {updated}")
+    else:
+        state.reset()
+        print("進捗を削除しました")
+    state.close()
+
+
+if __name__ == "__main__":
+    main()
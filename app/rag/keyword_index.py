@@ -0,0 +1,451 @@
+# 永続化したBM25キーワードインデックス（文字n-gramのハッシュによる転置インデックス）
+#
+# RAGChatBotの起動時にベクトルストアの全文書を読み込んでBM25Retrieverを作り直す代わりに、
+# create_vectorstore.py の取り込み時にインデックスを作成してディスクに保存しておく。
+# 検索時は必要なセグメントだけをmmapで開くため、起動時間・メモリ使用量がコーパスに比例しない。
+#
+# ディレクトリ構成:
+#   manifest.json            セグメント一覧・文書数・文書頻度のヒストグラム
+#   seg-000001/terms.bin     n-gramハッシュ（uint64, 昇順）
+#   seg-000001/offsets.bin   各termのポスティング開始位置（uint64, terms+1個）
+#   seg-000001/postings.bin  文書ID（uint32）。n-gramは文書ごとに重複を除くためtfは常に1
+#   seg-000001/doclens.bin   文書ごとのn-gram数（uint32）
+#   seg-000001/docs.jsonl    文書本文とメタデータ
+#   seg-000001/docs.idx      docs.jsonl の各行の開始位置（uint64, 文書数+1個）
+# 数値はネイティブのバイト順で保存する（作成したマシンと同じアーキテクチャで読む前提）。
+#
+# スコアは rank_bm25.BM25Okapi（BM25Retrieverの実装）と同じ式・同じパラメータで計算する。
+#
+# 使い方:
+#   python keyword_index.py stats   # 文書数・セグメント数を表示
+#   python keyword_index.py compact # セグメントを1つにまとめる
+import bisect
+import json
+import math
+import mmap
+import os
+import shutil
+import threading
+from array import array
+
+import numpy as np
+
+from ngram_tokenizer import HASH_BASE, NGRAM_MAX, NGRAM_MIN, batch_ngram_ids, ngram_ids
+
+INDEX_PATH = "/home/fujikawa/jinshari/flask-bonsai/data/keyword_index"
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+# rank_bm25.BM25Okapi のデフォルト値
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+MAX_SEGMENTS = 8  # 追加のたびにセグメントが増えるため、これを超えたら1つにまとめる
+
+assert array("I").itemsize == 4 and array("Q").itemsize == 8
+
+
+def bm25_idf(doc_count, df):
+    """BM25Okapiのidf（負の値の置き換えは呼び出し側で行う）"""
+    return math.log(doc_count - df + 0.5) - math.log(df + 0.5)
+
+
+# ========== 書き込み ==========
+
+
+def write_segment(directory, doc_start, token_sets, texts, metadatas):
+    """
+    文書を1つのセグメントとして書き込む
+    一時ディレクトリに書き込んでから directory にrenameするため、途中で中断しても書きかけのセグメントは残らない
+
+    :param doc_start: このセグメントの最初の文書ID（文書IDはインデックス全体で連番）
+    :param token_sets: 文書ごとのn-gramハッシュ（重複なしのuint64配列）
+    :return: manifestに記録するセグメント情報
+    """
+    final_directory = directory
+    directory = final_directory + ".tmp"
+    shutil.rmtree(directory, ignore_errors=True)  # 前回中断した書き込みの残り
+    os.makedirs(directory)
+    token_arrays = [np.asarray(ids, dtype=np.uint64) for ids in token_sets]
+    doclens = np.array([len(ids) for ids in token_arrays], dtype=np.uint32)
+    all_terms = np.concatenate(token_arrays) if token_arrays else np.empty(0, dtype=np.uint64)
+    all_docs = np.repeat(np.arange(doc_start, doc_start + len(token_arrays), dtype=np.uint32), doclens)
+
+    # termの昇順に並べる（安定ソートなので同じterm内は文書IDの昇順）
+    order = np.argsort(all_terms, kind="stable")
+    all_terms, all_docs = all_terms[order], all_docs[order]
+    terms, starts = np.unique(all_terms, return_index=True)
+    offsets = np.append(starts, len(all_terms)).astype(np.uint64)
+
+    terms.tofile(os.path.join(directory, "terms.bin"))
+    offsets.tofile(os.path.join(directory, "offsets.bin"))
+    all_docs.tofile(os.path.join(directory, "postings.bin"))
+    doclens.tofile(os.path.join(directory, "doclens.bin"))
+
+    doc_offsets = [0]
+    with open(os.path.join(directory, "docs.jsonl"), "wb") as f:
+        for text, metadata in zip(texts, metadatas):
+            line = json.dumps({"text": text, "metadata": metadata or {}}, ensure_ascii=False).encode("utf-8") + b"\n"
+            f.write(line)
+            doc_offsets.append(doc_offsets[-1] + len(line))
+    np.array(doc_offsets, dtype=np.uint64).tofile(os.path.join(directory, "docs.idx"))
+
+    # 同じ名前のディレクトリはmanifestに記録される前に中断したセグメント（名前はmanifestのnext_segmentで決まるため）
+    if os.path.exists(final_directory):
+        shutil.rmtree(final_directory)
+    os.replace(directory, final_directory)
+
+    return {
+        "name": os.path.basename(final_directory),
+        "doc_start": doc_start,
+        "doc_count": len(token_arrays),
+        "total_len": int(doclens.sum()),
+    }
+
+
+def _read_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(path, manifest):
+    """manifestを置き換える（読み取り側が途中の状態を見ないよう一時ファイルからrename）"""
+    tmp_path = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+def _df_histogram(path, segments):
+    """全セグメントを通した文書頻度のヒストグラム [[df, term数], ...]（average_idfの計算用）"""
+    terms, counts = [], []
+    for segment in segments:
+        directory = os.path.join(path, segment["name"])
+        terms.append(np.fromfile(os.path.join(directory, "terms.bin"), dtype=np.uint64))
+        counts.append(np.diff(np.fromfile(os.path.join(directory, "offsets.bin"), dtype=np.uint64)))
+    if not terms:
+        return []
+
+    # 同じtermのセグメントごとの文書頻度を合計する
+    _, inverse = np.unique(np.concatenate(terms), return_inverse=True)
+    dfs = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    values, term_counts = np.unique(dfs, return_counts=True)
+    return [[int(df), int(count)] for df, count in zip(values, term_counts)]
+
+
+def _next_segment_name(manifest):
+    number = manifest["next_segment"] if manifest else 1
+    return f"seg-{number:06d}", number + 1
+
+
+def _commit(path, manifest, segments, next_segment):
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": (manifest["version"] if manifest else 0) + 1,
+        "ngram": [NGRAM_MIN, NGRAM_MAX],
+        "hash_base": HASH_BASE,
+        "next_segment": next_segment,
+        "doc_count": sum(s["doc_count"] for s in segments),
+        "total_len": sum(s["total_len"] for s in segments),
+        "segments": segments,
+        "df_histogram": _df_histogram(path, segments),
+    }
+    _write_manifest(path, manifest)
+    return manifest
+
+
+def append_documents(texts, metadatas, path=INDEX_PATH, tokenize_batch=batch_ngram_ids):
+    """
+    文書を新しいセグメントとして追加する（create_vectorstore.py から呼び出す）
+    書き込みは1プロセスから行うこと。読み取り側は次の検索時に新しいセグメントを読み込む
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest = _read_manifest(path)
+    if not texts:
+        # 文書がなくてもmanifestは作る（読み取り側は空のインデックスとして扱う）
+        return manifest if manifest is not None else _commit(path, None, [], 1)
+    segments = list(manifest["segments"]) if manifest else []
+    doc_start = manifest["doc_count"] if manifest else 0
+
+    name, next_segment = _next_segment_name(manifest)
+    token_sets = tokenize_batch(texts)
+    segments.append(write_segment(os.path.join(path, name), doc_start, token_sets, texts, metadatas))
+    manifest = _commit(path, manifest, segments, next_segment)
+
+    if len(segments) > MAX_SEGMENTS:
+        manifest = compact(path, tokenize_batch=tokenize_batch)
+    return manifest
+
+
+def rebuild_index(texts, metadatas, path=INDEX_PATH, tokenize_batch=batch_ngram_ids):
+    """
+    インデックスを作り直す（既存のベクトルストアからの移行用）
+    manifestのversionは引き継いで増やす（run_rag.py の回答キャッシュがコーパスの更新を検出できるように）
+    """
+    manifest = _read_manifest(path)
+    if manifest is None:
+        # manifestのない作りかけのインデックスは削除して作り直す
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        return append_documents(texts, metadatas, path=path, tokenize_batch=tokenize_batch)
+    return _replace_segments(path, manifest, texts, metadatas, tokenize_batch)
+
+
+def iter_documents(path=INDEX_PATH):
+    """インデックスに保存されている文書を文書ID順に返す: (text, metadata)"""
+    manifest = _read_manifest(path)
+    if not manifest:
+        return
+    for segment in manifest["segments"]:
+        with open(os.path.join(path, segment["name"], "docs.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                doc = json.loads(line)
+                yield doc["text"], doc["metadata"]
+
+
+def compact(path=INDEX_PATH, tokenize_batch=batch_ngram_ids):
+    """全セグメントを1つにまとめる"""
+    manifest = _read_manifest(path)
+    if not manifest or len(manifest["segments"]) <= 1:
+        return manifest
+
+    texts, metadatas = [], []
+    for text, metadata in iter_documents(path):
+        texts.append(text)
+        metadatas.append(metadata)
+    return _replace_segments(path, manifest, texts, metadatas, tokenize_batch)
+
+
+def _replace_segments(path, manifest, texts, metadatas, tokenize_batch):
+    """
+    全セグメントを texts からなる1つのセグメントに置き換える（古いセグメントはmanifestの置き換え後に削除）
+    textsが空の場合はセグメントのない（文書数0の）manifestにする
+    """
+    old_segments = manifest["segments"]
+    if not texts:
+        manifest = _commit(path, manifest, [], manifest["next_segment"])
+    else:
+        name, next_segment = _next_segment_name(manifest)
+        token_sets = tokenize_batch(texts)
+        segment = write_segment(os.path.join(path, name), 0, token_sets, texts, metadatas)
+        manifest = _commit(path, manifest, [segment], next_segment)
+
+    # 読み取り中のプロセスがmmapしていても、POSIXではファイル削除後も読み続けられる
+    for old in old_segments:
+        shutil.rmtree(os.path.join(path, old["name"]), ignore_errors=True)
+    return manifest
+
+
+# ========== 読み取り ==========
+
+
+def _map_array(file_path, typecode):
+    """ファイルをmmapして配列として参照する（空ファイルはmmapできないため空配列）"""
+    if os.path.getsize(file_path) == 0:
+        return None, array(typecode)
+    with open(file_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped, memoryview(mapped).cast(typecode)
+
+
+class Segment:
+    """mmapで開いた1つのセグメント"""
+
+    def __init__(self, directory, info):
+        self.directory = directory
+        self.name = info["name"]
+        self.doc_start = info["doc_start"]
+        self.doc_count = info["doc_count"]
+        self._maps = []
+        self.terms = self._map("terms.bin", "Q")
+        self.offsets = self._map("offsets.bin", "Q")
+        self.postings_data = self._map("postings.bin", "I")
+        self.doclens = self._map("doclens.bin", "I")
+        self.doc_offsets = self._map("docs.idx", "Q")
+        self._docs_file = open(os.path.join(directory, "docs.jsonl"), "rb")
+
+    def _map(self, filename, typecode):
+        mapped, view = _map_array(os.path.join(self.directory, filename), typecode)
+        if mapped is not None:
+            self._maps.append((mapped, view))
+        return view
+
+    def postings(self, term):
+        """termを含む文書IDの列（含まない場合は空）"""
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return self.postings_data[self.offsets[i] : self.offsets[i + 1]]
+        return ()
+
+    def doc_len(self, doc_id):
+        return self.doclens[doc_id - self.doc_start]
+
+    def document(self, doc_id):
+        local_id = doc_id - self.doc_start
+        start, end = self.doc_offsets[local_id], self.doc_offsets[local_id + 1]
+        self._docs_file.seek(start)
+        doc = json.loads(self._docs_file.read(end - start))
+        return doc["text"], doc["metadata"]
+
+    def close(self):
+        for mapped, view in self._maps:
+            view.release()
+            mapped.close()
+        self._maps = []
+        self._docs_file.close()
+
+
+class KeywordIndex:
+    """
+    永続化したインデックスに対するBM25検索
+    最初の検索時にmanifestを読み込み、以降はmanifestが更新されていれば新しいセグメントを開く
+    """
+
+    def __init__(self, path=INDEX_PATH, tokenize=ngram_ids):
+        self.path = path
+        self.tokenize = tokenize
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self._segments = []
+        self.version = None
+        self.doc_count = 0
+        self.avgdl = 0.0
+        self.eps = 0.0
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, MANIFEST))
+
+    def current_version(self):
+        """manifestのversion（文書の追加・インデックスの作り直しのたびに増える）"""
+        with self._lock:
+            self._refresh()
+            return self.version
+
+    def _refresh(self):
+        """
+        manifestが変わっていれば読み込み直す（開いているセグメントは再利用）
+        manifestがない場合（インデックスをまだ作っていない）は空のインデックスとして扱う
+        """
+        manifest_path = os.path.join(self.path, MANIFEST)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            self._close_segments()
+            self.version = None
+            self.doc_count = 0
+            self.avgdl = 0.0
+            self.eps = 0.0
+            return
+        if mtime == self._manifest_mtime:
+            return
+        manifest = _read_manifest(self.path)
+        if manifest["ngram"] != [NGRAM_MIN, NGRAM_MAX] or manifest["hash_base"] != HASH_BASE:
+            raise ValueError("キーワードインデックスのトークン設定が一致しません。作り直してください")
+
+        opened = {segment.name: segment for segment in self._segments}
+        segments = []
+        for info in manifest["segments"]:
+            segment = opened.pop(info["name"], None)
+            if segment is None:
+                segment = Segment(os.path.join(self.path, info["name"]), info)
+            segments.append(segment)
+        for segment in opened.values():
+            segment.close()
+
+        self._segments = segments
+        self.version = manifest["version"]
+        self.doc_count = manifest["doc_count"]
+        self.avgdl = manifest["total_len"] / self.doc_count if self.doc_count else 0.0
+        # BM25Okapi: 負のidfは epsilon * (全termのidfの平均) に置き換える
+        vocabulary = sum(count for _, count in manifest["df_histogram"])
+        idf_sum = sum(count * bm25_idf(self.doc_count, df) for df, count in manifest["df_histogram"])
+        self.eps = EPSILON * idf_sum / vocabulary if vocabulary else 0.0
+        self._manifest_mtime = mtime
+
+    def _segment_of(self, doc_id):
+        starts = [segment.doc_start for segment in self._segments]
+        return self._segments[bisect.bisect_right(starts, doc_id) - 1]
+
+    def search(self, query, k=4):
+        """
+        BM25スコアの上位k件を返す: [(score, doc_id), ...]
+        スコアが同じ場合は文書IDの大きい順（BM25Retrieverのargsort逆順に合わせる）
+        """
+        with self._lock:
+            self._refresh()
+            if self.doc_count == 0:
+                return []
+
+            scores = {}
+            for term in map(int, self.tokenize(query)):
+                segment_postings = [(segment, segment.postings(term)) for segment in self._segments]
+                df = sum(len(postings) for _, postings in segment_postings)
+                if df == 0:
+                    continue
+                idf = bm25_idf(self.doc_count, df)
+                if idf < 0:
+                    idf = self.eps
+                for segment, postings in segment_postings:
+                    for doc_id in postings:
+                        dl = segment.doc_len(doc_id)
+                        # tfは常に1: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+                        score = idf * (K1 + 1) / (1 + K1 * (1 - B + B * dl / self.avgdl))
+                        scores[doc_id] = scores.get(doc_id, 0.0) + score
+
+            ranked = sorted(((score, doc_id) for doc_id, score in scores.items()), key=lambda x: (-x[0], -x[1]))
+            results = [item for item in ranked if item[0] > 0][:k]
+            if len(results) < k:
+                # スコア0の文書（どのn-gramも含まない文書を含む）を文書IDの大きい順に補う
+                doc_id = self.doc_count - 1
+                while len(results) < k and doc_id >= 0:
+                    if scores.get(doc_id, 0.0) == 0:
+                        results.append((0.0, doc_id))
+                    doc_id -= 1
+                results += [item for item in ranked if item[0] < 0][: k - len(results)]
+            return results
+
+    def documents(self, doc_ids):
+        """文書IDから (text, metadata) を取得"""
+        with self._lock:
+            self._refresh()
+            return [self._segment_of(doc_id).document(doc_id) for doc_id in doc_ids]
+
+    def _close_segments(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+        self._manifest_mtime = None
+
+    def close(self):
+        with self._lock:
+            self._close_segments()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="キーワードインデックスの管理")
+    parser.add_argument("command", choices=["stats", "compact"])
+    parser.add_argument("--path", default=INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compact(args.path)
+    manifest = _read_manifest(args.path)
+    if manifest is None:
+        print(f"インデックスが存在しません: {args.path}")
+        return
+    vocabulary = sum(count for _, count in manifest["df_histogram"])
+    print(f"バージョン: {manifest['version']}")
+    print(f"文書数: {manifest['doc_count']}")
+    print(f"セグメント数: {len(manifest['segments'])}")
+    print(f"語彙数: {vocabulary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# キーワード検索用の文字n-gramトークナイザ（n-gramを64bitハッシュのIDに変換する）
+#
+# RAGChatBot.preprocess_func と同じトークン（3〜5文字のn-gramの重複なし集合、
+# 3文字未満のテキストはテキスト全体）を文字列ではなくハッシュ値で返す。
+# ngram_ids / batch_ngram_ids はNumPyで全位置のハッシュをまとめて計算する高速版で、
+# text_to_ngram_ids（1文字ずつ計算する参照実装）と同じ値を返す。
+import numpy as np
+
+NGRAM_MIN = 3
+NGRAM_MAX = 5
+HASH_BASE = 1000003  # 多項式ハッシュの基数（奇数）
+HASH_MASK = (1 << 64) - 1
+
+BATCH_SIZE = 256  # batch_ngram_idsで一度に処理する文書数
+
+_BASE = np.uint64(HASH_BASE)
+
+
+def ngram_hash(ngram):
+    """n-gramの64bit多項式ハッシュ: Σ (code_point + 1) * HASH_BASE^(n-1-i) mod 2^64"""
+    h = 0
+    for ch in ngram:
+        h = (h * HASH_BASE + ord(ch) + 1) & HASH_MASK
+    return h
+
+
+def text_to_ngram_ids(text, min_n=NGRAM_MIN, max_n=NGRAM_MAX):
+    """参照実装: n-gramハッシュの集合"""
+    if len(text) < min_n:
+        return {ngram_hash(text)}
+    ids = set()
+    for n in range(min_n, max_n + 1):
+        for k in range(len(text) - n + 1):
+            ids.add(ngram_hash(text[k : k + n]))
+    return ids
+
+
+def _codepoints(text):
+    """文字列をコードポイント+1のuint64配列に変換"""
+    return np.frombuffer(text.encode("utf-32-le"), dtype="<u4").astype(np.uint64) + np.uint64(1)
+
+
+def _rolling_hashes(codes, min_n, max_n):
+    """
+    全位置のmin_n〜max_n文字n-gramのハッシュを計算
+    h_n[k] = h_(n-1)[k] * BASE + c[k+n-1]（uint64の演算は2^64で自然に剰余になる）
+
+    :return: [(n, hashes), ...]  hashes[k] は位置kから始まるn文字のn-gram
+    """
+    result = []
+    h = codes
+    for n in range(2, max_n + 1):
+        if len(codes) < n:
+            break
+        h = h[:-1] * _BASE + codes[n - 1 :]
+        if n >= min_n:
+            result.append((n, h))
+    if min_n == 1:
+        result.insert(0, (1, codes))
+    return result
+
+
+def ngram_ids(text, min_n=NGRAM_MIN, max_n=NGRAM_MAX):
+    """1つのテキストのn-gramハッシュ（重複なし・昇順のuint64配列）"""
+    if len(text) < min_n:
+        return np.array([ngram_hash(text)], dtype=np.uint64)
+    hashes = [h for _, h in _rolling_hashes(_codepoints(text), min_n, max_n)]
+    return np.unique(np.concatenate(hashes))
+
+
+def batch_ngram_ids(texts, min_n=NGRAM_MIN, max_n=NGRAM_MAX, batch_size=BATCH_SIZE):
+    """
+    複数のテキストのn-gramハッシュを計算（テキストごとに重複なし・昇順のuint64配列）
+    batch_size件ずつ連結してローリングハッシュを計算し、文書の境界をまたぐn-gramは除外する
+    """
+    results = []
+    for start in range(0, len(texts), batch_size):
+        results.extend(_batch_ngram_ids(texts[start : start + batch_size], min_n, max_n))
+    return results
+
+
+def _batch_ngram_ids(texts, min_n, max_n):
+    results = [None] * len(texts)
+    long_texts = []
+    for i, text in enumerate(texts):
+        if len(text) < min_n:
+            results[i] = np.array([ngram_hash(text)], dtype=np.uint64)
+        else:
+            long_texts.append(i)
+    if not long_texts:
+        return results
+
+    lengths = np.array([len(texts[i]) for i in long_texts], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths))).tolist()
+    codes = _codepoints("".join(texts[i] for i in long_texts))
+    rolling = _rolling_hashes(codes, min_n, max_n)
+
+    # ハッシュは連結した配列でまとめて計算し、重複除去は文書ごとのスライスで行う
+    # （位置kのn-gramは k+n-1 が同じ文書にある場合のみ有効なので、文書末尾のn-1件を除く）
+    for j, i in enumerate(long_texts):
+        start, end = starts[j], starts[j + 1]
+        results[i] = np.unique(np.concatenate([hashes[start : end - n + 1] for n, hashes in rolling]))
+    return results
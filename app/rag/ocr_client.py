@@ -0,0 +1,233 @@
+# Document AIによるOCR（共有クライアント・同時リクエスト数の制限・OCR結果のディスクキャッシュ）
+#
+# DocumentProcessorServiceClientはプロセス内で1つだけ作り、複数のスレッドから共有する。
+# OCRの結果はPDFの内容のハッシュ（とプロセッサ・オプション）をキーに保存するため、
+# pdf_chunking.py のチャンク分割を調整して取り込み直すときに同じPDFを再度OCRしない。
+#
+# オフラインの検証では ReplayDocumentAIClient で記録済みの結果（OCRキャッシュのディレクトリ）を再生する:
+#   client = OCRClient(client=ReplayDocumentAIClient(OCR_CACHE_DIR), cache=None)
+#
+# キャッシュを使う場合、prefetch() で取り込み待ちのPDFのOCRをクライアント自身のスレッド
+# （最大concurrency件）で先に実行しておける。呼び出し側のスレッド数に関係なく同時にOCRできる。
+#
+# 使い方:
+#   python ocr_client.py stats   # キャッシュの件数・サイズを表示
+#   python ocr_client.py clear   # キャッシュを削除
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import documentai
+
+from ingest_cache import content_key
+from ingest_state import file_hash
+
+PROJECT_ID = "utopian-saga-466802-m5"
+LOCATION = "us"
+PROCESSOR_ID = "e794632016082b0"
+PROCESSOR_VERSION = "pretrained-ocr-v2.0-2023-06-02"
+MIME_TYPE = "application/pdf"
+
+OCR_CONCURRENCY = 4  # 同時に実行するOCRリクエストの数
+OCR_CACHE_DIR = "/home/fujikawa/jinshari/flask-bonsai/data/ocr_cache"
+
+
+class OCRReplayMiss(Exception):
+    """ReplayDocumentAIClientに記録されていないリクエスト"""
+
+
+def ocr_key(processor_name, content_hash, process_options=None):
+    """OCR結果のキャッシュキー（プロセッサ・オプション・PDFの内容のハッシュ）"""
+    options = documentai.ProcessOptions.to_json(process_options) if process_options else ""
+    return content_key("ocr", processor_name + "\n" + options, content_hash)
+
+
+class OCRCache:
+    """OCR結果（シリアライズしたDocument）をキーごとのファイルに保存する"""
+
+    def __init__(self, directory=OCR_CACHE_DIR):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pb")
+
+    def contains(self, key):
+        """保存済みかどうか（読み込まず、ヒット数にも数えない）"""
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        self.hits += 1
+        return documentai.Document.deserialize(data)
+
+    def put(self, key, document):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルを読まないよう一時ファイルからrenameする
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(documentai.Document.serialize(document))
+        os.replace(tmp_path, path)
+
+    def report(self):
+        return f"キャッシュ(ocr): {self.hits}/{self.hits + self.misses}件ヒット"
+
+    def stats(self):
+        entries, size = 0, 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".pb"):
+                    entries += 1
+                    size += os.path.getsize(os.path.join(root, name))
+        return {"path": self.directory, "entries": entries, "bytes": size}
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ReplayDocumentAIClient:
+    """
+    DocumentProcessorServiceClientの代わりに記録済みのOCR結果を返す（オフライン検証用）
+    記録はOCRCacheと同じ形式のディレクトリ（通常の実行でOCRキャッシュに保存されたもの）
+    """
+
+    def __init__(self, directory=OCR_CACHE_DIR):
+        self.recordings = OCRCache(directory)
+
+    def processor_version_path(self, project, location, processor, processor_version):
+        return f"projects/{project}/locations/{location}/processors/{processor}/processorVersions/{processor_version}"
+
+    def process_document(self, request):
+        content_hash = hashlib.sha256(request.raw_document.content).hexdigest()
+        options = request.process_options if "process_options" in request else None
+        document = self.recordings.get(ocr_key(request.name, content_hash, options))
+        if document is None:
+            raise OCRReplayMiss(f"記録されていないOCRリクエストです (sha256={content_hash[:12]})")
+        return documentai.ProcessResponse(document=document)
+
+
+class OCRClient:
+    """
+    共有のDocument AIクライアント
+    複数のスレッドから呼び出せる。同時に実行するリクエスト（とメモリに読み込むPDF）は最大concurrency件
+    """
+
+    def __init__(self, client=None, concurrency=OCR_CONCURRENCY, cache=None):
+        """
+        :param client: DocumentProcessorServiceClient（NoneならここでAPIクライアントを作成）
+        :param cache: OCRCache（Noneならキャッシュしない）
+        """
+        self.client = client if client is not None else documentai.DocumentProcessorServiceClient()
+        self.name = self.client.processor_version_path(PROJECT_ID, LOCATION, PROCESSOR_ID, PROCESSOR_VERSION)
+        self.cache = cache
+        self.concurrency = concurrency
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._key_locks = {}  # 同じ内容のPDFを同時にOCRしないためのキーごとのロック
+        self._executor = None  # prefetch用（最初の呼び出しで作成）
+        self.requests = 0
+
+    def process_file(self, path, content_hash=None, process_options=None):
+        """
+        PDFファイルをOCRしてdocumentai.Documentを返す
+        キャッシュにある場合はファイルを読み込まずに返す
+
+        :param content_hash: 計算済みのファイル内容のSHA-256（省略時はここで計算）
+        """
+        if content_hash is None:
+            content_hash = file_hash(path)
+        key = ocr_key(self.name, content_hash, process_options)
+        if self.cache is None:
+            return self._request(path, process_options)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            document = self.cache.get(key)
+            if document is None:
+                document = self._request(path, process_options)
+                self.cache.put(key, document)
+        return document
+
+    def prefetch(self, path, content_hash=None, process_options=None):
+        """
+        PDFのOCRをクライアントのスレッドで実行してキャッシュに保存する（結果はメモリに残さない）
+        あとで process_file を呼ぶとキャッシュから返る（OCR中ならその完了を待つ）
+        キャッシュを使わない場合は何もしない（Noneを返す）
+
+        :return: 完了を表すFuture
+        """
+        if self.cache is None:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ocr")
+        return self._executor.submit(self._prefetch, path, content_hash, process_options)
+
+    def _prefetch(self, path, content_hash, process_options):
+        if content_hash is None:
+            content_hash = file_hash(path)
+        key = ocr_key(self.name, content_hash, process_options)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if not self.cache.contains(key):
+                self.cache.put(key, self._request(path, process_options))
+
+    def close(self):
+        """prefetchの実行中のOCRを待ってスレッドを終了する"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _request(self, path, process_options):
+        with self._semaphore:
+            with open(path, "rb") as f:
+                content = f.read()
+            request = documentai.ProcessRequest(
+                name=self.name,
+                raw_document=documentai.RawDocument(content=content, mime_type=MIME_TYPE),
+            )
+            if process_options is not None:
+                request.process_options = process_options
+            document = self.client.process_document(request=request).document
+        with self._lock:
+            self.requests += 1
+        return document
+
+    def report(self):
+        lines = [f"OCRリクエスト: {self.requests}件"]
+        if self.cache is not None:
+            lines.append(self.cache.report())
+        return "\n".join(lines)
+
+
+def main():
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="OCRキャッシュの管理")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--path", default=OCR_CACHE_DIR)
+    args = parser.parse_args()
+
+    cache = OCRCache(args.path)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    else:
+        cache.clear()
+        print("キャッシュを削除しました")
+
+
+if __name__ == "__main__":
+    main()
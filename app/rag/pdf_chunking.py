@@ -1,7 +1,24 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple, NamedTuple, Optional, Iterable, Iterator
+from bisect import bisect_left
+from collections import deque
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+import multiprocessing
+import sys
+import time
 from google.cloud import documentai
 from datetime import datetime
 
+PARALLEL_MIN_PAGES = 32  # これより少ないページ数の文書はプロセスプールを使わない（起動・受け渡しのほうが重くなる）
+PAGES_PER_TASK = 16  # プロセスプールの1タスクで処理するページ数
+PARALLEL_PENDING_TASKS = 8  # 結果を待つタスクの最大数（ページを読み進めた分だけ投入し、結果を溜めすぎない）
+
+# merge_paragraph_chunksの結合方法
+MERGE_SEQUENTIAL = "sequential"  # 読み順で隣り合うチャンクだけを結合する（従来の結果を再現する）
+MERGE_SPATIAL = "spatial"  # ページ上で近いチャンクを結合する
+MERGE_MODES = (MERGE_SEQUENTIAL, MERGE_SPATIAL)
+
 # --- test.pyからの関数移植 ---
 # analyze_text_orientation, analyze_bounding_box_orientation, get_docai_orientation, get_line_coordinates
 # analyze_paragraph_orientation, calculate_paragraph_bounds_from_lines, calculate_paragraph_distance_from_bounds
@@ -293,16 +310,16 @@ def calculate_paragraph_bounds_from_lines(lines_data: List[Dict]) -> Dict:
         "height": max_y - min_y
     }
 
-def calculate_paragraph_distance_from_bounds(bounds1: Dict, bounds2: Dict) -> float:
+def calculate_paragraph_distance_from_bounds(bounds1: "Bounds", bounds2: "Bounds") -> float:
     """
     段落の境界情報から最短距離を計算する（横・縦両方向を考慮）
     """
     if not bounds1 or not bounds2:
         return float('inf')
-    x1_min, x1_max = bounds1["min_x"], bounds1["max_x"]
-    y1_min, y1_max = bounds1["min_y"], bounds1["max_y"]
-    x2_min, x2_max = bounds2["min_x"], bounds2["max_x"]
-    y2_min, y2_max = bounds2["min_y"], bounds2["max_y"]
+    x1_min, x1_max = bounds1.min_x, bounds1.max_x
+    y1_min, y1_max = bounds1.min_y, bounds1.max_y
+    x2_min, x2_max = bounds2.min_x, bounds2.max_x
+    y2_min, y2_max = bounds2.min_y, bounds2.max_y
     if x1_max < x2_min:
         x_distance = x2_min - x1_max
     elif x2_max < x1_min:
@@ -324,57 +341,51 @@ def calculate_paragraph_distance_from_bounds(bounds1: Dict, bounds2: Dict) -> fl
     else:
         return (x_distance ** 2 + y_distance ** 2) ** 0.5
 
-def should_merge_paragraphs(para1, para2, max_distance=100, max_chars_per_chunk=1500) -> bool:
+def should_merge_paragraphs(para1: "Chunk", para2: "Chunk", max_distance=100, max_chars_per_chunk=1500) -> bool:
     """
     2つの段落を結合すべきかどうかを判定する
     """
-    combined_length = len(para1["text"]) + len(para2["text"])
+    combined_length = len(para1.text) + len(para2.text)
     if combined_length > max_chars_per_chunk:
         return False
-    if para1["page_number"] != para2["page_number"]:
+    if para1.page_number != para2.page_number:
         return False
-    if para1["orientation"]["is_vertical"] != para2["orientation"]["is_vertical"]:
+    if para1.orientation is not para2.orientation:
         return False
-    if para1["bounds"] and para2["bounds"]:
-        bounds1, bounds2 = para1["bounds"], para2["bounds"]
-        distance = calculate_paragraph_distance_from_bounds(bounds1, bounds2)
+    if para1.bounds and para2.bounds:
+        distance = calculate_paragraph_distance_from_bounds(para1.bounds, para2.bounds)
         if distance > max_distance:
             return False
     else:
-        if len(para1["text"].strip()) < 100 and len(para2["text"].strip()) < 100:
+        if len(para1.text.strip()) < 100 and len(para2.text.strip()) < 100:
             return True
     return True
 
-def merge_paragraph_chunks(chunks: List[Dict], max_distance=20, max_chars_per_chunk=1500) -> List[Dict]:
+def merge_paragraph_chunks(chunks: List["Chunk"], max_distance=20, max_chars_per_chunk=1500,
+                           mode: str = MERGE_SEQUENTIAL) -> List["Chunk"]:
     """
-    段落チャンクを適切に結合する
+    段落チャンクを適切に結合する（元のチャンクは変更しない）
+    mode:
+        MERGE_SEQUENTIAL: Document AIの読み順で隣り合うチャンクだけを結合する（従来の結果）
+        MERGE_SPATIAL: ページ上で近い同じ向きのチャンクを読み順に関係なく結合する（merge_paragraph_chunks_spatial）
     """
+    if mode == MERGE_SPATIAL:
+        return merge_paragraph_chunks_spatial(chunks, max_distance, max_chars_per_chunk)
+    if mode != MERGE_SEQUENTIAL:
+        raise ValueError(f"未対応の結合方法です: {mode}")
     if not chunks:
         return chunks
     merged_chunks = []
     i = 0
     while i < len(chunks):
         current_chunk = chunks[i].copy()
-        current_chunk["metadata"] = current_chunk["metadata"].copy()
         merged_paragraphs = [current_chunk]
         j = i + 1
         while j < len(chunks):
             next_chunk = chunks[j]
-            current_para_data = {
-                "text": merged_paragraphs[-1]["text"],
-                "orientation": merged_paragraphs[-1]["metadata"]["orientation_details"],
-                "bounds": merged_paragraphs[-1].get("_bounds"),
-                "page_number": merged_paragraphs[-1]["metadata"]["page_number"]
-            }
-            next_para_data = {
-                "text": next_chunk["text"],
-                "orientation": next_chunk["metadata"]["orientation_details"],
-                "bounds": next_chunk.get("_bounds"),
-                "page_number": next_chunk["metadata"]["page_number"]
-            }
             if should_merge_paragraphs(
-                current_para_data, 
-                next_para_data, 
+                merged_paragraphs[-1], 
+                next_chunk, 
                 max_distance,
                 max_chars_per_chunk
             ):
@@ -383,106 +394,295 @@ def merge_paragraph_chunks(chunks: List[Dict], max_distance=20, max_chars_per_ch
             else:
                 break
         if len(merged_paragraphs) > 1:
-            merged_text = "\n".join([p["text"] for p in merged_paragraphs])
-            current_chunk["text"] = merged_text
-            current_chunk["metadata"]["chunk_type"] = "merged_paragraph"
-            current_chunk["metadata"]["original_chunk_count"] = len(merged_paragraphs)
-            current_chunk["metadata"]["chunk_length"] = len(merged_text)
-            current_chunk["metadata"]["merged_chunk_count"] = len(merged_paragraphs)
-            current_chunk["metadata"]["merged_from_ids"] = [p["chunk_id"] for p in merged_paragraphs]
-            confidences = [p["metadata"]["orientation_confidence"] for p in merged_paragraphs]
-            current_chunk["metadata"]["orientation_confidence"] = sum(confidences) / len(confidences)
-            current_chunk["metadata"]["merge_details"] = {
-                "merged_texts": [p["text"][:50] + "..." if len(p["text"]) > 50 else p["text"] for p in merged_paragraphs],
-                "original_orientations": [p["metadata"]["text_orientation"] for p in merged_paragraphs],
-                "merge_criteria": "distance_and_orientation"
+            current_chunk.text = "\n".join([p.text for p in merged_paragraphs])
+            current_chunk.chunk_type = "merged_paragraph"
+            confidences = [p.confidence for p in merged_paragraphs]
+            current_chunk.confidence = sum(confidences) / len(confidences)
+            current_chunk.merge = {
+                "original_chunk_count": len(merged_paragraphs),
+                "merged_chunk_count": len(merged_paragraphs),
+                "merged_from_ids": [p.chunk_id for p in merged_paragraphs],
+                "merge_details": {
+                    "merged_texts": [p.text[:50] + "..." if len(p.text) > 50 else p.text for p in merged_paragraphs],
+                    "original_orientations": [p.orientation.value for p in merged_paragraphs],
+                    "merge_criteria": "distance_and_orientation"
+                }
             }
         merged_chunks.append(current_chunk)
         i += len(merged_paragraphs)
     for idx, chunk in enumerate(merged_chunks):
-        chunk["chunk_id"] = idx
-        chunk["metadata"]["final_chunk_id"] = idx
+        chunk.chunk_id = idx
+        chunk.final_chunk_id = idx
     return merged_chunks
 
-def extract_document_chunks(document: documentai.Document, base_metadata: Dict) -> List[Dict]:
+def iter_merged_chunks(chunks: Iterable["Chunk"], max_distance=20, max_chars_per_chunk=1500,
+                       mode: str = MERGE_SEQUENTIAL) -> Iterator["Chunk"]:
+    """
+    merge_paragraph_chunksのジェネレータ版（iter_document_chunksと組み合わせて1ページ分ずつ結合する）
+    どちらの結合方法もページをまたいで結合しないため、同じページの連続するチャンクだけを溜めて結合する。
+    chunk_id・final_chunk_idは結合後の通し番号（ページ順に並んだ入力ではmerge_paragraph_chunksと同じ結果）
+    """
+    chunk_id = 0
+    for _, page in groupby(chunks, key=lambda chunk: chunk.page_number):
+        for merged in merge_paragraph_chunks(list(page), max_distance, max_chars_per_chunk, mode):
+            merged.chunk_id = merged.final_chunk_id = chunk_id
+            chunk_id += 1
+            yield merged
+
+def merge_paragraph_chunks_spatial(chunks: List["Chunk"], max_distance=20, max_chars_per_chunk=1500) -> List["Chunk"]:
+    """
+    ページごとに段落の境界をグリッドに登録し、距離がmax_distance以下の同じ向きの段落を結合する
+    - 近い組から順に結合し、結合後のテキストがmax_chars_per_chunk文字を超える組は結合しない
+    - 結合したチャンク内の順序・ページ内のチャンクの順序は座標で決める（縦書きは右から、横書きは上から）
+    - 境界のないチャンクは結合せず、ページの最後に元の順序で置く
+    """
+    pages = {}
+    for chunk in chunks:
+        pages.setdefault(chunk.page_number, []).append(chunk)
+    merged_chunks = []
+    for page_number in sorted(pages):
+        page_chunks = pages[page_number]
+        positioned = [chunk for chunk in page_chunks if chunk.bounds]
+        groups = _group_adjacent_chunks(positioned, max_distance, max_chars_per_chunk)
+        groups = [sorted(group, key=_reading_position) for group in groups]
+        groups.sort(key=lambda group: _reading_position(group[0]))
+        groups += [[chunk] for chunk in page_chunks if not chunk.bounds]
+        for group in groups:
+            merged_chunks.append(_merge_chunk_group(group))
+    for idx, chunk in enumerate(merged_chunks):
+        chunk.chunk_id = idx
+        chunk.final_chunk_id = idx
+    return merged_chunks
+
+def _group_adjacent_chunks(chunks: List["Chunk"], max_distance, max_chars_per_chunk) -> List[List["Chunk"]]:
+    """1ページの境界のあるチャンクを結合するグループに分ける（グリッドで近傍の候補を探し、Union-Findでまとめる）"""
+    if not chunks:
+        return []
+    # セルの大きさは段落の大きさの中央値程度にする（1つの段落が登録されるセル・近傍として調べるセルを少なくする）
+    sizes = sorted(max(chunk.bounds.width, chunk.bounds.height) for chunk in chunks)
+    cell_size = max(max_distance, sizes[len(sizes) // 2], 1)
+    grid = {}
+    for idx, chunk in enumerate(chunks):
+        for cell in _grid_cells(chunk.bounds, 0, cell_size):
+            grid.setdefault(cell, []).append(idx)
+
+    candidates = []
+    for idx, chunk in enumerate(chunks):
+        neighbors = set()
+        for cell in _grid_cells(chunk.bounds, max_distance, cell_size):
+            neighbors.update(grid.get(cell, ()))
+        for other in neighbors:
+            if other <= idx or chunks[other].orientation is not chunk.orientation:
+                continue
+            distance = calculate_paragraph_distance_from_bounds(chunk.bounds, chunks[other].bounds)
+            if distance <= max_distance:
+                # 距離が同じ組は座標順にして、入力（読み順）によって結果が変わらないようにする
+                first, second = sorted((chunk.bounds, chunks[other].bounds))
+                candidates.append((distance, first, second, idx, other))
+    candidates.sort(key=lambda candidate: candidate[:3])
+
+    parent = list(range(len(chunks)))
+    length = [len(chunk.text) for chunk in chunks]  # グループを"\n"で結合したテキストの文字数
+
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    for _, _, _, a, b in candidates:
+        root_a, root_b = find(a), find(b)
+        if root_a == root_b or length[root_a] + 1 + length[root_b] > max_chars_per_chunk:
+            continue
+        parent[root_b] = root_a
+        length[root_a] += 1 + length[root_b]
+
+    groups = {}
+    for idx, chunk in enumerate(chunks):
+        groups.setdefault(find(idx), []).append(chunk)
+    return list(groups.values())
+
+def _grid_cells(bounds: "Bounds", margin, cell_size):
+    """境界をmarginだけ広げた範囲と重なるグリッドのセル"""
+    min_col, max_col = int((bounds.min_x - margin) // cell_size), int((bounds.max_x + margin) // cell_size)
+    min_row, max_row = int((bounds.min_y - margin) // cell_size), int((bounds.max_y + margin) // cell_size)
+    return [(col, row) for col in range(min_col, max_col + 1) for row in range(min_row, max_row + 1)]
+
+def _reading_position(chunk: "Chunk"):
+    """座標による読み順（縦書きは右の列から、横書きは上の行から）"""
+    if chunk.orientation is TextOrientation.VERTICAL:
+        return (-chunk.bounds.max_x, chunk.bounds.min_y)
+    return (chunk.bounds.min_y, chunk.bounds.min_x)
+
+def _merge_chunk_group(group: List["Chunk"]) -> "Chunk":
+    """グループのチャンクを1つにまとめる（1件ならコピーをそのまま返す）"""
+    merged = group[0].copy()
+    if len(group) == 1:
+        return merged
+    merged.text = "\n".join([p.text for p in group])
+    merged.chunk_type = "merged_paragraph"
+    merged.confidence = sum(p.confidence for p in group) / len(group)
+    merged.bounds = Bounds(
+        min(p.bounds.min_x for p in group),
+        max(p.bounds.max_x for p in group),
+        min(p.bounds.min_y for p in group),
+        max(p.bounds.max_y for p in group)
+    )
+    merged.merge = {
+        "original_chunk_count": len(group),
+        "merged_chunk_count": len(group),
+        "merged_from_ids": [p.chunk_id for p in group],
+        "merge_details": {
+            "merged_texts": [p.text[:50] + "..." if len(p.text) > 50 else p.text for p in group],
+            "original_orientations": [p.orientation.value for p in group],
+            "merge_criteria": "spatial_grid"
+        }
+    }
+    return merged
+
+def extract_document_chunks(document: documentai.Document, base_metadata: Dict,
+                            executor=None, min_pages: int = PARALLEL_MIN_PAGES) -> List["Chunk"]:
     """
     Document AIの段落構造に基づいてチャンクを抽出する（境界情報付き）
+    executorにプロセスプール（create_page_pool）を渡すとページをPAGES_PER_TASKページずつ並列に処理する。
+    ページ数がmin_pages未満の文書はプールを使わずに処理する。
+    チャンクの順序・chunk_idはどちらの場合も同じ（ページ順の通し番号）
     """
-    chunks = []
+    return list(iter_document_chunks(document, base_metadata, executor, min_pages))
+
+def iter_document_chunks(document: documentai.Document, base_metadata: Dict,
+                         executor=None, min_pages: int = PARALLEL_MIN_PAGES) -> Iterator["Chunk"]:
+    """
+    extract_document_chunksのジェネレータ版（1ページ分ずつチャンクを抽出して返す）
+    base_metadataへの判定方法の集計（orientation_method_stats）の追加は最後のチャンクを返した後に行う
+    """
+    # チャンクのメタデータは文書ごとに1つのコピーを共有する（base_metadataにはこのあと集計を追加するため）
+    shared_metadata = dict(base_metadata)
+    if executor is None or len(document.pages) < min_pages:
+        page_results = (
+            extract_page_chunks(page, page_idx, document.text, shared_metadata)
+            for page_idx, page in enumerate(document.pages)
+        )
+    else:
+        page_results = extract_pages_parallel(executor, document, shared_metadata)
     chunk_id = 0
     method_stats = {}
-    for page_idx, page in enumerate(document.pages):
-        if hasattr(page, 'paragraphs') and page.paragraphs:
-            for para_idx, paragraph in enumerate(page.paragraphs):
-                paragraph_text = extract_text_from_layout(paragraph.layout, document.text)
-                if paragraph_text.strip():
-                    lines_in_paragraph = []
-                    para_start, para_end = get_text_range(paragraph.layout)
-                    if hasattr(page, 'lines') and page.lines:
-                        for line in page.lines:
-                            line_start, line_end = get_text_range(line.layout)
-                            if (line_start is not None and line_end is not None and 
-                                para_start is not None and para_end is not None and
-                                line_start >= para_start and line_end <= para_end):
-                                line_text = extract_text_from_layout(line.layout, document.text)
-                                if line_text.strip():
-                                    line_orientation = analyze_text_orientation(line.layout, line_text)
-                                    line_coordinates = get_line_coordinates(line.layout)
-                                    lines_in_paragraph.append({
-                                        "text": line_text,
-                                        "orientation": line_orientation,
-                                        "coordinates": line_coordinates
-                                    })
-                    if lines_in_paragraph:
-                        paragraph_orientation = analyze_paragraph_orientation(lines_in_paragraph)
-                        paragraph_bounds = calculate_paragraph_bounds_from_lines(lines_in_paragraph)
-                    else:
-                        paragraph_orientation = analyze_text_orientation(paragraph.layout, paragraph_text)
-                        paragraph_bounds = None
-                    method = paragraph_orientation["method"]
-                    if method not in method_stats:
-                        method_stats[method] = 0
-                    method_stats[method] += 1
-                    chunk = create_chunk(
-                        chunk_id=chunk_id,
-                        text=paragraph_text.strip(),
-                        chunk_type="paragraph",
-                        base_metadata=base_metadata,
-                        page_number=page_idx + 1,
-                        element_index=para_idx,
-                        orientation_analysis=paragraph_orientation,
-                        paragraph_layout=paragraph.layout,
-                        paragraph_bounds=paragraph_bounds
-                    )
-                    chunks.append(chunk)
-                    chunk_id += 1
-        elif hasattr(page, 'lines') and page.lines:
-            for line_idx, line in enumerate(page.lines):
-                line_text = extract_text_from_layout(line.layout, document.text)
-                if line_text.strip():
-                    orientation_analysis = analyze_text_orientation(line.layout, line_text)
-                    line_coordinates = get_line_coordinates(line.layout)
-                    method = orientation_analysis["method"]
-                    if method not in method_stats:
-                        method_stats[method] = 0
-                    method_stats[method] += 1
-                    chunk = create_chunk(
-                        chunk_id=chunk_id,
-                        text=line_text.strip(),
-                        chunk_type="line",
-                        base_metadata=base_metadata,
-                        page_number=page_idx + 1,
-                        element_index=line_idx,
-                        orientation_analysis=orientation_analysis,
-                        paragraph_layout=line.layout,
-                        paragraph_bounds={"min_x": line_coordinates["min_x"], "max_x": line_coordinates["max_x"], 
-                                        "min_y": line_coordinates["min_y"], "max_y": line_coordinates["max_y"], 
-                                        "width": line_coordinates["width"], "height": line_coordinates["height"]} if line_coordinates else None
-                    )
-                    chunks.append(chunk)
-                    chunk_id += 1
+    for page_chunks, page_stats in page_results:
+        for method, count in page_stats.items():
+            method_stats[method] = method_stats.get(method, 0) + count
+        for chunk in page_chunks:
+            chunk.chunk_id = chunk_id
+            chunk_id += 1
+            yield chunk
     base_metadata["orientation_method_stats"] = method_stats
-    return chunks
+
+def extract_page_chunks(page, page_idx: int, full_text: str, base_metadata: Dict) -> Tuple[List["Chunk"], Dict]:
+    """
+    1ページのチャンクを抽出する
+    戻り値: (チャンクのリスト（chunk_idはページ内の通し番号）, 判定方法ごとの段落・行数)
+    """
+    chunks = []
+    method_stats = {}
+    if hasattr(page, 'paragraphs') and page.paragraphs:
+        # 段落ごとに全行を走査しないよう、ページの行をテキスト範囲で索引しておく
+        line_index = build_line_index(page.lines) if hasattr(page, 'lines') and page.lines else None
+        for para_idx, paragraph in enumerate(page.paragraphs):
+            paragraph_text = extract_text_from_layout(paragraph.layout, full_text)
+            if paragraph_text.strip():
+                lines_in_paragraph = []
+                para_start, para_end = get_text_range(paragraph.layout)
+                if line_index is not None and para_start is not None and para_end is not None:
+                    for line_idx in find_lines_in_range(line_index, para_start, para_end):
+                        line = page.lines[line_idx]
+                        line_text = extract_text_from_layout(line.layout, full_text)
+                        if line_text.strip():
+                            line_orientation = analyze_text_orientation(line.layout, line_text)
+                            line_coordinates = get_line_coordinates(line.layout)
+                            lines_in_paragraph.append({
+                                "text": line_text,
+                                "orientation": line_orientation,
+                                "coordinates": line_coordinates
+                            })
+                if lines_in_paragraph:
+                    paragraph_orientation = analyze_paragraph_orientation(lines_in_paragraph)
+                    paragraph_bounds = calculate_paragraph_bounds_from_lines(lines_in_paragraph)
+                else:
+                    paragraph_orientation = analyze_text_orientation(paragraph.layout, paragraph_text)
+                    paragraph_bounds = None
+                method = paragraph_orientation["method"]
+                if method not in method_stats:
+                    method_stats[method] = 0
+                method_stats[method] += 1
+                chunk = create_chunk(
+                    chunk_id=len(chunks),
+                    text=paragraph_text.strip(),
+                    chunk_type="paragraph",
+                    base_metadata=base_metadata,
+                    page_number=page_idx + 1,
+                    element_index=para_idx,
+                    orientation_analysis=paragraph_orientation,
+                    paragraph_bounds=paragraph_bounds
+                )
+                chunks.append(chunk)
+    elif hasattr(page, 'lines') and page.lines:
+        for line_idx, line in enumerate(page.lines):
+            line_text = extract_text_from_layout(line.layout, full_text)
+            if line_text.strip():
+                orientation_analysis = analyze_text_orientation(line.layout, line_text)
+                line_coordinates = get_line_coordinates(line.layout)
+                method = orientation_analysis["method"]
+                if method not in method_stats:
+                    method_stats[method] = 0
+                method_stats[method] += 1
+                chunk = create_chunk(
+                    chunk_id=len(chunks),
+                    text=line_text.strip(),
+                    chunk_type="line",
+                    base_metadata=base_metadata,
+                    page_number=page_idx + 1,
+                    element_index=line_idx,
+                    orientation_analysis=orientation_analysis,
+                    paragraph_bounds=line_coordinates
+                )
+                chunks.append(chunk)
+    return chunks, method_stats
+
+def create_page_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    extract_document_chunksのページ並列処理用のプロセスプール
+    gRPCのスレッドを持つ親プロセスをforkしないようspawnで起動する（起動に時間がかかるため文書ごとではなく取り込み全体で1つ作る）
+    """
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+
+def extract_pages_parallel(executor, document: documentai.Document, base_metadata: Dict):
+    """
+    ページをPAGES_PER_TASKページずつプロセスプールで処理し、(チャンク, 判定方法の集計)をページ順に返す
+    結果を待っているタスクは最大PARALLEL_PENDING_TASKS件（呼び出し側が読み進めた分だけ次のタスクを投入する）
+    """
+    pages = document.pages
+    pending = deque()
+    for first_page in range(0, len(pages), PAGES_PER_TASK):
+        serialized = [documentai.Document.Page.serialize(page) for page in pages[first_page:first_page + PAGES_PER_TASK]]
+        pending.append(executor.submit(_extract_pages_task, serialized, first_page, document.text, base_metadata))
+        if len(pending) >= PARALLEL_PENDING_TASKS:
+            yield from _shared_page_results(pending.popleft().result(), base_metadata)
+    while pending:
+        yield from _shared_page_results(pending.popleft().result(), base_metadata)
+
+def _shared_page_results(page_results, base_metadata: Dict):
+    for page_chunks, page_stats in page_results:
+        for chunk in page_chunks:
+            # プロセス間の受け渡しでコピーされたメタデータを文書で1つの共有に戻す
+            chunk.base_metadata = base_metadata
+        yield page_chunks, page_stats
+
+def _extract_pages_task(serialized_pages, first_page: int, full_text: str, base_metadata: Dict):
+    """プロセスプールで実行する: シリアライズしたページのチャンクを抽出する"""
+    results = []
+    for page_idx, data in enumerate(serialized_pages, first_page):
+        page = documentai.Document.Page.deserialize(data)
+        results.append(extract_page_chunks(page, page_idx, full_text, base_metadata))
+    return results
 
 def extract_text_from_layout(layout, full_text: str) -> str:
     """
@@ -508,34 +708,149 @@ def get_text_range(layout):
     end_index = int(segments[-1].end_index) if segments[-1].end_index else None
     return start_index, end_index
 
+def build_line_index(lines) -> Tuple[List[int], List[Tuple[int, int, int]]]:
+    """
+    行のテキスト範囲を開始インデックス順に並べた索引を作成する
+    戻り値: (開始インデックスのリスト, (開始, 終了, 行番号)のリスト) いずれも開始インデックスの昇順
+    テキスト範囲が取得できない行は含めない
+    """
+    intervals = []
+    for line_idx, line in enumerate(lines):
+        line_start, line_end = get_text_range(line.layout)
+        if line_start is not None and line_end is not None:
+            intervals.append((line_start, line_end, line_idx))
+    intervals.sort()
+    return [interval[0] for interval in intervals], intervals
+
+def find_lines_in_range(line_index, start: int, end: int) -> List[int]:
+    """
+    テキスト範囲 [start, end] に収まる行の行番号を元の行の順に返す
+    """
+    starts, intervals = line_index
+    found = []
+    for i in range(bisect_left(starts, start), len(intervals)):
+        line_start, line_end, line_idx = intervals[i]
+        if line_start > end:
+            break
+        if line_end <= end:
+            found.append(line_idx)
+    found.sort()
+    return found
+
+class TextOrientation(Enum):
+    """チャンクのテキストの向き（値はメタデータのtext_orientation）"""
+    HORIZONTAL = "横書き"
+    VERTICAL = "縦書き"
+
+class Bounds(NamedTuple):
+    """チャンクの境界（ページ上の座標）"""
+    min_x: float
+    max_x: float
+    min_y: float
+    max_y: float
+
+    @property
+    def width(self):
+        return self.max_x - self.min_x
+
+    @property
+    def height(self):
+        return self.max_y - self.min_y
+
+    @classmethod
+    def from_dict(cls, bounds: Dict) -> "Bounds":
+        return cls(bounds["min_x"], bounds["max_x"], bounds["min_y"], bounds["max_y"])
+
+    def to_dict(self) -> Dict:
+        return {
+            "min_x": self.min_x,
+            "max_x": self.max_x,
+            "min_y": self.min_y,
+            "max_y": self.max_y,
+            "width": self.width,
+            "height": self.height
+        }
+
+class Chunk:
+    """
+    チャンク（段落・行）
+    大きな文書では数万件になるため、辞書ではなく__slots__のオブジェクトで持つ
+    - base_metadataは文書の全チャンクで同じ辞書を共有する
+    - 向きはTextOrientation、判定方法は intern した文字列で持つ
+    - Document AIのレイアウト（protobuf）は境界を取り出したら参照しない（OCR結果全体を保持し続けないため）
+    Chromaへの書き込み・途中結果の保存には to_dict() で従来の辞書の形式に変換する
+    """
+    __slots__ = (
+        "chunk_id", "text", "chunk_type", "base_metadata", "page_number", "element_index",
+        "orientation", "confidence", "method", "details", "bounds", "created_at", "merge", "final_chunk_id"
+    )
+
+    def __init__(self, chunk_id: int, text: str, chunk_type: str, base_metadata: Dict,
+                 page_number: int, element_index: int, orientation_analysis: Dict,
+                 bounds: Optional[Bounds] = None):
+        self.chunk_id = chunk_id
+        self.text = text
+        self.chunk_type = chunk_type
+        self.base_metadata = base_metadata
+        self.page_number = page_number
+        self.element_index = element_index
+        self.orientation = TextOrientation.VERTICAL if orientation_analysis["is_vertical"] else TextOrientation.HORIZONTAL
+        self.confidence = orientation_analysis["confidence"]
+        self.method = sys.intern(orientation_analysis["method"])
+        self.details = orientation_analysis
+        self.bounds = bounds
+        self.created_at = time.time()
+        self.merge = None  # 結合したチャンクのメタデータ（merge_paragraph_chunks）
+        self.final_chunk_id = None
+
+    def copy(self) -> "Chunk":
+        chunk = Chunk.__new__(Chunk)
+        for name in Chunk.__slots__:
+            setattr(chunk, name, getattr(self, name))
+        return chunk
+
+    def to_dict(self) -> Dict:
+        """従来のcreate_chunk・merge_paragraph_chunksが返していた辞書の形式に変換する"""
+        metadata = {
+            **self.base_metadata,
+            "chunk_type": self.chunk_type,
+            "page_number": self.page_number,
+            "element_index": self.element_index,
+            "chunk_length": len(self.text),
+            "text_orientation": self.orientation.value,
+            "is_vertical_text": self.orientation is TextOrientation.VERTICAL,
+            "orientation_confidence": self.confidence,
+            "orientation_method": self.method,
+            "orientation_details": self.details,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "has_bounds": self.bounds is not None
+        }
+        if self.merge:
+            metadata.update(self.merge)
+        if self.final_chunk_id is not None:
+            metadata["final_chunk_id"] = self.final_chunk_id
+        chunk = {"chunk_id": self.chunk_id, "text": self.text, "metadata": metadata}
+        if self.bounds is not None:
+            chunk["_bounds"] = self.bounds.to_dict()
+        return chunk
+
+def chunks_to_dicts(chunks: List[Chunk]) -> List[Dict]:
+    """チャンクを辞書のリストに変換する（create_vectorstore.pyの書き込み・途中結果の保存用）"""
+    return [chunk.to_dict() for chunk in chunks]
+
 def create_chunk(chunk_id: int, text: str, chunk_type: str, base_metadata: Dict, 
                 page_number: int, element_index: int, orientation_analysis: Dict,
-                paragraph_layout=None, paragraph_bounds=None) -> Dict:
+                paragraph_bounds=None) -> Chunk:
     """
     チャンクオブジェクトを作成する（境界情報付き）
     """
-    chunk = {
-        "chunk_id": chunk_id,
-        "text": text,
-        "metadata": {
-            **base_metadata,
-            "chunk_type": chunk_type,
-            "page_number": page_number,
-            "element_index": element_index,
-            "chunk_length": len(text),
-            "text_orientation": "縦書き" if orientation_analysis["is_vertical"] else "横書き",
-            "is_vertical_text": orientation_analysis["is_vertical"],
-            "orientation_confidence": orientation_analysis["confidence"],
-            "orientation_method": orientation_analysis["method"],
-            "orientation_details": orientation_analysis,
-            "created_at": datetime.now().isoformat()
-        }
-    }
-    if paragraph_layout:
-        chunk["_layout"] = paragraph_layout
-    if paragraph_bounds:
-        chunk["_bounds"] = paragraph_bounds
-        chunk["metadata"]["has_bounds"] = True
-    else:
-        chunk["metadata"]["has_bounds"] = False
-    return chunk 
\ No newline at end of file
+    return Chunk(
+        chunk_id=chunk_id,
+        text=text,
+        chunk_type=chunk_type,
+        base_metadata=base_metadata,
+        page_number=page_number,
+        element_index=element_index,
+        orientation_analysis=orientation_analysis,
+        bounds=Bounds.from_dict(paragraph_bounds) if paragraph_bounds else None
+    )
@@ -0,0 +1,134 @@
+# RAGの回答キャッシュ（正規化した質問の完全一致と、質問の埋め込みの類似度で検索する）
+#
+# 盆栽の手入れの質問は同じ内容の言い換えが多いため、過去の回答と参照文書をそのまま返して
+# 検索・回答生成（LLM呼び出し）を省略する。
+# - 正規化した質問が一致すれば埋め込みも計算せずに返す
+# - 一致しなければ質問の埋め込みとのコサイン類似度が SIMILARITY_THRESHOLD 以上の回答を返す
+# - 保存から QUERY_CACHE_TTL 秒経ったもの、コーパスのバージョン（キーワードインデックスの
+#   manifestのversion）が変わる前に保存したものは使わない
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+QUERY_CACHE_SIZE = 256  # 保持する回答の最大数（超えたら最後に使われたのが古いものから削除）
+QUERY_CACHE_TTL = 24 * 60 * 60  # 秒
+SIMILARITY_THRESHOLD = 0.95  # text-embedding-ada-002のコサイン類似度（言い換え程度の差を同じ質問とみなす）
+
+_TRAILING = re.compile(r"[\s。．.、,？?！!]+$")
+
+
+def normalize_question(question):
+    """全角・半角と大文字・小文字、空白、末尾の句読点・疑問符の違いを無視する"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = "".join(text.split())
+    return _TRAILING.sub("", text)
+
+
+class CachedAnswer:
+    def __init__(self, question, answer, references, embedding, corpus_version):
+        self.question = question
+        self.answer = answer
+        self.references = references
+        self.embedding = embedding
+        self.corpus_version = corpus_version
+        self.created_at = time.monotonic()
+
+
+class QueryCache:
+    """回答キャッシュ（サイズ上限付きLRU・TTL付き、スレッドセーフ）"""
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, threshold=SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()  # 正規化した質問 -> CachedAnswer
+        self._matrix = None  # 埋め込みを並べた行列（エントリが変わったら作り直す）
+        self._lock = threading.Lock()
+        self.corpus_version = None
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self.invalidations = 0
+
+    def _sync(self, corpus_version):
+        """コーパスのバージョンが変わっていたら全エントリを破棄し、期限切れのエントリを削除する"""
+        if corpus_version != self.corpus_version:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._matrix = None
+            self.corpus_version = corpus_version
+        deadline = time.monotonic() - self.ttl
+        expired = [key for key, entry in self._entries.items() if entry.created_at < deadline]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def get(self, question, corpus_version):
+        """正規化した質問が一致する回答（見つからない場合はNone）"""
+        key = normalize_question(question)
+        with self._lock:
+            self._sync(corpus_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits["exact"] += 1
+            return entry
+
+    def get_similar(self, embedding, corpus_version):
+        """埋め込みの類似度が閾値以上で最も近い回答（見つからない場合はNone）"""
+        query = _unit(embedding)
+        with self._lock:
+            self._sync(corpus_version)
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix = (list(self._entries), np.stack([e.embedding for e in self._entries.values()]))
+            keys, matrix = self._matrix
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(keys[best])
+            self.hits["semantic"] += 1
+            return self._entries[keys[best]]
+
+    def put(self, question, embedding, corpus_version, answer, references):
+        """回答を保存する（保存までの間にコーパスが更新されていたら保存しない）"""
+        key = normalize_question(question)
+        entry = CachedAnswer(question, answer, references, _unit(embedding), corpus_version)
+        with self._lock:
+            self._sync(self.corpus_version)
+            if corpus_version != self.corpus_version:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self):
+        """監視用の統計情報"""
+        with self._lock:
+            lookups = sum(self.hits.values()) + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "corpus_version": self.corpus_version,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "hit_rate": round(sum(self.hits.values()) / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
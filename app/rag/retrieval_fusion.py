@@ -0,0 +1,107 @@
+# ベクトル検索とキーワード検索の結果の統合（Reciprocal Rank Fusion）
+#
+# 2つの検索結果を順位ベースのスコアで統合し、同じチャンクは1件にまとめる。
+# プロンプトに入れる専門文書はトークン数の上限（CONTEXT_TOKEN_BUDGET）に収まる分だけにする。
+import time
+from contextlib import contextmanager
+
+import tiktoken
+
+RRF_K = 60  # RRFの定数（大きいほど下位の結果との差が小さくなる）
+FUSION_TOP_K = 6  # 統合後にプロンプトへ入れるチャンクの最大数
+CONTEXT_TOKEN_BUDGET = 3000  # 専門文書部分のトークン数の上限
+
+
+def chunk_key(doc):
+    """チャンクの同一性を判定するキー（ファイル名・ページ・本文）"""
+    return (doc.metadata.get("filename"), doc.metadata.get("page_number"), doc.page_content)
+
+
+def reciprocal_rank_fusion(result_lists, weights=None, k=RRF_K):
+    """
+    複数の検索結果をRRFで統合する
+    score(d) = Σ weight_i / (k + rank_i(d))  （rankは1始まり）
+
+    :param result_lists: 検索結果（Documentのリスト）のリスト
+    :param weights: 検索結果ごとの重み（Noneの場合はすべて1.0）
+    :param k: RRFの定数
+    :return: [(score, Document), ...]  スコアの降順、同じチャンクは1件のみ
+    """
+    weights = weights or [1.0] * len(result_lists)
+    scores = {}
+    documents = {}
+    for results, weight in zip(result_lists, weights):
+        seen = set()
+        for rank, doc in enumerate(results, start=1):
+            key = chunk_key(doc)
+            # 1つの検索結果内で重複している場合は最上位の順位だけを使う
+            if key in seen:
+                continue
+            seen.add(key)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+            documents.setdefault(key, doc)
+    # 同点の場合は先に出現したもの（ベクトル検索の上位）を優先する（sortedは安定ソート）
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [(scores[key], documents[key]) for key in ranked]
+
+
+class TokenCounter:
+    """プロンプトのトークン数を数える"""
+
+    def __init__(self, model="gpt-4.1-nano"):
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # tiktokenが対応していないモデル名の場合はGPT-4o系と同じエンコーディングを使う
+            self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def __call__(self, text):
+        return len(self.encoding.encode(text))
+
+
+def fit_token_budget(documents, budget, count_tokens, max_documents=FUSION_TOP_K):
+    """
+    上位から順にトークン数の上限に収まる分だけチャンクを選ぶ
+    上限を超えるチャンクは飛ばし、後続の短いチャンクが収まる場合はそれを入れる
+
+    :param documents: スコア順のDocumentのリスト
+    :param budget: トークン数の上限
+    :param count_tokens: テキストのトークン数を返す関数
+    :param max_documents: 選ぶチャンクの最大数
+    :return: (選んだDocumentのリスト, 合計トークン数)
+    """
+    selected = []
+    used = 0
+    for doc in documents:
+        if len(selected) >= max_documents:
+            break
+        tokens = count_tokens(doc.page_content)
+        if used + tokens > budget:
+            continue
+        selected.append(doc)
+        used += tokens
+    return selected, used
+
+
+class StageTimer:
+    """処理段階ごとの所要時間（ミリ秒）を記録する"""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def format_timings(timings, context_tokens=None):
+    """StageTimer.timings を1行の文字列にする"""
+    parts = [f"{name} {ms:.0f}ms" for name, ms in timings.items()]
+    line = "処理時間: " + " / ".join(parts) + f" (合計 {sum(timings.values()):.0f}ms)"
+    if context_tokens is not None:
+        line += f" / 専門文書 {context_tokens} tokens"
+    return line
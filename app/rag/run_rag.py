@@ -1,23 +1,60 @@
 # ベクトルストアを使用したインタラクティブAIチャット
 import json
+import warnings
 from typing import List, Tuple
 
 from dotenv import load_dotenv
 from langchain.prompts import ChatPromptTemplate
+from langchain.schema.document import Document
 from langchain.schema.messages import HumanMessage
-from langchain_community.retrievers import BM25Retriever
 from langchain_community.vectorstores import Chroma
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from keyword_index import INDEX_PATH as KEYWORD_INDEX_PATH, KeywordIndex
+from query_cache import QUERY_CACHE_TTL, SIMILARITY_THRESHOLD, QueryCache
+from retrieval_fusion import (
+    CONTEXT_TOKEN_BUDGET,
+    FUSION_TOP_K,
+    StageTimer,
+    TokenCounter,
+    fit_token_budget,
+    format_timings,
+    reciprocal_rank_fusion,
+)
 
 load_dotenv(dotenv_path="/home/fujikawa/jinshari/flask-bonsai/.env.local")
 
 TOP_K = 5
+KEYWORD_TOP_K = 4  # BM25Retrieverのデフォルトと同じ
 
 VECTORSTORE_PATH = "/home/fujikawa/jinshari/flask-bonsai/data/vectorstore"
 
 
+class KeywordIndexRetriever:
+    """永続化したキーワードインデックスをBM25Retrieverと同じ invoke(query) で検索する"""
+
+    def __init__(self, index, k=KEYWORD_TOP_K):
+        self.index = index
+        self.k = k
+
+    def invoke(self, query):
+        hits = self.index.search(query, self.k)
+        documents = self.index.documents([doc_id for _, doc_id in hits])
+        return [Document(page_content=text, metadata=metadata) for text, metadata in documents]
+
+
 class RAGChatBot:
-    def __init__(self, show_content=False):
+    def __init__(
+        self,
+        show_content=False,
+        top_k=TOP_K,
+        keyword_top_k=KEYWORD_TOP_K,
+        fusion_top_k=FUSION_TOP_K,
+        context_token_budget=CONTEXT_TOKEN_BUDGET,
+        show_timings=False,
+        use_query_cache=True,
+        cache_threshold=SIMILARITY_THRESHOLD,
+        cache_ttl=QUERY_CACHE_TTL,
+    ):
         print("ベクトルストアを読み込み中...")
         self.embeddings = OpenAIEmbeddings(
             model="text-embedding-ada-002",
@@ -25,19 +62,27 @@ class RAGChatBot:
         self.vectorstore = Chroma(
             embedding_function=self.embeddings, persist_directory=VECTORSTORE_PATH
         )
-        self.documents = self.vectorstore.get()
-        self.docs = self.documents["documents"]
-        self.metadatas = self.documents["metadatas"]
-        
-        print("BM25リトリーバーを初期化中...")
-        self.keyword_retriever = BM25Retriever.from_texts(
-            self.documents["documents"],
-            metadatas=self.documents["metadatas"],
-            preprocess_func=self.preprocess_func,
-        )
+
+        # キーワード検索はcreate_vectorstore.pyが作成したインデックスを使う（検索時に遅延読み込み）
+        # インデックスへの書き込みは取り込み側の1プロセスだけが行う（Flaskのワーカーごとに作り直すと競合する）。
+        # まだない場合は空のインデックスとして検索し、作成されれば次の検索から使う
+        self.keyword_index = KeywordIndex(KEYWORD_INDEX_PATH)
+        if not self.keyword_index.exists():
+            warnings.warn(
+                "キーワードインデックスが見つかりません。"
+                "python create_vectorstore.py --rebuild-keyword-index で作成するまでキーワード検索は結果を返しません"
+            )
+        self.keyword_retriever = KeywordIndexRetriever(self.keyword_index, k=keyword_top_k)
+        self.top_k = top_k
         self.vector_retriever = self.vectorstore.as_retriever(
-            search_kwargs={"k": TOP_K}
+            search_kwargs={"k": top_k}
         )
+        # 回答キャッシュ（キーワードインデックスのversionが変わったら破棄）
+        self.query_cache = QueryCache(ttl=cache_ttl, threshold=cache_threshold) if use_query_cache else None
+        # 検索結果の統合とプロンプトに入れる専門文書の上限
+        self.fusion_top_k = fusion_top_k
+        self.context_token_budget = context_token_budget
+        self.count_tokens = TokenCounter()
         self.system_message = (
             """あなたは盆栽の専門家です。以下に与えられた盆栽の専門文書のデータに基づいて、ユーザーの質問に対して回答を生成してください。
             なるべく専門文書のデータに基づいて回答するようにし、不正確な部分があれば断定は避けてください。
@@ -48,6 +93,10 @@ class RAGChatBot:
         # 会話履歴を保持
         self.chat_history = []
         self.show_content = show_content
+        self.show_timings = show_timings
+        self.last_timings = {}
+        self.last_context_tokens = 0
+        self.last_cached = False
         
         print("チャットボットの準備が完了しました！")
 
@@ -78,6 +127,10 @@ class RAGChatBot:
                 print("\n検索中...")
                 response, metadata_list, referenced_docs = self.run_chat(user_input)
                 print(f"\nAI: {response}")
+                if self.show_timings:
+                    print(format_timings(self.last_timings, self.last_context_tokens))
+                    if self.last_cached:
+                        print("（キャッシュした回答を表示しています）")
                 
                 # 参照したドキュメント情報を表示
                 self.display_referenced_documents(metadata_list, referenced_docs, show_content=self.show_content)
@@ -144,26 +197,132 @@ class RAGChatBot:
         return ngrams
 
     def generate_output(
-        self, keyword_retriever, vector_retriever, user_input, system_message
+        self, keyword_retriever, vector_retriever, user_input, system_message, chat_history=None
     ):
-        question = self.regenerate_question(user_input)
-        keyword_searched = keyword_retriever.invoke(question)
-        vector_searched = vector_retriever.invoke(question)
-        texts_retrieved = []
-        metadata_list = []
-        referenced_docs = []  # 参照したドキュメントを保持
-        for doc in vector_searched + keyword_searched:
-            texts_retrieved.append(doc.page_content)
-            metadata_list.append(doc.metadata)
-            referenced_docs.append(doc)  # Document オブジェクトを保持
-        result = self.chat_based_on_texts(texts_retrieved, question, system_message)
+        # 段階ごとの処理時間は self.last_timings に記録する
+        timer = StageTimer()
+        with timer.stage("rewrite"):
+            question = self.regenerate_question(user_input, chat_history)
+        cached, embedding, corpus_version = self.lookup_answer(question, timer)
+        if cached is not None:
+            result, referenced_docs, context_tokens = cached.answer, cached.references, 0
+        else:
+            referenced_docs, context_tokens = self.retrieve_context(
+                keyword_retriever, vector_retriever, question, timer, embedding
+            )
+            texts_retrieved = [doc.page_content for doc in referenced_docs]
+            with timer.stage("generation"):
+                result = self.chat_based_on_texts(texts_retrieved, question, system_message, chat_history)
+            self.store_answer(question, embedding, corpus_version, result, referenced_docs, chat_history)
+        metadata_list = [doc.metadata for doc in referenced_docs]
+        self.last_timings = timer.timings
+        self.last_context_tokens = context_tokens
+        self.last_cached = cached is not None
         return result, metadata_list, referenced_docs  # referenced_docsも返す
 
-    def regenerate_question(self, user_input):
+    def stream_output(self, user_input, chat_history):
+        """
+        generate_output のストリーミング版（HTTP APIから使用）
+        インスタンスの状態を変更しないため、複数のリクエストから同時に呼び出せる
+
+        :param chat_history: セッションの会話履歴
+        :return: ("references", Documentのリスト) → ("token", 文字列) ... →
+                 ("done", {"answer", "timings", "context_tokens", "cached"}) の順に返すジェネレータ
+                 キャッシュした回答の場合は回答全体を1つの"token"として返す
+        """
+        timer = StageTimer()
+        with timer.stage("rewrite"):
+            question = self.regenerate_question(user_input, chat_history)
+        cached, embedding, corpus_version = self.lookup_answer(question, timer)
+        if cached is not None:
+            yield "references", cached.references
+            yield "token", cached.answer
+            yield "done", {"answer": cached.answer, "timings": timer.timings, "context_tokens": 0, "cached": True}
+            return
+
+        referenced_docs, context_tokens = self.retrieve_context(
+            self.keyword_retriever, self.vector_retriever, question, timer, embedding
+        )
+        yield "references", referenced_docs
+        texts_retrieved = [doc.page_content for doc in referenced_docs]
+        answer = []
+        with timer.stage("generation"):
+            for token in self.stream_based_on_texts(texts_retrieved, question, self.system_message, chat_history):
+                answer.append(token)
+                yield "token", token
+        answer = "".join(answer)
+        self.store_answer(question, embedding, corpus_version, answer, referenced_docs, chat_history)
+        yield "done", {"answer": answer, "timings": timer.timings, "context_tokens": context_tokens, "cached": False}
+
+    def lookup_answer(self, question, timer):
+        """
+        回答キャッシュを参照する（正規化した質問の一致 → 質問の埋め込みの類似度の順）
+
+        :param question: 言い換え後の質問
+        :return: (CachedAnswer（見つからない場合はNone）, 質問の埋め込み（計算しなかった場合はNone）, コーパスのバージョン)
+        コーパスのバージョンが分からない（キーワードインデックスのmanifestがない・読めない）場合はキャッシュを使わない
+        """
+        if self.query_cache is None:
+            return None, None, None
+        with timer.stage("cache"):
+            try:
+                corpus_version = self.keyword_index.current_version()
+            except OSError:
+                corpus_version = None
+            if corpus_version is None:
+                return None, None, None
+            cached = self.query_cache.get(question, corpus_version)
+        if cached is not None:
+            return cached, None, corpus_version
+        # 埋め込みはキャッシュにない場合のベクトル検索にも使うため、計算は1回で済む
+        with timer.stage("embed"):
+            embedding = self.embeddings.embed_query(question)
+        with timer.stage("cache"):
+            cached = self.query_cache.get_similar(embedding, corpus_version)
+        return cached, embedding, corpus_version
+
+    def store_answer(self, question, embedding, corpus_version, answer, referenced_docs, chat_history=None):
+        """回答をキャッシュに保存する（会話履歴を踏まえた回答は他の会話では使えないため保存しない）"""
+        if chat_history is None:
+            chat_history = self.chat_history
+        if self.query_cache is None or chat_history or corpus_version is None:
+            return
+        self.query_cache.put(question, embedding, corpus_version, answer, referenced_docs)
+
+    def retrieve_context(self, keyword_retriever, vector_retriever, question, timer, query_embedding=None):
+        """
+        検索・統合を行い、プロンプトに入れるチャンクを選ぶ
+
+        :param question: 言い換え後の質問
+        :param timer: 各段階の処理時間を記録するStageTimer
+        :param query_embedding: 計算済みの質問の埋め込み（ある場合はベクトル検索で再計算しない）
+        :return: (選んだDocumentのリスト, 専門文書のトークン数)
+        """
+        with timer.stage("vector"):
+            if query_embedding is None:
+                vector_searched = vector_retriever.invoke(question)
+            else:
+                vector_searched = self.vectorstore.similarity_search_by_vector(query_embedding, k=self.top_k)
+        with timer.stage("keyword"):
+            keyword_searched = keyword_retriever.invoke(question)
+        with timer.stage("fusion"):
+            # 同じチャンクは1件にまとめ、順位ベースのスコアで並べてトークン数の上限まで選ぶ
+            fused = reciprocal_rank_fusion([vector_searched, keyword_searched])
+            referenced_docs, context_tokens = fit_token_budget(
+                [doc for _, doc in fused],
+                self.context_token_budget,
+                self.count_tokens,
+                max_documents=self.fusion_top_k,
+            )
+        return referenced_docs, context_tokens
+
+    def regenerate_question(self, user_input, chat_history=None):
         """
         会話履歴を考慮して質問を再生成する
         """
-        if not self.chat_history:
+        if chat_history is None:
+            chat_history = self.chat_history
+        if not chat_history:
             return user_input
             
         prompt = ChatPromptTemplate.from_template(
@@ -179,16 +338,31 @@ class RAGChatBot:
         )
         chain = prompt | self.llm
         follow_up_question = user_input
-        args = {"chat_history": self.chat_history, "follow_up_question": follow_up_question}
+        args = {"chat_history": chat_history, "follow_up_question": follow_up_question}
         ans = chain.invoke(args)
         return str(ans.content)
 
-    def chat_based_on_texts(self, texts_retrieved, question, system_message):
+    def chat_based_on_texts(self, texts_retrieved, question, system_message, chat_history=None):
+        return self.llm.invoke(
+            self.build_messages(texts_retrieved, question, system_message, chat_history)
+        ).content
+
+    def stream_based_on_texts(self, texts_retrieved, question, system_message, chat_history=None):
+        """chat_based_on_texts と同じプロンプトで、回答を生成された順に少しずつ返す"""
+        for chunk in self.llm.stream(
+            self.build_messages(texts_retrieved, question, system_message, chat_history)
+        ):
+            if chunk.content:
+                yield chunk.content
+
+    def build_messages(self, texts_retrieved, question, system_message, chat_history=None):
+        if chat_history is None:
+            chat_history = self.chat_history
         texts = "\n\n".join(texts_retrieved)
         
         # 会話履歴を文字列形式に変換
         history_str = ""
-        for msg in self.chat_history[-4:]:  # 最新の4つの発言のみ使用
+        for msg in chat_history[-4:]:  # 最新の4つの発言のみ使用
             history_str += f"{msg['role']}: {msg['content']}\n"
         
         prompt_text = f"""
@@ -203,9 +377,7 @@ class RAGChatBot:
             質問: {question}
             """
 
-        return self.llm.invoke(
-            [HumanMessage(content=[{"type": "text", "text": prompt_text}])]
-        ).content
+        return [HumanMessage(content=[{"type": "text", "text": prompt_text}])]
 
     def display_referenced_documents(self, metadata_list, referenced_docs, show_content=False):
         """
@@ -256,9 +428,25 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--show-content', action='store_true', help='参照ドキュメントの内容も表示する')
+    parser.add_argument('--top-k', type=int, default=TOP_K, help='ベクトル検索で取得するチャンク数')
+    parser.add_argument('--keyword-top-k', type=int, default=KEYWORD_TOP_K, help='キーワード検索で取得するチャンク数')
+    parser.add_argument('--fusion-top-k', type=int, default=FUSION_TOP_K, help='統合後にプロンプトへ入れるチャンクの最大数')
+    parser.add_argument('--context-token-budget', type=int, default=CONTEXT_TOKEN_BUDGET, help='専門文書部分のトークン数の上限')
+    parser.add_argument('--show-timings', action='store_true', help='検索・統合・生成の処理時間を表示する')
+    parser.add_argument('--no-query-cache', action='store_true', help='回答キャッシュを使わない')
+    parser.add_argument('--cache-threshold', type=float, default=SIMILARITY_THRESHOLD, help='キャッシュした回答を使う質問の埋め込みの類似度の下限')
     args = parser.parse_args()
     try:
-        chatbot = RAGChatBot(show_content=args.show_content)
+        chatbot = RAGChatBot(
+            show_content=args.show_content,
+            top_k=args.top_k,
+            keyword_top_k=args.keyword_top_k,
+            fusion_top_k=args.fusion_top_k,
+            context_token_budget=args.context_token_budget,
+            show_timings=args.show_timings,
+            use_query_cache=not args.no_query_cache,
+            cache_threshold=args.cache_threshold,
+        )
         chatbot.main()
     except Exception as e:
         print(f"初期化エラー: {e}")
@@ -0,0 +1,113 @@
+"""RAGチャットAPI用のチャットボットと会話履歴
+
+RAGChatBot（ベクトルストア・キーワードインデックス・LLMクライアント）の読み込みには時間がかかるため、
+ワーカープロセスごとに最初のリクエストで1回だけ作成し、app.extensions に保持して全リクエストで共有する。
+会話履歴はセッションIDごとにプロセス内のメモリに保持する（最後に使われてから RAG_CHAT_SESSION_TTL 秒で破棄）。
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+
+EXTENSION_KEY = 'rag_chatbot'
+SESSIONS_EXTENSION_KEY = 'rag_chat_sessions'
+RAG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag')
+
+DEFAULT_HISTORY_SIZE = 10  # run_rag.py の対話ループと同じく直近10件（5往復）を保持
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_SESSION_TTL = 3600  # 秒
+
+_load_lock = threading.Lock()
+
+
+class ChatSessionStore:
+    """セッションIDごとの会話履歴（サイズ上限付きLRU・TTL付き、スレッドセーフ）"""
+
+    def __init__(self, history_size=DEFAULT_HISTORY_SIZE, max_sessions=DEFAULT_MAX_SESSIONS, ttl=DEFAULT_SESSION_TTL):
+        self.history_size = history_size
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> (最終利用時刻, 履歴)
+        self._lock = threading.Lock()
+
+    def new_session_id(self):
+        return uuid.uuid4().hex
+
+    def history(self, session_id):
+        """会話履歴のコピーを返す（存在しない・期限切れの場合は空）"""
+        with self._lock:
+            self._expire()
+            entry = self._sessions.get(session_id)
+            return list(entry[1]) if entry else []
+
+    def append(self, session_id, question, answer):
+        """1往復分の発言を追加する"""
+        with self._lock:
+            self._expire()
+            _, history = self._sessions.pop(session_id, (None, []))
+            history = history + [
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer},
+            ]
+            self._sessions[session_id] = (time.monotonic(), history[-self.history_size:])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            if last_used >= deadline:
+                break
+            del self._sessions[session_id]
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions, "ttl": self.ttl}
+
+
+def get_chat_sessions(app=None):
+    """アプリに紐づく会話履歴ストアを取得（初回はRAG_CHAT_*の設定に従って作成）"""
+    if app is None:
+        app = current_app._get_current_object()
+
+    sessions = app.extensions.get(SESSIONS_EXTENSION_KEY)
+    if sessions is None:
+        sessions = app.extensions.setdefault(
+            SESSIONS_EXTENSION_KEY,
+            ChatSessionStore(
+                history_size=app.config.get('RAG_CHAT_HISTORY_SIZE', DEFAULT_HISTORY_SIZE),
+                max_sessions=app.config.get('RAG_CHAT_MAX_SESSIONS', DEFAULT_MAX_SESSIONS),
+                ttl=app.config.get('RAG_CHAT_SESSION_TTL', DEFAULT_SESSION_TTL)
+            )
+        )
+    return sessions
+
+
+def get_rag_chatbot(app=None):
+    """
+    アプリに紐づくRAGChatBotを取得（プロセス内で最初の呼び出し時に1回だけ読み込む）
+    app/rag のスクリプトは同じディレクトリのモジュールを直接importするため、読み込み前にsys.pathへ追加する
+    """
+    if app is None:
+        app = current_app._get_current_object()
+
+    chatbot = app.extensions.get(EXTENSION_KEY)
+    if chatbot is None:
+        with _load_lock:
+            chatbot = app.extensions.get(EXTENSION_KEY)
+            if chatbot is None:
+                if RAG_DIR not in sys.path:
+                    sys.path.insert(0, RAG_DIR)
+                from run_rag import RAGChatBot
+                chatbot = RAGChatBot()
+                app.extensions[EXTENSION_KEY] = chatbot
+    return chatbot
@@ -0,0 +1,107 @@
+"""推奨結果のキャッシュ
+
+/api/pesticides/recommendation/<bonsai_id> と /monthly-risks/<bonsai_id> の計算結果を
+(種別, 盆栽ID, 日付, マスタのバージョン, 農薬記録のバージョン) をキーに保持する。
+
+推奨結果が変わるのは 農薬記録の追加・削除 / マスタの更新 / 日付の変化 のときだけなので、
+- 農薬記録のバージョンは bonsai.pesticide_log_version（pesticide_logs のトリガーで更新）を使う。
+  別のワーカープロセスや options/ のスクリプトでの更新も次のリクエストでミスになる
+- マスタ更新時はスナップショットのバージョンが変わり、clear() で古いエントリも捨てる
+- 日付はキーに含まれているため、日付が変われば自然にミスになる
+このプロセスで農薬記録を更新したときは invalidate_bonsai() で古いエントリを先に捨てる（メモリの解放のみ）。
+サイズ上限を超えた場合は最も古く参照されたエントリから追い出す（LRU）。
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app
+
+EXTENSION_KEY = 'recommendation_cache'
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class RecommendationCache:
+    """サイズ上限付きLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def make_key(self, kind, bonsai_id, master_version, log_version, today=None):
+        """キャッシュキーを作成
+
+        log_version は計算に使う農薬記録を読む前に bonsai.pesticide_log_version から読んだ値を渡す
+        （読んだ後に記録が更新されても、結果は新しいバージョンのキーでは参照されない）
+        """
+        if today is None:
+            today = date.today()
+        return (kind, int(bonsai_id), today.isoformat(), master_version, log_version)
+
+    def get(self, key):
+        """キャッシュを参照（見つからない場合はNone）"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """キャッシュに保存（上限を超えたら古いものから追い出す）"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_bonsai(self, bonsai_id):
+        """盆栽の農薬記録が変わったときに呼び出す（古いバージョンのエントリを追い出しを待たずに捨てる）"""
+        bonsai_id = int(bonsai_id)
+        with self._lock:
+            stale = [key for key in self._entries if key[1] == bonsai_id]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """全エントリを破棄（マスタ更新時）"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """監視用の統計情報"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+def get_recommendation_cache(app=None):
+    """アプリに紐づくキャッシュを取得（初回はRECOMMENDATION_CACHE_SIZEに従って作成）"""
+    if app is None:
+        app = current_app._get_current_object()
+
+    cache = app.extensions.get(EXTENSION_KEY)
+    if cache is None:
+        cache = app.extensions.setdefault(
+            EXTENSION_KEY,
+            RecommendationCache(app.config.get('RECOMMENDATION_CACHE_SIZE', DEFAULT_MAX_ENTRIES))
+        )
+    return cache
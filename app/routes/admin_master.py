@@ -1,5 +1,8 @@
 from flask import Blueprint, request, jsonify, current_app
-from ..db import get_db
+from ..db import get_db, get_db_pool
+from ..pagination import InvalidPageRequest, paginate, paginated_response
+from ..master_snapshot import get_master_snapshot, refresh_master_snapshot, refresh_species_risks
+from ..recommend_cache import get_recommendation_cache
 from functools import wraps
 
 bp = Blueprint('admin_master', __name__, url_prefix='/api/admin/master')
@@ -36,6 +39,17 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def master_data_changed(db, species_id=None):
+    """マスタ更新後の後処理（スナップショットの差し替えと推奨キャッシュの破棄）
+    
+    species_id を指定した場合はその樹種のリスク表だけを再計算する
+    """
+    if species_id is None:
+        refresh_master_snapshot(db)
+    else:
+        refresh_species_risks(species_id, db)
+    get_recommendation_cache().clear()
+
 # ========== 農薬マスタ管理 ==========
 
 @bp.route('/pesticides', methods=['GET'])
@@ -43,8 +57,12 @@ def admin_required(f):
 def get_pesticides():
     """農薬マスタの一覧取得"""
     db = get_db(current_app)
-    pesticides = db.execute('SELECT * FROM pesticide_master ORDER BY name').fetchall()
-    return jsonify([dict(p) for p in pesticides])
+    try:
+        pesticides, next_cursor = paginate(db, 'SELECT * FROM pesticide_master', (),
+                                           ['name', 'id'], scope='admin_pesticides')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    return paginated_response([dict(p) for p in pesticides], next_cursor)
 
 @bp.route('/pesticides', methods=['POST'])
 @admin_required
@@ -60,6 +78,7 @@ def add_pesticide():
         ''', (data['name'], data['type'], data['interval_days'], 
               data.get('active_ingredient', ''), data.get('description', '')))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "農薬を追加しました", "name": data['name']}), 201
     except Exception as e:
@@ -80,6 +99,7 @@ def update_pesticide(pesticide_id):
         ''', (data['name'], data['type'], data['interval_days'], 
               data.get('active_ingredient', ''), data.get('description', ''), pesticide_id))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "農薬を更新しました"})
     except Exception as e:
@@ -108,6 +128,7 @@ def delete_pesticide(pesticide_id):
         
         db.execute('DELETE FROM pesticide_master WHERE id = ?', (pesticide_id,))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "農薬を削除しました"})
     except Exception as e:
@@ -120,8 +141,12 @@ def delete_pesticide(pesticide_id):
 def get_pest_diseases():
     """害虫・病気マスタの一覧取得"""
     db = get_db(current_app)
-    pest_diseases = db.execute('SELECT * FROM pest_disease_master ORDER BY type, name').fetchall()
-    return jsonify([dict(pd) for pd in pest_diseases])
+    try:
+        pest_diseases, next_cursor = paginate(db, 'SELECT * FROM pest_disease_master', (),
+                                              ['type', 'name', 'id'], scope='admin_pest_diseases')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    return paginated_response([dict(pd) for pd in pest_diseases], next_cursor)
 
 @bp.route('/pest-diseases', methods=['POST'])
 @admin_required
@@ -141,6 +166,7 @@ def add_pest_disease():
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (data['name'], data['type'], data.get('description', ''), season, start_month, end_month))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "害虫・病気を追加しました", "name": data['name']}), 201
     except Exception as e:
@@ -169,6 +195,7 @@ def delete_pest_disease(pest_disease_id):
         
         db.execute('DELETE FROM pest_disease_master WHERE id = ?', (pest_disease_id,))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "害虫・病気を削除しました"})
     except Exception as e:
@@ -181,14 +208,16 @@ def delete_pest_disease(pest_disease_id):
 def get_pesticide_effectiveness():
     """農薬効果マスタの一覧取得"""
     db = get_db(current_app)
-    effectiveness = db.execute('''
-        SELECT pe.*, pm.name as pesticide_name, pdm.name as pest_disease_name
-        FROM pesticide_effectiveness pe
-        JOIN pesticide_master pm ON pe.pesticide_id = pm.id
-        JOIN pest_disease_master pdm ON pe.pest_disease_id = pdm.id
-        ORDER BY pm.name, pdm.name
-    ''').fetchall()
-    return jsonify([dict(e) for e in effectiveness])
+    try:
+        effectiveness, next_cursor = paginate(db, '''
+            SELECT pe.*, pm.name as pesticide_name, pdm.name as pest_disease_name
+            FROM pesticide_effectiveness pe
+            JOIN pesticide_master pm ON pe.pesticide_id = pm.id
+            JOIN pest_disease_master pdm ON pe.pest_disease_id = pdm.id
+        ''', (), ['pesticide_name', 'pest_disease_name', 'id'], scope='admin_pesticide_effectiveness')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    return paginated_response([dict(e) for e in effectiveness], next_cursor)
 
 @bp.route('/pesticide-effectiveness', methods=['POST'])
 @admin_required
@@ -205,6 +234,7 @@ def add_pesticide_effectiveness():
         ''', (data['pesticide_id'], data['pest_disease_id'], 
               data['effectiveness_level'], data.get('notes', '')))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "農薬効果を追加しました"}), 201
     except Exception as e:
@@ -219,6 +249,7 @@ def delete_pesticide_effectiveness(effectiveness_id):
     try:
         db.execute('DELETE FROM pesticide_effectiveness WHERE id = ?', (effectiveness_id,))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "農薬効果を削除しました"})
     except Exception as e:
@@ -231,8 +262,12 @@ def delete_pesticide_effectiveness(effectiveness_id):
 def get_species():
     """樹種マスタの一覧取得"""
     db = get_db(current_app)
-    species = db.execute('SELECT * FROM species_master ORDER BY name').fetchall()
-    return jsonify([dict(s) for s in species])
+    try:
+        species, next_cursor = paginate(db, 'SELECT * FROM species_master', (),
+                                        ['name', 'id'], scope='admin_species')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    return paginated_response([dict(s) for s in species], next_cursor)
 
 @bp.route('/species', methods=['POST'])
 @admin_required
@@ -293,14 +328,16 @@ def delete_species(species_id):
 def get_species_pest_diseases():
     """樹種別リスクの一覧取得"""
     db = get_db(current_app)
-    species_risks = db.execute('''
-        SELECT spd.*, sm.name as species_name, pdm.name as pest_disease_name, pdm.type as pest_disease_type
-        FROM species_pest_disease spd
-        JOIN species_master sm ON spd.species_id = sm.id
-        JOIN pest_disease_master pdm ON spd.pest_disease_id = pdm.id
-        ORDER BY sm.name, pdm.name
-    ''').fetchall()
-    return jsonify([dict(sr) for sr in species_risks])
+    try:
+        species_risks, next_cursor = paginate(db, '''
+            SELECT spd.*, sm.name as species_name, pdm.name as pest_disease_name, pdm.type as pest_disease_type
+            FROM species_pest_disease spd
+            JOIN species_master sm ON spd.species_id = sm.id
+            JOIN pest_disease_master pdm ON spd.pest_disease_id = pdm.id
+        ''', (), ['species_name', 'pest_disease_name', 'id'], scope='admin_species_pest_diseases')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    return paginated_response([dict(sr) for sr in species_risks], next_cursor)
 
 @bp.route('/species-pest-diseases', methods=['POST'])
 @admin_required
@@ -322,6 +359,7 @@ def add_species_pest_disease():
         ''', (data['species_id'], data['pest_disease_id'], data['occurrence_probability'], 
               season, start_month, end_month, data.get('notes', '')))
         db.commit()
+        master_data_changed(db, species_id=data['species_id'])
         
         return jsonify({"message": "樹種別リスクを追加しました"}), 201
     except Exception as e:
@@ -334,8 +372,15 @@ def delete_species_pest_disease(species_risk_id):
     db = get_db(current_app)
     
     try:
+        species_risk = db.execute(
+            'SELECT species_id FROM species_pest_disease WHERE id = ?',
+            (species_risk_id,)
+        ).fetchone()
+        
         db.execute('DELETE FROM species_pest_disease WHERE id = ?', (species_risk_id,))
         db.commit()
+        if species_risk:
+            master_data_changed(db, species_id=species_risk['species_id'])
         
         return jsonify({"message": "樹種別リスクを削除しました"})
     except Exception as e:
@@ -348,14 +393,16 @@ def delete_species_pest_disease(species_risk_id):
 def get_species_prohibited_pesticides():
     """樹種別NG薬剤の一覧取得"""
     db = get_db(current_app)
-    prohibited = db.execute('''
-        SELECT spp.*, sm.name as species_name, pm.name as pesticide_name
-        FROM species_prohibited_pesticides spp
-        JOIN species_master sm ON spp.species_id = sm.id
-        JOIN pesticide_master pm ON spp.pesticide_id = pm.id
-        ORDER BY sm.name, pm.name
-    ''').fetchall()
-    return jsonify([dict(p) for p in prohibited])
+    try:
+        prohibited, next_cursor = paginate(db, '''
+            SELECT spp.*, sm.name as species_name, pm.name as pesticide_name
+            FROM species_prohibited_pesticides spp
+            JOIN species_master sm ON spp.species_id = sm.id
+            JOIN pesticide_master pm ON spp.pesticide_id = pm.id
+        ''', (), ['species_name', 'pesticide_name', 'id'], scope='admin_species_prohibited_pesticides')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    return paginated_response([dict(p) for p in prohibited], next_cursor)
 
 @bp.route('/species-prohibited-pesticides', methods=['POST'])
 @admin_required
@@ -372,6 +419,7 @@ def add_species_prohibited_pesticide():
         ''', (data['species_id'], data['pesticide_id'], data.get('reason', ''), 
               data.get('severity', 'warning'), data.get('notes', '')))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "樹種別NG薬剤を追加しました"}), 201
     except Exception as e:
@@ -386,6 +434,7 @@ def delete_species_prohibited_pesticide(prohibited_id):
     try:
         db.execute('DELETE FROM species_prohibited_pesticides WHERE id = ?', (prohibited_id,))
         db.commit()
+        master_data_changed(db)
         
         return jsonify({"message": "樹種別NG薬剤を削除しました"})
     except Exception as e:
@@ -407,4 +456,19 @@ def get_master_summary():
     summary['species_risks_count'] = db.execute('SELECT COUNT(*) as count FROM species_pest_disease').fetchone()['count']
     summary['prohibited_count'] = db.execute('SELECT COUNT(*) as count FROM species_prohibited_pesticides').fetchone()['count']
     
-    return jsonify(summary) 
\ No newline at end of file
+    return jsonify(summary)
+
+@bp.route('/cache-stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    """推奨キャッシュ・マスタスナップショット・DB接続プールの状態を取得（監視用）"""
+    snapshot = get_master_snapshot()
+    return jsonify({
+        "recommendation_cache": get_recommendation_cache().stats(),
+        "master_snapshot": {
+            "version": snapshot.version,
+            "db_version": snapshot.db_version,
+            "built_at": snapshot.built_at.isoformat()
+        },
+        "db_pool": get_db_pool().stats()
+    }) 
\ No newline at end of file
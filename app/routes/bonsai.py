@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app, send_from_directory
-from ..db import get_db
+from ..db import get_db, refresh_latest_image_id
+from ..pagination import InvalidPageRequest, paginate, paginated_response
+from ..recommend_cache import get_recommendation_cache
 import os
 import time
 import sqlite3
@@ -15,6 +17,16 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def bonsai_to_dict(bonsai):
+    """盆栽の行をレスポンス用の辞書に変換（最新画像の有無とIDを付与）"""
+    b_dict = dict(bonsai)
+    b_dict.pop('pesticide_log_version', None)  # キャッシュ用の内部の列
+    latest_image_id = b_dict.pop('latest_image_id', None)
+    b_dict['has_image'] = latest_image_id is not None
+    if latest_image_id is not None:
+        b_dict['image_id'] = latest_image_id
+    return b_dict
+
 @bp.route('/species', methods=['GET'])
 def get_species_list():
     """盆栽の樹種リストをデータベースから取得するエンドポイント"""
@@ -40,46 +52,36 @@ def get_bonsai():
     # クエリパラメータからuser_idを取得
     user_id = request.args.get('user_id')
     
-    if user_id:
-        # 特定ユーザーの盆栽のみを取得
-        bonsai = db.execute('SELECT * FROM bonsai WHERE user_id = ?', (user_id,)).fetchall()
-    else:
-        # すべての盆栽を取得（管理者用）
-        bonsai = db.execute('SELECT * FROM bonsai').fetchall()
-    
-    # 盆栽の画像情報を取得
-    result = []
-    for b in bonsai:
-        b_dict = dict(b)
-        # 最新の画像を取得
-        image = db.execute('SELECT * FROM bonsai_images WHERE bonsai_id = ? ORDER BY created_at DESC LIMIT 1', 
-                        (b['id'],)).fetchone()
-        b_dict['has_image'] = bool(image)
-        if image:
-            b_dict['image_id'] = image['id']
-        result.append(b_dict)
-    
-    return jsonify(result)
+    try:
+        if user_id:
+            # 特定ユーザーの盆栽のみを取得
+            bonsai, next_cursor = paginate(db, 'SELECT * FROM bonsai WHERE user_id = ?', (user_id,),
+                                           ['id'], scope=f'bonsai:user:{user_id}')
+        else:
+            # すべての盆栽を取得（管理者用）
+            bonsai, next_cursor = paginate(db, 'SELECT * FROM bonsai', (), ['id'], scope='bonsai')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # 盆栽の画像情報を付与（最新画像IDは bonsai.latest_image_id に保持）
+    result = [bonsai_to_dict(b) for b in bonsai]
+    
+    return paginated_response(result, next_cursor)
 
 @bp.route('/user/<int:user_id>', methods=['GET'])
 def get_user_bonsai(user_id):
     """特定ユーザーの盆栽のみを取得するエンドポイント"""
     db = get_db(current_app)
-    bonsai = db.execute('SELECT * FROM bonsai WHERE user_id = ?', (user_id,)).fetchall()
+    try:
+        bonsai, next_cursor = paginate(db, 'SELECT * FROM bonsai WHERE user_id = ?', (user_id,),
+                                       ['id'], scope=f'bonsai:user:{user_id}')
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
     
-    # 盆栽の画像情報を取得
-    result = []
-    for b in bonsai:
-        b_dict = dict(b)
-        # 最新の画像を取得
-        image = db.execute('SELECT * FROM bonsai_images WHERE bonsai_id = ? ORDER BY created_at DESC LIMIT 1', 
-                        (b['id'],)).fetchone()
-        b_dict['has_image'] = bool(image)
-        if image:
-            b_dict['image_id'] = image['id']
-        result.append(b_dict)
-    
-    return jsonify(result)
+    # 盆栽の画像情報を付与（最新画像IDは bonsai.latest_image_id に保持）
+    result = [bonsai_to_dict(b) for b in bonsai]
+    
+    return paginated_response(result, next_cursor)
 
 @bp.route('', methods=['POST'])
 def add_bonsai():
@@ -125,15 +127,7 @@ def get_bonsai_by_id(bonsai_id):
     if not bonsai:
         return jsonify({"error": "盆栽が見つかりません"}), 404
     
-    # 盆栽の画像情報を取得
-    b_dict = dict(bonsai)
-    image = db.execute('SELECT * FROM bonsai_images WHERE bonsai_id = ? ORDER BY created_at DESC LIMIT 1', 
-                    (bonsai_id,)).fetchone()
-    b_dict['has_image'] = bool(image)
-    if image:
-        b_dict['image_id'] = image['id']
-    
-    return jsonify(b_dict)
+    return jsonify(bonsai_to_dict(bonsai))
 
 @bp.route('/<int:bonsai_id>/image', methods=['POST'])
 def upload_bonsai_image(bonsai_id):
@@ -177,12 +171,14 @@ def upload_bonsai_image(bonsai_id):
     
     # データベースに画像情報を保存
     try:
-        db.execute(
+        cursor = db.execute(
             'INSERT INTO bonsai_images (bonsai_id, user_id, filename, original_filename) VALUES (?, ?, ?, ?)',
             (bonsai_id, user_id, unique_filename, original_filename)
         )
+        image_id = cursor.lastrowid
+        # 追加した画像が最新画像になる（同じトランザクションで更新）
+        db.execute('UPDATE bonsai SET latest_image_id = ? WHERE id = ?', (image_id, bonsai_id))
         db.commit()
-        image_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
         
         return jsonify({
             "success": True,
@@ -191,6 +187,7 @@ def upload_bonsai_image(bonsai_id):
         }), 200
     except sqlite3.Error as e:
         # エラーが発生した場合、ファイルを削除して失敗を返す
+        db.rollback()
         if os.path.exists(file_path):
             os.remove(file_path)
         return jsonify({"error": f"データベースエラー: {str(e)}"}), 500
@@ -244,6 +241,7 @@ def delete_bonsai_image(image_id):
     
     # データベースからの削除
     db.execute('DELETE FROM bonsai_images WHERE id = ?', (image_id,))
+    refresh_latest_image_id(db, image['bonsai_id'])
     db.commit()
     
     return jsonify({"success": True, "message": "画像が削除されました"}), 200
@@ -285,6 +283,7 @@ def delete_bonsai(bonsai_id):
         db.execute('DELETE FROM bonsai WHERE id = ?', (bonsai_id,))
         
         db.commit()
+        get_recommendation_cache().invalidate_bonsai(bonsai_id)
         
         return jsonify({
             "success": True,
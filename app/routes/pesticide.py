@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_cors import cross_origin
 from ..db import get_db
+from ..pagination import InvalidPageRequest, paginate, paginated_response
 from .recommend import get_current_season
+from ..recommend_cache import get_recommendation_cache
 
 bp = Blueprint('pesticide', __name__, url_prefix='/api/pesticides')
 
@@ -152,10 +154,14 @@ def get_logs(bonsai_id):
     if user_id and int(user_id) != bonsai['user_id']:
         return jsonify({"error": "この盆栽の記録にアクセスする権限がありません"}), 403
     
-    logs = db.execute(
-        'SELECT * FROM pesticide_logs WHERE bonsai_id = ? ORDER BY date DESC',
-        (bonsai_id,)
-    ).fetchall()
+    # 新しい順（同じ日付はIDの大きい順）
+    try:
+        logs, next_cursor = paginate(
+            db, 'SELECT * FROM pesticide_logs WHERE bonsai_id = ?', (bonsai_id,),
+            ['date', 'id'], scope=f'pesticide_logs:bonsai:{bonsai_id}', descending=True
+        )
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
     
     # フロントエンドと一致するようにデータを整形
     logs_list = []
@@ -167,7 +173,7 @@ def get_logs(bonsai_id):
             log_dict['dosage'] = log_dict['amount']
         logs_list.append(log_dict)
     
-    return jsonify(logs_list)
+    return paginated_response(logs_list, next_cursor)
 
 
 @bp.route('/user/<int:user_id>', methods=['GET'])
@@ -189,16 +195,20 @@ def get_user_logs(user_id):
     
     # IN句を使用してクエリを構築
     placeholders = ','.join(['?'] * len(bonsai_id_list))
-    logs = db.execute(
-        f'''
-        SELECT pl.*, b.name as bonsai_name
-        FROM pesticide_logs pl
-        JOIN bonsai b ON pl.bonsai_id = b.id
-        WHERE pl.bonsai_id IN ({placeholders})
-        ORDER BY pl.date DESC
-        ''',
-        bonsai_id_list
-    ).fetchall()
+    try:
+        logs, next_cursor = paginate(
+            db,
+            f'''
+            SELECT pl.*, b.name as bonsai_name
+            FROM pesticide_logs pl
+            JOIN bonsai b ON pl.bonsai_id = b.id
+            WHERE pl.bonsai_id IN ({placeholders})
+            ''',
+            bonsai_id_list,
+            ['date', 'id'], scope=f'pesticide_logs:user:{user_id}', descending=True
+        )
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
     
     # フロントエンドと一致するようにデータを整形
     logs_list = []
@@ -211,7 +221,7 @@ def get_user_logs(user_id):
             log_dict['dosage'] = log_dict['amount']
         logs_list.append(log_dict)
     
-    return jsonify(logs_list)
+    return paginated_response(logs_list, next_cursor)
 
 @bp.route('/<int:bonsai_id>', methods=['POST'])
 def add_log(bonsai_id):
@@ -233,6 +243,7 @@ def add_log(bonsai_id):
         VALUES (?, ?, ?, ?, ?, ?)
     ''', (bonsai_id, bonsai['user_id'], data['pesticide_name'], data['usage_date'], data.get('dosage', ''), data.get('notes', '')))
     db.commit()
+    get_recommendation_cache().invalidate_bonsai(bonsai_id)
     
     # 新しく追加された記録のIDを取得
     new_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
@@ -264,6 +275,7 @@ def remove_log(log_id):
     # 記録を削除
     db.execute('DELETE FROM pesticide_logs WHERE id = ?', (log_id,))
     db.commit()
+    get_recommendation_cache().invalidate_bonsai(bonsai_id)
     
     return jsonify({
         "message": "農薬記録を削除しました",
@@ -317,6 +329,7 @@ def add_enhanced_log():
         ))
         
         db.commit()
+        get_recommendation_cache().invalidate_bonsai(data['bonsai_id'])
         log_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
         
         return jsonify({
@@ -0,0 +1,112 @@
+from flask import Blueprint, Response, jsonify, current_app, request, stream_with_context
+from ..rag_service import get_chat_sessions, get_rag_chatbot
+import json
+import time
+
+bp = Blueprint('rag_chat', __name__, url_prefix='/api/rag')
+
+MAX_SESSION_ID_LENGTH = 64  # new_session_id() は32文字の16進数
+
+def reference_to_dict(doc):
+    """参照したチャンクの情報（画像のbase64などの大きなメタデータは返さない）"""
+    return {
+        "filename": doc.metadata.get('filename'),
+        "page_number": doc.metadata.get('page_number'),
+        "type": doc.metadata.get('type', 'Text'),
+        "content": doc.page_content
+    }
+
+def sse_event(event, data):
+    """Server-Sent Eventsの1イベント"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@bp.route('/chat', methods=['POST'])
+def chat():
+    """
+    RAGによる質問応答
+
+    リクエスト: {"question": "...", "session_id": "...(省略時は新規セッション)", "stream": true}
+    stream=true（デフォルト）の場合は text/event-stream で以下のイベントを順に返す
+        session    {"session_id"}
+        references {"references": [...]}
+        token      {"text"}  （回答の断片、生成された順）
+        done       {"answer", "timings", "first_token_ms", "context_tokens", "cached"}
+        error      {"error"}  （途中で失敗した場合）
+    stream=false の場合は {"session_id", "answer", "references", "timings", "context_tokens", "cached"} を返す
+    cached=true は回答キャッシュ（同じ・類似の質問への過去の回答）から返したことを表す
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    question = data.get('question') or ''
+    if not isinstance(question, str) or not question.strip():
+        return jsonify({"error": "質問を入力してください"}), 400
+    question = question.strip()
+
+    session_id = data.get('session_id')
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > MAX_SESSION_ID_LENGTH):
+        return jsonify({"error": f"session_id は{MAX_SESSION_ID_LENGTH}文字以内の文字列で指定してください"}), 400
+
+    sessions = get_chat_sessions()
+    session_id = session_id or sessions.new_session_id()
+    history = sessions.history(session_id)
+
+    try:
+        chatbot = get_rag_chatbot()
+    except Exception as e:
+        current_app.logger.exception("Failed to load RAG chatbot")
+        return jsonify({"error": f"RAGチャットボットを読み込めませんでした: {str(e)}"}), 503
+
+    if not data.get('stream', True):
+        try:
+            references = []
+            for event, value in chatbot.stream_output(question, history):
+                if event == 'references':
+                    references = [reference_to_dict(doc) for doc in value]
+                elif event == 'done':
+                    result = value
+        except Exception as e:
+            current_app.logger.exception("RAG chat failed")
+            return jsonify({"error": f"回答の生成に失敗しました: {str(e)}"}), 500
+        sessions.append(session_id, question, result['answer'])
+        return jsonify({
+            "session_id": session_id,
+            "answer": result['answer'],
+            "references": references,
+            "timings": result['timings'],
+            "context_tokens": result['context_tokens'],
+            "cached": result['cached']
+        })
+
+    def generate():
+        started = time.perf_counter()
+        first_token_ms = None
+        yield sse_event('session', {"session_id": session_id})
+        try:
+            for event, value in chatbot.stream_output(question, history):
+                if event == 'references':
+                    yield sse_event('references', {"references": [reference_to_dict(doc) for doc in value]})
+                elif event == 'token':
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                    yield sse_event('token', {"text": value})
+                elif event == 'done':
+                    sessions.append(session_id, question, value['answer'])
+                    yield sse_event('done', dict(value, first_token_ms=first_token_ms))
+        except Exception as e:
+            current_app.logger.exception("RAG chat failed")
+            yield sse_event('error', {"error": f"回答の生成に失敗しました: {str(e)}"})
+
+    # プロキシ（nginx等）でバッファリングされるとトークンが届くのが遅れるため無効にする
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@bp.route('/chat/<session_id>', methods=['DELETE'])
+def clear_chat(session_id):
+    """セッションの会話履歴を削除"""
+    if not get_chat_sessions().clear(session_id):
+        return jsonify({"error": "セッションが見つかりません"}), 404
+    return jsonify({"message": "会話履歴を削除しました"})
@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, current_app, request
 from flask_cors import cross_origin
 from ..db import get_db
+from ..master_snapshot import get_master_snapshot, get_month_season
+from ..recommend_cache import get_recommendation_cache
 from datetime import datetime, timedelta
 import calendar
 
@@ -18,70 +20,10 @@ def get_current_season():
     else:
         return "冬"
 
-def is_month_in_range(target_month, start_month, end_month):
-    """指定月が月範囲内にあるかチェック（年をまたぐ場合も対応）"""
-    if start_month <= end_month:
-        # 通常の範囲（例: 3月-6月）
-        return start_month <= target_month <= end_month
-    else:
-        # 年をまたぐ範囲（例: 12月-2月）
-        return target_month >= start_month or target_month <= end_month
-
 def get_monthly_risks_for_month(db, species_id, target_month):
-    """指定月の樹種別害虫・病気リスクを取得（月ベース）"""
-    # 月ベースデータを優先、なければ季節ベースをフォールバック
-    query = '''
-        SELECT spd.*, pdm.name as pest_disease_name, pdm.type as pest_disease_type, 
-               pdm.start_month, pdm.end_month, pdm.season as pest_disease_season,
-               pdm.description as pest_disease_description
-        FROM species_pest_disease spd
-        JOIN pest_disease_master pdm ON spd.pest_disease_id = pdm.id
-        WHERE spd.species_id = ?
-        ORDER BY spd.occurrence_probability DESC, pdm.type DESC
-    '''
-    
-    all_risks = db.execute(query, (species_id,)).fetchall()
-    filtered_risks = []
-    
-    for risk in all_risks:
-        risk_dict = dict(risk)
-        
-        # まず月ベースデータをチェック
-        if risk_dict['start_month'] and risk_dict['end_month']:
-            # species_pest_diseaseテーブルの月データ優先
-            spd_start = risk_dict.get('start_month')
-            spd_end = risk_dict.get('end_month')
-            if spd_start and spd_end and is_month_in_range(target_month, spd_start, spd_end):
-                filtered_risks.append(risk_dict)
-                continue
-        
-        # pest_disease_masterの月データをチェック
-        if risk_dict.get('start_month') and risk_dict.get('end_month'):
-            if is_month_in_range(target_month, risk_dict['start_month'], risk_dict['end_month']):
-                filtered_risks.append(risk_dict)
-                continue
-        
-        # フォールバック: 季節ベースデータをチェック
-        season = risk_dict.get('pest_disease_season') or risk_dict.get('season')
-        if season:
-            current_season = get_month_season(target_month)
-            if (season == "通年" or 
-                season == current_season or
-                (season == "梅雨" and target_month == 6)):
-                filtered_risks.append(risk_dict)
-    
-    return filtered_risks
-
-def get_month_season(month):
-    """指定された月の季節を取得（互換性のため残存）"""
-    if month in [3, 4, 5]:
-        return "春"
-    elif month in [6, 7, 8]:
-        return "夏"
-    elif month in [9, 10, 11]:
-        return "秋"
-    else:
-        return "冬"
+    """指定月の樹種別害虫・病気リスクを取得（月ベース、事前計算表を参照）"""
+    # 月ベースデータ優先・季節ベースのフォールバック判定はスナップショット構築時に済んでいる
+    return get_master_snapshot(db).risks_for_month(species_id, target_month)
 
 def get_seasonal_risks_for_month(db, species_id, target_month):
     """指定月の樹種別害虫・病気リスクを取得（月ベースに移行）"""
@@ -120,32 +62,11 @@ def get_effective_pesticides(db, pest_disease_ids, current_season):
     if not pest_disease_ids:
         return []
     
-    placeholders = ','.join(['?'] * len(pest_disease_ids))
-    query = f'''
-        SELECT pe.*, pm.name as pesticide_name, pm.type as pesticide_type, 
-               pm.interval_days, pm.active_ingredient, pm.description,
-               AVG(pe.effectiveness_level) as avg_effectiveness
-        FROM pesticide_effectiveness pe
-        JOIN pesticide_master pm ON pe.pesticide_id = pm.id
-        WHERE pe.pest_disease_id IN ({placeholders})
-        GROUP BY pe.pesticide_id
-        ORDER BY avg_effectiveness DESC, pm.interval_days ASC
-    '''
-    
-    pesticides = db.execute(query, pest_disease_ids).fetchall()
-    return [dict(pesticide) for pesticide in pesticides]
+    return get_master_snapshot(db).effective_pesticides(pest_disease_ids)
 
 def get_prohibited_pesticides(db, species_id):
     """樹種に対する禁止・警告農薬を取得"""
-    query = '''
-        SELECT spp.*, pm.name as pesticide_name
-        FROM species_prohibited_pesticides spp
-        JOIN pesticide_master pm ON spp.pesticide_id = pm.id
-        WHERE spp.species_id = ?
-    '''
-    
-    prohibited = db.execute(query, (species_id,)).fetchall()
-    return [dict(p) for p in prohibited]
+    return get_master_snapshot(db).prohibitions_for_species(species_id)
 
 def filter_by_season_and_prohibition(pesticides, species_id, db, current_season):
     """季節と禁止薬剤でフィルタリング"""
@@ -172,54 +93,87 @@ def filter_by_season_and_prohibition(pesticides, species_id, db, current_season)
 
 def analyze_pesticide_history(db, bonsai_id, days_back=90):
     """過去の農薬使用履歴を分析"""
+    return analyze_pesticide_histories(db, [bonsai_id], days_back)[bonsai_id]
+
+def analyze_pesticide_histories(db, bonsai_ids, days_back=90):
+    """複数の盆栽の農薬使用履歴をまとめて分析（履歴の取得は1クエリ）"""
+    if not bonsai_ids:
+        return {}
+    
     cutoff_date = (datetime.today() - timedelta(days=days_back)).strftime("%Y-%m-%d")
+    placeholders = ','.join(['?'] * len(bonsai_ids))
+    history = db.execute(
+        f'''
+        SELECT bonsai_id, pesticide_name, date FROM pesticide_logs
+        WHERE bonsai_id IN ({placeholders}) AND date >= ?
+        ORDER BY bonsai_id, date DESC
+        ''',
+        list(bonsai_ids) + [cutoff_date]
+    ).fetchall()
+    
+    return summarize_pesticide_histories(history, bonsai_ids, get_master_snapshot(db).pesticide_types)
+
+def analyze_user_pesticide_histories(db, user_id, bonsai_ids, days_back=90):
+    """ユーザーの全盆栽の農薬使用履歴をまとめて分析（盆栽数によらず1クエリ）"""
+    if not bonsai_ids:
+        return {}
     
+    cutoff_date = (datetime.today() - timedelta(days=days_back)).strftime("%Y-%m-%d")
     history = db.execute(
-        'SELECT * FROM pesticide_logs WHERE bonsai_id = ? AND date >= ? ORDER BY date DESC',
-        (bonsai_id, cutoff_date)
+        '''
+        SELECT bonsai_id, pesticide_name, date FROM pesticide_logs
+        WHERE bonsai_id IN (SELECT id FROM bonsai WHERE user_id = ?) AND date >= ?
+        ORDER BY bonsai_id, date DESC
+        ''',
+        (user_id, cutoff_date)
     ).fetchall()
     
-    analysis = {
-        "total_applications": len(history),
-        "pesticide_frequency": {},
-        "last_pesticide_type": None,
-        "days_since_fungicide": None,
-        "days_since_insecticide": None,
-        "recent_pesticides": []
+    return summarize_pesticide_histories(history, bonsai_ids, get_master_snapshot(db).pesticide_types)
+
+def summarize_pesticide_histories(history, bonsai_ids, pesticide_types):
+    """日付の新しい順に並んだ履歴行から盆栽ごとの分析結果を1パスで作成
+    
+    農薬タイプはマスタスナップショットの name → type 表から引く（行ごとのクエリは発行しない）
+    """
+    analyses = {
+        bonsai_id: {
+            "total_applications": 0,
+            "pesticide_frequency": {},
+            "last_pesticide_type": None,
+            "days_since_fungicide": None,
+            "days_since_insecticide": None,
+            "recent_pesticides": []
+        }
+        for bonsai_id in bonsai_ids
     }
     
     today = datetime.today()
     
-    for i, log in enumerate(history):
+    for log in history:
+        analysis = analyses[log['bonsai_id']]
         pesticide_name = log['pesticide_name']
-        log_date = datetime.strptime(log['date'], "%Y-%m-%d")
-        days_ago = (today - log_date).days
+        analysis["total_applications"] += 1
         
         # 使用頻度をカウント
-        if pesticide_name not in analysis["pesticide_frequency"]:
-            analysis["pesticide_frequency"][pesticide_name] = 0
-        analysis["pesticide_frequency"][pesticide_name] += 1
+        frequency = analysis["pesticide_frequency"]
+        frequency[pesticide_name] = frequency.get(pesticide_name, 0) + 1
         
         # 最近使用した農薬リスト（重複を避ける）
         if len(analysis["recent_pesticides"]) < 3 and pesticide_name not in analysis["recent_pesticides"]:
             analysis["recent_pesticides"].append(pesticide_name)
         
-        # 農薬タイプを判定
-        pesticide_info = db.execute(
-            'SELECT type FROM pesticide_master WHERE name = ?',
-            (pesticide_name,)
-        ).fetchone()
-        
-        if pesticide_info:
-            pesticide_type = pesticide_info['type']
-            if analysis["last_pesticide_type"] is None:
+        # 農薬タイプを判定（最新の判定可能な記録のみ）
+        if analysis["last_pesticide_type"] is None:
+            pesticide_type = pesticide_types.get(pesticide_name)
+            if pesticide_type:
                 analysis["last_pesticide_type"] = pesticide_type
+                days_ago = (today - datetime.strptime(log['date'], "%Y-%m-%d")).days
                 if pesticide_type == "fungicide":
                     analysis["days_since_fungicide"] = days_ago
                 else:
                     analysis["days_since_insecticide"] = days_ago
     
-    return analysis
+    return analyses
 
 def apply_rotation_logic(pesticides, history_analysis, latest_log):
     """農薬ローテーションロジックを適用"""
@@ -254,15 +208,19 @@ def apply_rotation_logic(pesticides, history_analysis, latest_log):
     scored_pesticides.sort(key=lambda x: x['rotation_score'], reverse=True)
     return scored_pesticides
 
-def get_intelligent_recommendation(db, bonsai, latest_log):
-    """マスタテーブルベースのインテリジェントな推奨（月ベース対応、殺虫剤・殺菌剤別）"""
+def get_intelligent_recommendation(db, bonsai, latest_log, history_analysis=None):
+    """マスタテーブルベースのインテリジェントな推奨（月ベース対応、殺虫剤・殺菌剤別）
+    
+    history_analysis を渡した場合は履歴分析のクエリを省略する（一括推奨用）
+    """
     species_id = bonsai['species_id']
     today = datetime.today()
     current_month = today.month
     current_season = get_current_season()
     
     # 履歴分析
-    history_analysis = analyze_pesticide_history(db, bonsai['id'])
+    if history_analysis is None:
+        history_analysis = analyze_pesticide_history(db, bonsai['id'])
     
     # 樹種の害虫・病気リスクを取得（当月）
     monthly_risks = get_monthly_risks_for_month(db, species_id, current_month)
@@ -388,20 +346,7 @@ def get_effective_pesticides_by_type(db, pest_disease_ids, pesticide_type, curre
     if not pest_disease_ids:
         return []
     
-    placeholders = ','.join(['?'] * len(pest_disease_ids))
-    query = f'''
-        SELECT pe.*, pm.name as pesticide_name, pm.type as pesticide_type, 
-               pm.interval_days, pm.active_ingredient, pm.description,
-               AVG(pe.effectiveness_level) as avg_effectiveness
-        FROM pesticide_effectiveness pe
-        JOIN pesticide_master pm ON pe.pesticide_id = pm.id
-        WHERE pe.pest_disease_id IN ({placeholders}) AND pm.type = ?
-        GROUP BY pe.pesticide_id
-        ORDER BY avg_effectiveness DESC, pm.interval_days ASC
-    '''
-    
-    pesticides = db.execute(query, pest_disease_ids + [pesticide_type]).fetchall()
-    return [dict(pesticide) for pesticide in pesticides]
+    return get_master_snapshot(db).effective_pesticides(pest_disease_ids, pesticide_type)
 
 def get_no_risk_recommendation(pesticide_type):
     """リスクがない場合の推奨"""
@@ -431,25 +376,15 @@ def get_no_pesticide_recommendation(pesticide_type):
 def get_fallback_recommendation_separated(db, current_season, history_analysis, latest_log):
     """フォールバック推奨（殺虫剤・殺菌剤別）"""
     # 汎用的な農薬を取得
-    insecticides = db.execute('''
-        SELECT * FROM pesticide_master 
-        WHERE type = 'insecticide'
-        ORDER BY interval_days ASC
-        LIMIT 3
-    ''').fetchall()
-    
-    fungicides = db.execute('''
-        SELECT * FROM pesticide_master 
-        WHERE type = 'fungicide'
-        ORDER BY interval_days ASC
-        LIMIT 3
-    ''').fetchall()
+    snapshot = get_master_snapshot(db)
+    insecticides = snapshot.pesticides_of_type('insecticide', limit=3)
+    fungicides = snapshot.pesticides_of_type('fungicide', limit=3)
     
     insecticide_rec = None
     fungicide_rec = None
     
     if insecticides:
-        recommended = dict(insecticides[0])
+        recommended = insecticides[0]
         insecticide_rec = {
             "recommendation": recommended['name'],
             "reason": "汎用殺虫剤推奨（マスタデータ不足）",
@@ -462,7 +397,7 @@ def get_fallback_recommendation_separated(db, current_season, history_analysis,
         insecticide_rec = get_no_pesticide_recommendation("insecticide")
     
     if fungicides:
-        recommended = dict(fungicides[0])
+        recommended = fungicides[0]
         fungicide_rec = {
             "recommendation": recommended['name'],
             "reason": "汎用殺菌剤推奨（マスタデータ不足）",
@@ -525,6 +460,14 @@ def recommend(bonsai_id):
     if user_id and int(user_id) != bonsai['user_id']:
         return jsonify({"error": "この盆栽の情報にアクセスする権限がありません"}), 403
     
+    # キャッシュ済みの推奨があればそれを返す
+    cache = get_recommendation_cache()
+    cache_key = cache.make_key('recommendation', bonsai_id, get_master_snapshot(db).version,
+                               bonsai['pesticide_log_version'])
+    result = cache.get(cache_key)
+    if result is not None:
+        return jsonify(result)
+    
     # 最新の農薬記録を取得
     latest = db.execute(
         'SELECT * FROM pesticide_logs WHERE bonsai_id = ? ORDER BY date DESC LIMIT 1',
@@ -533,9 +476,42 @@ def recommend(bonsai_id):
     
     # インテリジェントな推奨を取得
     result = get_intelligent_recommendation(db, bonsai, latest)
+    cache.put(cache_key, result)
     
     return jsonify(result)
 
+def load_user_recommendation_context(db, user_id, days_back=90):
+    """ユーザーの全盆栽の推奨計算に必要なデータを一括取得
+    
+    盆栽一覧・盆栽ごとの最新農薬記録・履歴分析をそれぞれ1クエリで取得する
+    （樹種リスクと農薬情報はマスタスナップショットから参照）
+    """
+    bonsai_list = db.execute(
+        'SELECT * FROM bonsai WHERE user_id = ?', 
+        (user_id,)
+    ).fetchall()
+    
+    if not bonsai_list:
+        return [], {}, {}
+    
+    # 盆栽ごとの最新の農薬記録
+    latest_rows = db.execute('''
+        SELECT * FROM (
+            SELECT pl.*, ROW_NUMBER() OVER (
+                PARTITION BY pl.bonsai_id ORDER BY pl.date DESC, pl.id DESC
+            ) AS row_rank
+            FROM pesticide_logs pl
+            WHERE pl.bonsai_id IN (SELECT id FROM bonsai WHERE user_id = ?)
+        )
+        WHERE row_rank = 1
+    ''', (user_id,)).fetchall()
+    latest_logs = {row['bonsai_id']: row for row in latest_rows}
+    
+    bonsai_ids = [b['id'] for b in bonsai_list]
+    histories = analyze_user_pesticide_histories(db, user_id, bonsai_ids, days_back)
+    
+    return bonsai_list, latest_logs, histories
+
 @bp.route('/recommendations/user/<int:user_id>', methods=['GET'])
 @cross_origin(origins=['https://bonsai.modur4.com', 'http://localhost:6173', 'http://localhost:6000'], 
               allow_headers=['Content-Type', 'Authorization'], 
@@ -544,11 +520,8 @@ def user_recommendations(user_id):
     """ユーザーのすべての盆栽の農薬推奨情報を取得"""
     db = get_db(current_app)
     
-    # ユーザーの盆栽を取得
-    bonsai_list = db.execute(
-        'SELECT * FROM bonsai WHERE user_id = ?', 
-        (user_id,)
-    ).fetchall()
+    # 盆栽・最新記録・履歴を盆栽数によらず固定回数のクエリで取得
+    bonsai_list, latest_logs, histories = load_user_recommendation_context(db, user_id)
     
     if not bonsai_list:
         return jsonify([])
@@ -556,14 +529,10 @@ def user_recommendations(user_id):
     recommendations = []
     
     for bonsai in bonsai_list:
-        # 各盆栽について最新の農薬記録を取得
-        latest = db.execute(
-            'SELECT * FROM pesticide_logs WHERE bonsai_id = ? ORDER BY date DESC LIMIT 1',
-            (bonsai['id'],)
-        ).fetchone()
-        
-        # 推奨情報を取得
-        recommendation_detail = get_intelligent_recommendation(db, bonsai, latest)
+        # 推奨情報をメモリ上で計算
+        recommendation_detail = get_intelligent_recommendation(
+            db, bonsai, latest_logs.get(bonsai['id']), histories[bonsai['id']]
+        )
         
         # レスポンス用の情報を整理
         recommendation_info = {
@@ -692,6 +661,14 @@ def get_monthly_risks(bonsai_id):
     if not bonsai:
         return jsonify({"error": "盆栽が見つからないか、アクセス権限がありません"}), 404
     
+    # キャッシュ済みの結果があればそれを返す
+    cache = get_recommendation_cache()
+    cache_key = cache.make_key('monthly_risks', bonsai_id, get_master_snapshot(db).version,
+                               bonsai['pesticide_log_version'])
+    result = cache.get(cache_key)
+    if result is not None:
+        return jsonify(result)
+    
     today = datetime.now()
     current_month = today.month
     next_month = (current_month % 12) + 1
@@ -728,8 +705,9 @@ def get_monthly_risks(bonsai_id):
         return rotated_pesticides[:5] if rotated_pesticides else []  # 上位5つまで
     
     current_recommendations = get_recommendations_for_risks(monthly_risks)
+    next_month_risks = get_monthly_risks_for_month(db, bonsai['species_id'], next_month)
     
-    return jsonify({
+    result = {
         "bonsai": {
             "id": bonsai['id'],
             "name": bonsai['name'],
@@ -745,12 +723,15 @@ def get_monthly_risks(bonsai_id):
         "next_month": {
             "month": next_month,
             "season": get_month_season(next_month),
-            "risks": get_monthly_risks_for_month(db, bonsai['species_id'], next_month),
-            "recommendations": get_recommendations_for_risks(get_monthly_risks_for_month(db, bonsai['species_id'], next_month))
+            "risks": next_month_risks,
+            "recommendations": get_recommendations_for_risks(next_month_risks)
         },
         "history_analysis": history_analysis,
         "disclaimer": {
             "combination_warning": "この組み合わせは参考であり、科学的な正しさに裏付けされたものではありません。",
             "concentration_warning": "希釈濃度はメーカーの説明書をよく読んで、ご自身で判断してください。"
         }
-    })
+    }
+    cache.put(cache_key, result)
+    
+    return jsonify(result)
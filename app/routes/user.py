@@ -90,8 +90,6 @@ def api_register():
         response = jsonify({"success": False, "message": "このユーザー名は既に使用されています"})
         response.status_code = 409
         return _corsify_actual_response(response)
-    finally:
-        conn.close()
 
 @bp.route('/users', methods=['GET', 'OPTIONS'])
 def api_get_users():
@@ -137,8 +135,6 @@ def api_get_users():
         })
         response.status_code = 500
         return _corsify_actual_response(response)
-    finally:
-        conn.close()
 
 # ユーザーが管理者かどうかを確認する関数
 @bp.route('/is-admin/<int:user_id>', methods=['GET', 'OPTIONS'])
@@ -157,8 +153,6 @@ def is_admin(user_id):
         response = jsonify({"success": False, "message": str(e)})
         response.status_code = 500
         return _corsify_actual_response(response)
-    finally:
-        conn.close()
 
 @bp.route('/<int:user_id>', methods=['GET', 'OPTIONS'])
 def get_user_by_id(user_id):
@@ -185,8 +179,6 @@ def get_user_by_id(user_id):
         response = jsonify({"success": False, "message": str(e)})
         response.status_code = 500
         return _corsify_actual_response(response)
-    finally:
-        conn.close()
 
 # 管理者ステータスをチェックするユーティリティ関数
 def check_admin_status():
@@ -204,8 +196,6 @@ def check_admin_status():
     except Exception as e:
         print(f"管理者権限の確認中にエラー: {e}")
         return False
-    finally:
-        conn.close()
 
 # CORS プリフライトレスポンスを構築する関数
 def _build_cors_preflight_response():
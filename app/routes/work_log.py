@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify, current_app
 from ..db import get_db
+from ..pagination import InvalidPageRequest, paginate, paginated_response
 
 bp = Blueprint('work_log', __name__, url_prefix='/api/work-logs')
 
@@ -35,10 +36,14 @@ def get_work_logs(bonsai_id):
     if user_id and int(user_id) != bonsai['user_id']:
         return jsonify({"error": "この盆栽の記録にアクセスする権限がありません"}), 403
     
-    logs = db.execute(
-        'SELECT * FROM work_logs WHERE bonsai_id = ? ORDER BY date DESC',
-        (bonsai_id,)
-    ).fetchall()
+    # 新しい順（同じ日付はIDの大きい順）
+    try:
+        logs, next_cursor = paginate(
+            db, 'SELECT * FROM work_logs WHERE bonsai_id = ?', (bonsai_id,),
+            ['date', 'id'], scope=f'work_logs:bonsai:{bonsai_id}', descending=True
+        )
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
     
     # データを整形
     logs_list = []
@@ -46,7 +51,7 @@ def get_work_logs(bonsai_id):
         log_dict = dict(log)
         logs_list.append(log_dict)
     
-    return jsonify(logs_list)
+    return paginated_response(logs_list, next_cursor)
 
 @bp.route('/user/<int:user_id>', methods=['GET'])
 def get_user_work_logs(user_id):
@@ -67,16 +72,20 @@ def get_user_work_logs(user_id):
     
     # IN句を使用してクエリを構築
     placeholders = ','.join(['?'] * len(bonsai_id_list))
-    logs = db.execute(
-        f'''
-        SELECT wl.*, b.name as bonsai_name
-        FROM work_logs wl
-        JOIN bonsai b ON wl.bonsai_id = b.id
-        WHERE wl.bonsai_id IN ({placeholders})
-        ORDER BY wl.date DESC
-        ''',
-        bonsai_id_list
-    ).fetchall()
+    try:
+        logs, next_cursor = paginate(
+            db,
+            f'''
+            SELECT wl.*, b.name as bonsai_name
+            FROM work_logs wl
+            JOIN bonsai b ON wl.bonsai_id = b.id
+            WHERE wl.bonsai_id IN ({placeholders})
+            ''',
+            bonsai_id_list,
+            ['date', 'id'], scope=f'work_logs:user:{user_id}', descending=True
+        )
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
     
     # データを整形
     logs_list = []
@@ -84,7 +93,7 @@ def get_user_work_logs(user_id):
         log_dict = dict(log)
         logs_list.append(log_dict)
     
-    return jsonify(logs_list)
+    return paginated_response(logs_list, next_cursor)
 
 @bp.route('/<int:bonsai_id>', methods=['POST'])
 def add_work_log(bonsai_id):
@@ -1,5 +1,5 @@
 from app import create_app
-from app.db import get_db
+from app.db import get_db, refresh_latest_image_id
 from werkzeug.security import generate_password_hash
 
 # db.execute('''
@@ -32,6 +32,8 @@ def create_bonsai_images(bonsai_id, user_id, filename, original_filename):
             'INSERT INTO bonsai_images (bonsai_id, user_id, filename, original_filename) VALUES (?, ?, ?, ?)',
             (bonsai_id, user_id, filename, original_filename)
         )
+        # 盆栽の最新画像ID（bonsai.latest_image_id）も同じトランザクションで更新
+        refresh_latest_image_id(db, bonsai_id)
         db.commit()
         
         print(f"盆栽画像 '{filename}' が作成されました。")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+pdf_chunking のチャンクの表現によるメモリ使用量（ピークRSS）の比較
+- dict : 従来の形式（チャンクごとにbase_metadataをコピーした辞書、Document AIのレイアウトへの参照付き）
+- slots: Chunk（__slots__、メタデータは共有、レイアウトは参照しない）
+それぞれ別のプロセスでチャンクを抽出し、OCR結果（document）を解放した後に保持しているメモリ（tracemalloc）と
+ピークRSSを表示する（解放したメモリはRSSからはすぐには減らないため、保持している量はtracemallocで測る）
+
+OCRキャッシュに保存された実際のPDFのOCR結果で測る場合:
+    python test_scripts/bench_chunk_memory.py --ocr-file data/ocr_cache/ab/abcdef....pb
+指定しない場合は合成したDocument AIのページ構造（bench_line_assignment.py と同じもの）を使う
+"""
+
+import argparse
+import gc
+import os
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'app', 'rag'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PAGES = 400
+DEFAULT_LINES_PER_PAGE = 200
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_document(args):
+    if args.ocr_file:
+        from google.cloud import documentai
+        with open(args.ocr_file, "rb") as f:
+            return documentai.Document.deserialize(f.read())
+    from bench_line_assignment import make_document
+    return make_document(args.lines_per_page, 5, pages=args.pages)
+
+
+def legacy_dict(chunk, document):
+    """従来のcreate_chunkと同じ形式の辞書（_layoutでOCR結果を参照し続ける）"""
+    data = chunk.to_dict()
+    page = document.pages[chunk.page_number - 1]
+    elements = page.paragraphs if chunk.chunk_type == "paragraph" else page.lines
+    data["_layout"] = elements[chunk.element_index].layout
+    return data
+
+
+def run(args):
+    import pdf_chunking
+
+    tracemalloc.start()
+    document = load_document(args)
+    loaded = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    chunks = pdf_chunking.extract_document_chunks(document, {"source_file": "bench.pdf", "filename": "bench.pdf"})
+    if args.mode == "dict":
+        # 1件ずつ置き換えて、両方の表現が同時に存在する時間を短くする
+        for i, chunk in enumerate(chunks):
+            chunks[i] = legacy_dict(chunk, document)
+    del document
+    gc.collect()
+    retained, peak = (size / 1024 / 1024 for size in tracemalloc.get_traced_memory())
+    tracemalloc.stop()
+    print(f"{args.mode:>5}: チャンク {len(chunks):6d}件  OCR結果 {loaded:7.1f}MB  "
+          f"OCR結果の解放後に保持 {retained:7.1f}MB  ピーク {peak:7.1f}MB  ピークRSS {peak_rss_mb():7.1f}MB")
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="チャンクの表現によるピークRSSの比較")
+    parser.add_argument("--ocr-file", help="OCRキャッシュの.pbファイル（documentai.Documentをシリアライズしたもの）")
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES)
+    parser.add_argument("--lines-per-page", type=int, default=DEFAULT_LINES_PER_PAGE)
+    parser.add_argument("--mode", choices=["dict", "slots"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args)
+        return
+    # ピークRSSはプロセス単位のため、表現ごとに別のプロセスで測る
+    for mode in ["dict", "slots"]:
+        subprocess.run([sys.executable, __file__, "--mode", mode] + sys.argv[1:], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+農薬履歴分析（analyze_pesticide_histories）のベンチマーク
+ログ件数を増やしても発行されるSQLの数が一定であることを確認する
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.db import get_db, init_master_data
+from app.routes.recommend import analyze_pesticide_histories
+
+BONSAI_COUNT = 50
+LOG_VOLUMES = [100, 1000, 10000, 50000]
+
+def seed_logs(db, log_count):
+    """盆栽と農薬記録を投入"""
+    db.execute('DELETE FROM pesticide_logs')
+    db.execute('DELETE FROM bonsai')
+    for i in range(BONSAI_COUNT):
+        db.execute('INSERT INTO bonsai (user_id, name, species, species_id) VALUES (1, ?, ?, 1)',
+                   (f'盆栽{i}', '黒松'))
+    bonsai_ids = [row['id'] for row in db.execute('SELECT id FROM bonsai')]
+    names = [row['name'] for row in db.execute('SELECT name FROM pesticide_master')]
+    today = datetime.today()
+    db.executemany(
+        'INSERT INTO pesticide_logs (bonsai_id, user_id, date, pesticide_name) VALUES (?, 1, ?, ?)',
+        [
+            (random.choice(bonsai_ids),
+             (today - timedelta(days=random.randint(0, 89))).strftime("%Y-%m-%d"),
+             random.choice(names))
+            for _ in range(log_count)
+        ]
+    )
+    db.commit()
+    return bonsai_ids
+
+def bench():
+    print('=== 農薬履歴分析ベンチマーク ===')
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'DATABASE': os.path.join(tmp, 'bench.db'),
+            'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+        })
+        with app.app_context():
+            db = get_db()
+            init_master_data()
+            print(f'{"ログ件数":>10} {"クエリ数":>8} {"処理時間(ms)":>14}')
+            for log_count in LOG_VOLUMES:
+                bonsai_ids = seed_logs(db, log_count)
+                # マスタスナップショットを事前に構築しておく
+                analyze_pesticide_histories(db, bonsai_ids[:1])
+
+                statements = []
+                db.set_trace_callback(statements.append)
+                start = time.perf_counter()
+                analyses = analyze_pesticide_histories(db, bonsai_ids)
+                elapsed = (time.perf_counter() - start) * 1000
+                db.set_trace_callback(None)
+
+                total = sum(a['total_applications'] for a in analyses.values())
+                assert total == log_count, (total, log_count)
+                print(f'{log_count:>10} {len(statements):>8} {elapsed:>14.1f}')
+
+if __name__ == '__main__':
+    bench()
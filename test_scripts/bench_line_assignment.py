@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+pdf_chunking.extract_document_chunks の行→段落の割り当てのベンチマーク
+Document AIのページ構造（段落・行のtext_anchorとbounding_poly）を合成し、
+段落ごとに全行を走査する従来の割り当てと、テキスト範囲の索引（build_line_index）による割り当てを比較する
+
+1ページの行数を増やしたときに、1行あたりの時間がほぼ一定（ページの行数に線形）であることを確認する:
+    python test_scripts/bench_line_assignment.py
+    python test_scripts/bench_line_assignment.py --sizes 200 800 3200 --lines-per-paragraph 4
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'app', 'rag'))
+
+from pdf_chunking import build_line_index, extract_document_chunks, find_lines_in_range, get_text_range
+
+DEFAULT_SIZES = [100, 400, 1600, 6400]
+LINES_PER_PARAGRAPH = 5
+LEGACY_MAX_LINES = 1600  # 従来の割り当ては行数の2乗に比例するため、これより大きいページでは測らない
+REPEAT = 3
+
+SAMPLE_TEXT = "松の芽切りは六月下旬から七月上旬に行い、二番芽の長さを揃える。"
+
+
+def make_layout(start, end, x, y, vertical):
+    width, height = (20, 200) if vertical else (200, 20)
+    vertices = [
+        SimpleNamespace(x=x, y=y),
+        SimpleNamespace(x=x + width, y=y),
+        SimpleNamespace(x=x + width, y=y + height),
+        SimpleNamespace(x=x, y=y + height),
+    ]
+    return SimpleNamespace(
+        text_anchor=SimpleNamespace(text_segments=[SimpleNamespace(start_index=start, end_index=end)]),
+        bounding_poly=SimpleNamespace(vertices=vertices),
+        orientation=0,
+    )
+
+
+def make_document(lines_per_page, lines_per_paragraph, pages=1, seed=0):
+    """合成したDocument AIのDocument（段落は連続する行のテキスト範囲を覆う）"""
+    rng = random.Random(seed)
+    texts = []
+    offset = 0
+    document_pages = []
+    for _ in range(pages):
+        lines, paragraphs = [], []
+        for first in range(0, lines_per_page, lines_per_paragraph):
+            vertical = rng.random() < 0.3
+            para_start = offset
+            for i in range(first, min(first + lines_per_paragraph, lines_per_page)):
+                text = SAMPLE_TEXT[:rng.randint(8, len(SAMPLE_TEXT))] + "\n"
+                texts.append(text)
+                x, y = (i * 25, 0) if vertical else (0, i * 25)
+                lines.append(SimpleNamespace(layout=make_layout(offset, offset + len(text), x, y, vertical)))
+                offset += len(text)
+            paragraphs.append(SimpleNamespace(layout=make_layout(para_start, offset, 0, first * 25, vertical)))
+        # Document AIの出力と同様に、行の順序は読み順で段落の範囲順とは限らない
+        rng.shuffle(lines)
+        document_pages.append(SimpleNamespace(paragraphs=paragraphs, lines=lines))
+    return SimpleNamespace(text="".join(texts), pages=document_pages)
+
+
+def legacy_assignment(page):
+    """従来の割り当て（段落ごとにページの全行を走査する）"""
+    result = []
+    for paragraph in page.paragraphs:
+        para_start, para_end = get_text_range(paragraph.layout)
+        found = []
+        for line_idx, line in enumerate(page.lines):
+            line_start, line_end = get_text_range(line.layout)
+            if (line_start is not None and line_end is not None and
+                para_start is not None and para_end is not None and
+                line_start >= para_start and line_end <= para_end):
+                found.append(line_idx)
+        result.append(found)
+    return result
+
+
+def indexed_assignment(page):
+    line_index = build_line_index(page.lines)
+    result = []
+    for paragraph in page.paragraphs:
+        para_start, para_end = get_text_range(paragraph.layout)
+        result.append(find_lines_in_range(line_index, para_start, para_end))
+    return result
+
+
+def best_of(func, *args):
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="行→段落の割り当てのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="1ページの行数")
+    parser.add_argument("--lines-per-paragraph", type=int, default=LINES_PER_PARAGRAPH)
+    args = parser.parse_args()
+
+    print(f"{'行数':>6} {'段落数':>6} {'従来(ms)':>10} {'索引(ms)':>10} {'索引(us/行)':>12} {'抽出全体(ms)':>13} {'抽出(us/行)':>12}")
+    for size in args.sizes:
+        document = make_document(size, args.lines_per_paragraph)
+        page = document.pages[0]
+
+        indexed = indexed_assignment(page)
+        indexed_ms = best_of(indexed_assignment, page)
+        if size <= LEGACY_MAX_LINES:
+            if legacy_assignment(page) != indexed:
+                print(f"割り当てが一致しません (行数={size})")
+                sys.exit(1)
+            legacy = f"{best_of(legacy_assignment, page):10.1f}"
+        else:
+            legacy = f"{'-':>10}"
+        extract_ms = best_of(extract_document_chunks, document, {"filename": "synthetic.pdf"})
+
+        print(f"{size:6d} {len(page.paragraphs):6d} {legacy} {indexed_ms:10.2f} "
+              f"{indexed_ms * 1000 / size:12.2f} {extract_ms:13.1f} {extract_ms * 1000 / size:12.2f}")
+    print("割り当て結果は従来の方法と一致しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+キーワード検索用n-gramトークナイザのマイクロベンチマーク
+RAGChatBot.preprocess_func（文字列のn-gram）と app/rag/ngram_tokenizer.py のハッシュ版を比較する
+
+コーパスはデフォルトではリポジトリ内の日本語テキスト（README・マスタデータの説明文）を
+512文字（create_vectorstore.py のチャンクサイズ）ごとに区切って作成する。
+実際の取り込み済みコーパスで測る場合はキーワードインデックスの docs.jsonl を指定する:
+    python test_scripts/bench_ngram_tokenizer.py --corpus data/keyword_index/seg-000001/docs.jsonl
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'app', 'rag'))
+
+from ngram_tokenizer import batch_ngram_ids, ngram_ids, text_to_ngram_ids
+
+CHUNK_SIZE = 512
+DEFAULT_DOCS = 2000
+REPEAT = 3
+
+JAPANESE_RUN = re.compile(r'[^\x00-\x7f]{8,}[^\n"\']*')
+
+def preprocess_func(text):
+    """RAGChatBot.preprocess_func と同じ処理（3〜5文字のn-gramの重複なしリスト）"""
+    i, j = 3, 5
+    if len(text) < i:
+        return [text]
+    ngrams = []
+    for n in range(i, j + 1):
+        for k in range(len(text) - n + 1):
+            ngrams.append(text[k : k + n])
+    return list(set(ngrams))
+
+def load_repo_corpus(doc_count):
+    """リポジトリ内の日本語の文をつなげて CHUNK_SIZE 文字の文書を作成"""
+    sentences = []
+    paths = [os.path.join(ROOT, 'README.md'), os.path.join(ROOT, 'app', 'db.py')]
+    paths += glob.glob(os.path.join(ROOT, 'options', '*.py'))
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            sentences += JAPANESE_RUN.findall(f.read())
+
+    random.seed(0)
+    docs = []
+    for _ in range(doc_count):
+        text = ''
+        while len(text) < CHUNK_SIZE:
+            text += random.choice(sentences) + '。'
+        docs.append(text[:CHUNK_SIZE])
+    return docs
+
+def load_jsonl_corpus(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['text'] for line in f]
+
+def measure(label, func, docs, chars):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(docs)
+        best = min(best, time.perf_counter() - start)
+    print(f'{label:<34} {best * 1000:>10.1f} {len(docs) / best:>12.0f} {chars / best / 1e6:>10.2f}')
+    return best
+
+def bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', help='docs.jsonl（キーワードインデックスの文書ファイル）')
+    parser.add_argument('--docs', type=int, default=DEFAULT_DOCS, help='リポジトリのテキストから作る文書数')
+    args = parser.parse_args()
+
+    docs = load_jsonl_corpus(args.corpus) if args.corpus else load_repo_corpus(args.docs)
+    chars = sum(len(d) for d in docs)
+    print('=== n-gramトークナイザ ベンチマーク ===')
+    print(f'文書数: {len(docs)} / 総文字数: {chars}')
+
+    # ハッシュ版が文字列版と同じトークン集合を表していることを確認
+    for text, ids in zip(docs, batch_ngram_ids(docs)):
+        assert len(ids) == len(preprocess_func(text)), '文書内でハッシュが衝突しました'
+        assert set(ids.tolist()) == text_to_ngram_ids(text)
+
+    print(f'{"実装":<34} {"時間(ms)":>10} {"文書/秒":>12} {"M文字/秒":>10}')
+    base = measure('preprocess_func（文字列）', lambda ds: [preprocess_func(d) for d in ds], docs, chars)
+    measure('text_to_ngram_ids（参照実装）', lambda ds: [text_to_ngram_ids(d) for d in ds], docs, chars)
+    single = measure('ngram_ids（1文書ずつ）', lambda ds: [ngram_ids(d) for d in ds], docs, chars)
+    batch = measure('batch_ngram_ids（256文書ずつ）', batch_ngram_ids, docs, chars)
+    print(f'preprocess_func比: ngram_ids {base / single:.1f}倍 / batch_ngram_ids {base / batch:.1f}倍')
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+SQLite接続プロファイル（SQLITE_PROFILES）のベンチマーク
+読み取りスレッドと書き込みスレッドを同時に動かし、プロファイルごとのスループットを比較する
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.db import SQLITE_PROFILES, apply_sqlite_profile, get_db, init_master_data
+
+USER_COUNT = 20
+BONSAI_PER_USER = 5
+INITIAL_LOGS = 5000
+READER_THREADS = 8
+WRITER_THREADS = 2
+DURATION_SECONDS = 5
+
+# 盆栽一覧＋最新の農薬記録（ユーザー画面の読み取りに相当）
+READ_QUERY = '''
+    SELECT b.id, b.name, pl.date, pl.pesticide_name
+    FROM bonsai b
+    LEFT JOIN pesticide_logs pl ON pl.id = (
+        SELECT id FROM pesticide_logs
+        WHERE bonsai_id = b.id
+        ORDER BY date DESC, id DESC LIMIT 1
+    )
+    WHERE b.user_id = ?
+'''
+
+WRITE_QUERY = '''
+    INSERT INTO pesticide_logs (bonsai_id, user_id, date, pesticide_name)
+    VALUES (?, ?, ?, ?)
+'''
+
+def seed(db):
+    """ユーザー・盆栽・農薬記録を投入"""
+    init_master_data()
+    for user_id in range(1, USER_COUNT + 1):
+        for i in range(BONSAI_PER_USER):
+            db.execute('INSERT INTO bonsai (user_id, name, species, species_id) VALUES (?, ?, ?, 1)',
+                       (user_id, f'盆栽{user_id}-{i}', '黒松'))
+    bonsai = [(row['id'], row['user_id']) for row in db.execute('SELECT id, user_id FROM bonsai')]
+    today = datetime.today()
+    db.executemany(WRITE_QUERY, [
+        (*random.choice(bonsai), (today - timedelta(days=random.randint(0, 365))).strftime("%Y-%m-%d"), 'ベニカX')
+        for _ in range(INITIAL_LOGS)
+    ])
+    db.commit()
+    return bonsai
+
+def run_load(path, profile, bonsai):
+    """読み取り・書き込みスレッドを同時に実行して処理件数を数える"""
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    read_latencies = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    start_barrier = threading.Barrier(READER_THREADS + WRITER_THREADS)
+
+    def connect():
+        conn = sqlite3.connect(path)
+        return apply_sqlite_profile(conn, profile)
+
+    def reader():
+        conn = connect()
+        reads, latencies, errors = 0, [], 0
+        start_barrier.wait()
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute(READ_QUERY, (random.randint(1, USER_COUNT),)).fetchall()
+            except sqlite3.OperationalError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            reads += 1
+        conn.close()
+        with lock:
+            counts['reads'] += reads
+            counts['errors'] += errors
+            read_latencies.extend(latencies)
+
+    def writer():
+        conn = connect()
+        writes, errors = 0, 0
+        today = datetime.today().strftime("%Y-%m-%d")
+        start_barrier.wait()
+        while not stop.is_set():
+            try:
+                conn.execute(WRITE_QUERY, (*random.choice(bonsai), today, 'ベニカX'))
+                conn.commit()
+                writes += 1
+            except sqlite3.OperationalError:
+                conn.rollback()
+                errors += 1
+        conn.close()
+        with lock:
+            counts['writes'] += writes
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(READER_THREADS)]
+    threads += [threading.Thread(target=writer) for _ in range(WRITER_THREADS)]
+    for t in threads:
+        t.start()
+    time.sleep(DURATION_SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    read_latencies.sort()
+    p99 = read_latencies[int(len(read_latencies) * 0.99)] * 1000 if read_latencies else 0.0
+    return counts, p99
+
+def bench():
+    print('=== SQLite接続プロファイル ベンチマーク ===')
+    print(f'読み取り {READER_THREADS}スレッド / 書き込み {WRITER_THREADS}スレッド / 各{DURATION_SECONDS}秒')
+    print(f'{"プロファイル":<10} {"読み取り/秒":>12} {"書き込み/秒":>12} {"読み取りp99(ms)":>16} {"エラー":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in SQLITE_PROFILES:
+            path = os.path.join(tmp, f'{profile}.db')
+            app = create_app({
+                'DATABASE': path,
+                'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+                'SQLITE_PROFILE': profile,
+            })
+            with app.app_context():
+                bonsai = seed(get_db())
+
+            counts, p99 = run_load(path, profile, bonsai)
+            print(f'{profile:<10} {counts["reads"] / DURATION_SECONDS:>12.0f} '
+                  f'{counts["writes"] / DURATION_SECONDS:>12.0f} {p99:>16.2f} {counts["errors"]:>8}')
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+PDF取り込み（create_vectorstore.py）を中断した後の再開のテスト用スクリプト
+Chroma・埋め込みAPI・OCRの代わりにメモリ上の簡易な実装を使い、書き込みの途中で中断した場合に
+次回の実行でChromaとキーワードインデックスが一致した状態に戻ることを確認する
+    python test_scripts/test_ingest_resume.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'app', 'rag'))
+
+import create_vectorstore
+import keyword_index
+from batch_embedding import IngestStats
+from create_vectorstore import CreateVectorstore
+from ingest_state import KEYWORD_INDEX_REBUILD, IngestState, file_hash
+from langchain.schema.document import Document
+
+
+class Interrupted(BaseException):
+    """プロセスの強制終了の代わり（except Exceptionでは捕まえられない）"""
+
+
+class MemoryCollection:
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for id_, text, metadata in zip(ids, documents, metadatas):
+            self.rows[id_] = (text, metadata)
+
+    def _match(self, where):
+        return [id_ for id_, (_, metadata) in self.rows.items()
+                if all(metadata.get(key) == value for key, value in where.items())]
+
+    def get(self, where, include=None):
+        return {"ids": self._match(where)}
+
+    def delete(self, ids=None, where=None):
+        for id_ in ids if ids is not None else self._match(where):
+            del self.rows[id_]
+
+
+class MemoryVectorstore:
+    def __init__(self):
+        self._collection = MemoryCollection()
+
+    def get(self):
+        rows = list(self._collection.rows.values())
+        return {"documents": [text for text, _ in rows], "metadatas": [metadata for _, metadata in rows]}
+
+    def persist(self):
+        pass
+
+
+class LengthEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text))] for text in texts]
+
+
+class NoOCR:
+    def prefetch(self, path, content_hash=None):
+        return None
+
+    def close(self):
+        pass
+
+    def report(self):
+        return ""
+
+
+def make_ingester(workdir, vectorstore):
+    """APIクライアントを作らずにCreateVectorstoreを組み立てる（PDFの内容をそのままチャンクにする）"""
+    cv = CreateVectorstore.__new__(CreateVectorstore)
+    cv.vectorstore = vectorstore
+    cv.batch_embeddings = LengthEmbeddings()
+    cv.batch_size = 2
+    cv.embed_concurrency = 1
+    cv.stats = IngestStats()
+    cv.ocr = NoOCR()
+    cv.cache = None
+    cv.chunk_pool = None
+    cv.state = IngestState(os.path.join(workdir, "ingest_state.sqlite3"))
+
+    def prepare_file(file, hash_):
+        with open(os.path.join(create_vectorstore.FOLDER_PATH, file), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        return [
+            Document(page_content=line, metadata={"type": "paragraph", "filename": file, "page_number": 1,
+                                                  "image_base64": "", "file_hash": hash_})
+            for line in lines
+        ]
+    cv.prepare_file = prepare_file
+    return cv
+
+
+def write_pdf(name, lines):
+    with open(os.path.join(create_vectorstore.FOLDER_PATH, name), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def run(workdir, vectorstore, interrupt=None):
+    """1回分の取り込み。interruptを指定した場合はその処理の途中で中断する"""
+    cv = make_ingester(workdir, vectorstore)
+    try:
+        if interrupt is not None:
+            interrupt(cv)
+        cv.main(workers=1)
+    except Interrupted:
+        print("  (中断)")
+    finally:
+        create_vectorstore.append_documents = keyword_index.append_documents
+    # main()の最後で閉じられるため、確認用に開き直す
+    return IngestState(os.path.join(workdir, "ingest_state.sqlite3"))
+
+
+def check_consistent(vectorstore, state, expected_texts):
+    chroma_texts = sorted(text for text, _ in vectorstore._collection.rows.values())
+    index_texts = sorted(text for text, _ in keyword_index.iter_documents(create_vectorstore.KEYWORD_INDEX_PATH))
+    assert chroma_texts == sorted(expected_texts), chroma_texts
+    assert index_texts == chroma_texts, index_texts
+    assert not state.has_flag(KEYWORD_INDEX_REBUILD)
+
+
+def test_resume_after_interrupted_write(workdir):
+    print('=== キーワードインデックスへの追加中に中断した場合 ===')
+    vectorstore = MemoryVectorstore()
+    write_pdf("a.pdf", ["松の芽切り", "黒松の剪定", "水やりの回数"])
+
+    def interrupt_append(cv):
+        # セグメントのディレクトリを作った直後に中断する
+        def append(texts, metadatas, path):
+            manifest = keyword_index._read_manifest(path)
+            os.makedirs(os.path.join(path, keyword_index._next_segment_name(manifest)[0]))
+            raise Interrupted()
+        create_vectorstore.append_documents = append
+
+    hash_ = file_hash(os.path.join(create_vectorstore.FOLDER_PATH, "a.pdf"))
+    state = run(workdir, vectorstore, interrupt_append)
+    assert not state.is_done(hash_)
+    state = run(workdir, vectorstore)
+    assert state.is_done(hash_)
+    check_consistent(vectorstore, state, ["松の芽切り", "黒松の剪定", "水やりの回数"])
+    print('✅ 再実行で書き込み直し、Chromaとキーワードインデックスが一致しました')
+    return vectorstore
+
+
+def test_resume_after_interrupted_rebuild(workdir, vectorstore):
+    print('=== 内容が変わったPDFの取り込み後、キーワードインデックスの作り直しの前に中断した場合 ===')
+    write_pdf("a.pdf", ["松の芽摘み", "肥料の時期"])
+
+    def interrupt_rebuild(cv):
+        def rebuild():
+            raise Interrupted()
+        cv.rebuild_keyword_index = rebuild
+
+    state = run(workdir, vectorstore, interrupt_rebuild)
+    assert state.has_flag(KEYWORD_INDEX_REBUILD)
+    state = run(workdir, vectorstore)
+    check_consistent(vectorstore, state, ["松の芽摘み", "肥料の時期"])
+    print('✅ 次回の実行でキーワードインデックスを作り直しました')
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    try:
+        create_vectorstore.FOLDER_PATH = os.path.join(workdir, "input") + os.sep
+        create_vectorstore.PROCESSED_FILES_TXT = os.path.join(workdir, "processed_files.txt")
+        create_vectorstore.KEYWORD_INDEX_PATH = os.path.join(workdir, "keyword_index")
+        os.makedirs(create_vectorstore.FOLDER_PATH)
+        vectorstore = test_resume_after_interrupted_write(workdir)
+        test_resume_after_interrupted_rebuild(workdir, vectorstore)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()